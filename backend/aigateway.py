@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+
+class AIUnavailable(Exception):
+    pass
+
+
+class LlmProvider(ABC):
+    @abstractmethod
+    async def complete(self, system_message: str, prompt: str) -> str: ...
+
+
+class EmergentProvider(LlmProvider):
+    def __init__(self, api_key: str, provider: str = "openai", model: str = "gpt-4o-mini"):
+        self.api_key = api_key
+        self.provider = provider
+        self.model = model
+
+    async def complete(self, system_message: str, prompt: str) -> str:
+        chat = LlmChat(api_key=self.api_key, session_id=f"gw_{uuid.uuid4()}", system_message=system_message).with_model(self.provider, self.model)
+        return await chat.send_message(UserMessage(text=prompt))
+
+
+class FakeProvider(LlmProvider):
+    """Local stand-in for tests and development: echoes the prompt after `delay` seconds."""
+
+    def __init__(self, reply: Optional[str] = None, delay: float = 0.0, fail: bool = False):
+        self.reply = reply
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def complete(self, system_message: str, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("fake provider down")
+        return self.reply if self.reply is not None else f"[fake] {prompt.splitlines()[0]}"
+
+
+def create_provider(name: str, api_key: Optional[str]) -> LlmProvider:
+    if name == 'fake':
+        return FakeProvider(delay=0.05)
+    if name == 'emergent':
+        return EmergentProvider(api_key)
+    raise ValueError(f"Unknown AI provider: {name}")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return ' '.join(value.casefold().split())
+    if isinstance(value, dict):
+        return {str(k).casefold(): _normalize(v) for k, v in value.items() if v not in (None, '', [], {})}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_key(kind: str, fields: Dict[str, Any]) -> str:
+    """Cache key of an AI request: case, whitespace, field order and empty fields don't matter."""
+    canonical = json.dumps([kind, _normalize(fields)], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class AIGateway:
+    """Front for all LLM calls: LRU+TTL response cache, in-flight deduplication, a concurrency cap and timeouts.
+
+    Failures, timeouts and a saturated upstream surface as `AIUnavailable` so callers can fall back.
+    """
+
+    def __init__(self, provider: LlmProvider, max_concurrency: int = 4, timeout: float = 20.0,
+                 cache_size: int = 1000, cache_ttl: float = 86400.0):
+        self.provider = provider
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.cache: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "upstream_calls": 0, "timeouts": 0, "errors": 0}
+
+    def cached(self, key: str) -> Optional[str]:
+        entry = self.cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.cache.pop(key, None)
+            return None
+        self.cache.move_to_end(key)
+        return entry[1]
+
+    def store(self, key: str, value: str) -> None:
+        self.cache[key] = (time.monotonic() + self.cache_ttl, value)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def complete(self, key: str, system_message: str, prompt: str) -> Tuple[str, bool]:
+        """Returns (text, from_cache)."""
+        value = self.cached(key)
+        if value is not None:
+            self.stats['hits'] += 1
+            return value, True
+        self.stats['misses'] += 1
+        pending = self.inflight.get(key)
+        if pending is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(pending), False
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await asyncio.wait_for(self._call(system_message, prompt), self.timeout)
+        except (Exception, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats['timeouts'] += 1
+            elif not isinstance(e, asyncio.CancelledError):
+                self.stats['errors'] += 1
+            error = AIUnavailable(str(e) or type(e).__name__)
+            future.set_exception(error)
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise error from e
+        finally:
+            del self.inflight[key]
+        self.store(key, value)
+        future.set_result(value)
+        return value, False
+
+    async def _call(self, system_message: str, prompt: str) -> str:
+        async with self.semaphore:
+            self.stats['upstream_calls'] += 1
+            return await self.provider.complete(system_message, prompt)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "cached": len(self.cache), "inflight": len(self.inflight)}
@@ -0,0 +1,171 @@
+import gzip
+import hashlib
+import json
+
+# Bump when the catalog changes shape or content; it is part of the ETag
+CATALOG_VERSION = 1
+
+CATEGORIES = [
+    {
+        "id": "cars",
+        "name": "Autos",
+        "name_de": "Autos",
+        "icon": "car",
+        "fields": [
+            {"name": "brand", "label": "Marke", "type": "select", "options": ["Audi", "BMW", "Mercedes-Benz", "Volkswagen", "Opel", "Ford", "Toyota", "Honda", "Nissan", "Mazda", "Hyundai", "Kia", "Peugeot", "Renault", "Fiat", "Volvo", "Skoda", "Seat", "Porsche", "Tesla", "Andere"]},
+            {"name": "model", "label": "Modell", "type": "select_dynamic", "options": {
+                "Audi": ["A1", "A3", "A4", "A5", "A6", "A7", "A8", "Q2", "Q3", "Q5", "Q7", "Q8", "TT", "R8", "e-tron"],
+                "BMW": ["1er", "2er", "3er", "4er", "5er", "6er", "7er", "8er", "X1", "X2", "X3", "X4", "X5", "X6", "X7", "Z4", "i3", "i4", "iX"],
+                "Mercedes-Benz": ["A-Klasse", "B-Klasse", "C-Klasse", "E-Klasse", "S-Klasse", "GLA", "GLB", "GLC", "GLE", "GLS", "CLA", "CLS", "AMG GT", "EQC", "EQS"],
+                "Volkswagen": ["Polo", "Golf", "Passat", "Tiguan", "Touareg", "T-Roc", "T-Cross", "Arteon", "ID.3", "ID.4", "ID.5"],
+                "Opel": ["Corsa", "Astra", "Insignia", "Mokka", "Crossland", "Grandland"],
+                "Ford": ["Fiesta", "Focus", "Mondeo", "Kuga", "Puma", "Explorer", "Mustang"],
+                "Toyota": ["Aygo", "Yaris", "Corolla", "Camry", "RAV4", "Highlander", "C-HR", "Prius"],
+                "Honda": ["Jazz", "Civic", "Accord", "CR-V", "HR-V"],
+                "Nissan": ["Micra", "Juke", "Qashqai", "X-Trail", "Leaf"],
+                "Mazda": ["2", "3", "6", "CX-3", "CX-5", "CX-30", "MX-5"],
+                "Andere": []
+            }},
+            {"name": "year", "label": "Baujahr", "type": "number"},
+            {"name": "mileage", "label": "Kilometerstand", "type": "number"},
+            {"name": "fuel_type", "label": "Kraftstoffart", "type": "select", "options": ["Benzin", "Diesel", "Elektro", "Hybrid", "Plug-in-Hybrid", "Erdgas (CNG)", "Autogas (LPG)"]},
+            {"name": "transmission", "label": "Getriebe", "type": "select", "options": ["Automatik", "Manuell", "Halbautomatik"]},
+            {"name": "power", "label": "Leistung (PS)", "type": "number"},
+            {"name": "doors", "label": "Türen", "type": "select", "options": ["2/3", "4/5", "6/7"]},
+            {"name": "seats", "label": "Sitze", "type": "number"},
+            {"name": "color", "label": "Farbe", "type": "select", "options": ["Schwarz", "Weiß", "Silber", "Grau", "Blau", "Rot", "Grün", "Gelb", "Braun", "Beige", "Orange", "Andere"]},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Neuwertig", "Gebraucht", "Beschädigt"]}
+        ]
+    },
+    {
+        "id": "electronics",
+        "name": "Elektronik",
+        "name_de": "Elektronik",
+        "icon": "laptop",
+        "fields": [
+            {"name": "category", "label": "Kategorie", "type": "select", "options": ["Smartphones", "Tablets", "Laptops", "Desktop-PCs", "Monitore", "Drucker", "Kameras", "TV & Audio", "Smart Home", "Zubehör", "Andere"]},
+            {"name": "brand", "label": "Marke", "type": "select", "options": ["Apple", "Samsung", "Huawei", "Xiaomi", "Sony", "LG", "Lenovo", "HP", "Dell", "Asus", "Acer", "Microsoft", "Canon", "Nikon", "Bose", "JBL", "Philips", "Andere"]},
+            {"name": "model", "label": "Modell", "type": "text"},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Sehr gut", "Gut", "Akzeptabel", "Defekt"]},
+            {"name": "warranty", "label": "Garantie", "type": "select", "options": ["Mit Garantie", "Ohne Garantie"]},
+            {"name": "storage", "label": "Speicher", "type": "text"},
+            {"name": "color", "label": "Farbe", "type": "text"}
+        ]
+    },
+    {
+        "id": "real_estate",
+        "name": "Immobilien",
+        "name_de": "Immobilien",
+        "icon": "home",
+        "fields": [
+            {"name": "property_type", "label": "Immobilientyp", "type": "select", "options": ["Wohnung", "Haus", "Villa", "Grundstück", "Gewerbeimmobilie", "Büro", "Garage/Stellplatz", "Andere"]},
+            {"name": "listing_type", "label": "Angebotstyp", "type": "select", "options": ["Zu verkaufen", "Zu vermieten", "Zwischenmiete"]},
+            {"name": "area", "label": "Wohnfläche (m²)", "type": "number"},
+            {"name": "plot_area", "label": "Grundstücksfläche (m²)", "type": "number"},
+            {"name": "bedrooms", "label": "Schlafzimmer", "type": "number"},
+            {"name": "bathrooms", "label": "Badezimmer", "type": "number"},
+            {"name": "floor", "label": "Etage", "type": "text"},
+            {"name": "year_built", "label": "Baujahr", "type": "number"},
+            {"name": "heating", "label": "Heizung", "type": "select", "options": ["Zentralheizung", "Gasheizung", "Ölheizung", "Fernwärme", "Wärmepumpe", "Elektrisch", "Keine"]},
+            {"name": "parking", "label": "Parkplatz", "type": "select", "options": ["Garage", "Stellplatz", "Tiefgarage", "Keine"]},
+            {"name": "balcony", "label": "Balkon/Terrasse", "type": "select", "options": ["Ja", "Nein"]},
+            {"name": "elevator", "label": "Aufzug", "type": "select", "options": ["Ja", "Nein"]},
+            {"name": "location", "label": "Standort", "type": "text"}
+        ]
+    },
+    {
+        "id": "furniture",
+        "name": "Möbel",
+        "name_de": "Möbel",
+        "icon": "bed",
+        "fields": [
+            {"name": "category", "label": "Kategorie", "type": "select", "options": ["Wohnzimmer", "Schlafzimmer", "Küche", "Badezimmer", "Büro", "Kinderzimmer", "Garten", "Andere"]},
+            {"name": "type", "label": "Möbeltyp", "type": "select", "options": ["Sofa", "Sessel", "Tisch", "Stuhl", "Bett", "Schrank", "Regal", "Kommode", "Andere"]},
+            {"name": "material", "label": "Material", "type": "select", "options": ["Holz", "Metall", "Kunststoff", "Glas", "Stoff", "Leder", "Andere"]},
+            {"name": "color", "label": "Farbe", "type": "text"},
+            {"name": "dimensions", "label": "Maße (L×B×H in cm)", "type": "text"},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
+        ]
+    },
+    {
+        "id": "fashion",
+        "name": "Mode",
+        "name_de": "Mode",
+        "icon": "shirt",
+        "fields": [
+            {"name": "category", "label": "Kategorie", "type": "select", "options": ["Oberbekleidung", "Hosen", "Kleider & Röcke", "Schuhe", "Accessoires", "Taschen", "Uhren", "Schmuck", "Andere"]},
+            {"name": "brand", "label": "Marke", "type": "text"},
+            {"name": "size", "label": "Größe", "type": "select", "options": ["XXS", "XS", "S", "M", "L", "XL", "XXL", "XXXL", "Andere"]},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu mit Etikett", "Neu ohne Etikett", "Wie neu", "Sehr gut", "Gut"]},
+            {"name": "gender", "label": "Geschlecht", "type": "select", "options": ["Herren", "Damen", "Unisex", "Kinder"]},
+            {"name": "color", "label": "Farbe", "type": "text"},
+            {"name": "material", "label": "Material", "type": "text"}
+        ]
+    },
+    {
+        "id": "sports",
+        "name": "Sport & Freizeit",
+        "name_de": "Sport & Freizeit",
+        "icon": "football",
+        "fields": [
+            {"name": "category", "label": "Kategorie", "type": "select", "options": ["Fitnessgeräte", "Fahrräder", "Camping & Outdoor", "Wintersport", "Wassersport", "Ballsport", "Sportbekleidung", "Andere"]},
+            {"name": "brand", "label": "Marke", "type": "text"},
+            {"name": "type", "label": "Typ", "type": "text"},
+            {"name": "size", "label": "Größe", "type": "text"},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
+        ]
+    },
+    {
+        "id": "garden",
+        "name": "Garten & Heimwerk",
+        "name_de": "Garten & Heimwerk",
+        "icon": "hammer",
+        "fields": [
+            {"name": "category", "label": "Kategorie", "type": "select", "options": ["Gartengeräte", "Pflanzen", "Gartenmöbel", "Werkzeuge", "Baumaterial", "Andere"]},
+            {"name": "brand", "label": "Marke", "type": "text"},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
+        ]
+    },
+    {
+        "id": "other",
+        "name": "Sonstiges",
+        "name_de": "Sonstiges",
+        "icon": "apps",
+        "fields": [
+            {"name": "type", "label": "Typ", "type": "text"},
+            {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Gebraucht"]}
+        ]
+    }
+]
+
+
+def _category_ids() -> dict:
+    ids = {}
+    for category in CATEGORIES:
+        for name in (category['id'], category['name'], category['name_de']):
+            ids.setdefault(name.casefold(), category['id'])
+    return ids
+
+
+CATEGORY_IDS = _category_ids()
+
+
+def category_id(value: str) -> str:
+    """Catalog id for a category given by id or display name ("Autos" -> "cars"); unknown values are returned as-is."""
+    return CATEGORY_IDS.get(' '.join(value.split()).casefold(), value)
+
+
+class SerializedCatalog:
+    """The category catalog encoded once: JSON and gzip bodies with one strong ETag per encoding."""
+
+    def __init__(self, categories: list, version: int = CATALOG_VERSION):
+        self.version = version
+        self.body = json.dumps(categories, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:16]
+        self.etag = f'"categories-v{version}-{digest}"'
+        self.gzip_etag = f'"categories-v{version}-{digest}-gzip"'
+
+
+def load_catalog() -> SerializedCatalog:
+    return SerializedCatalog(CATEGORIES)
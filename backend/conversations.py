@@ -0,0 +1,192 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, UpdateOne
+
+PREVIEW_LENGTH = 50
+
+
+class InvalidMessageCursor(ValueError):
+    pass
+
+
+def _other_user_expr(user_id: str) -> dict:
+    return {"$cond": [{"$eq": ["$from_user_id", user_id]}, "$to_user_id", "$from_user_id"]}
+
+
+async def record_message(db, message: dict) -> None:
+    """Update both participants' rows in the materialized `conversations` collection."""
+    last = {"last_message": message['content'][:PREVIEW_LENGTH], "last_message_time": message['created_at']}
+    await db.conversations.bulk_write([
+        UpdateOne(
+            {"user_id": message['from_user_id'], "other_user_id": message['to_user_id'], "listing_id": message['listing_id']},
+            {"$set": last, "$setOnInsert": {"unread_count": 0}},
+            upsert=True
+        ),
+        UpdateOne(
+            {"user_id": message['to_user_id'], "other_user_id": message['from_user_id'], "listing_id": message['listing_id']},
+            {"$set": last, "$inc": {"unread_count": 1}},
+            upsert=True
+        ),
+    ], ordered=False)
+
+
+async def mark_conversation_read(db, user_id: str, other_user_id: str, listing_id: str, marked: int) -> None:
+    """Reset the conversation after `marked` messages were flagged as read."""
+    await db.conversations.update_one(
+        {"user_id": user_id, "other_user_id": other_user_id, "listing_id": listing_id},
+        {"$set": {"unread_count": 0}}
+    )
+    if marked:
+        await db.unread_counters.update_one(
+            {"user_id": user_id},
+            {"$inc": {"total": -marked, f"by_conversation.{conversation_key(listing_id, other_user_id)}": -marked}}
+        )
+
+
+# Per-user unread counters: {user_id, total, by_conversation: {"<listing_id>:<other_user_id>": n}}
+def conversation_key(listing_id: str, other_user_id: str) -> str:
+    return f"{listing_id}:{other_user_id}"
+
+
+async def increment_unread(db, message: dict) -> None:
+    key = conversation_key(message['listing_id'], message['from_user_id'])
+    await db.unread_counters.update_one(
+        {"user_id": message['to_user_id']},
+        {"$inc": {"total": 1, f"by_conversation.{key}": 1}},
+        upsert=True
+    )
+
+
+async def uncount_unread(db, messages: List[dict]) -> List[str]:
+    """Take deleted `messages` out of their recipients' unread counters. Returns the recipients changed."""
+    counts = Counter((m['to_user_id'], conversation_key(m['listing_id'], m['from_user_id'])) for m in messages if m.get('read') is False)
+    decrements = {}
+    for (user_id, key), n in counts.items():
+        decrements.setdefault(user_id, {"total": 0})
+        decrements[user_id]['total'] -= n
+        decrements[user_id][f"by_conversation.{key}"] = -n
+    if decrements:
+        await db.unread_counters.bulk_write([UpdateOne({"user_id": user_id}, {"$inc": inc}) for user_id, inc in decrements.items()], ordered=False)
+    return list(decrements)
+
+
+async def get_unread_total(db, user_id: str) -> int:
+    counter = await db.unread_counters.find_one({"user_id": user_id}, {"_id": 0, "total": 1})
+    return max(counter['total'], 0) if counter else 0
+
+
+async def reconcile_unread_counters(db) -> int:
+    """Recompute every user's unread counters from `messages`. Returns the number of users with unread messages."""
+    pipeline = [
+        {"$match": {"read": False}},
+        {"$group": {"_id": {"user_id": "$to_user_id", "listing_id": "$listing_id", "from_user_id": "$from_user_id"}, "count": {"$sum": 1}}},
+    ]
+    counters = {}
+    async for row in db.messages.aggregate(pipeline, allowDiskUse=True):
+        key = row['_id']
+        counter = counters.setdefault(key['user_id'], {"user_id": key['user_id'], "total": 0, "by_conversation": {}})
+        counter['total'] += row['count']
+        counter['by_conversation'][conversation_key(key['listing_id'], key['from_user_id'])] = row['count']
+    if counters:
+        await db.unread_counters.bulk_write([ReplaceOne({"user_id": user_id}, counter, upsert=True) for user_id, counter in counters.items()], ordered=False)
+    await db.unread_counters.delete_many({"user_id": {"$nin": list(counters)}})
+    return len(counters)
+
+
+async def aggregate_conversations(db, user_id: str, limit: int = 100) -> List[dict]:
+    """Compute a user's conversations straight from `messages` in one pipeline."""
+    pipeline = [
+        {"$match": {"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]}},
+        {"$sort": {"created_at": -1}},
+        {"$group": {
+            "_id": {"other_user_id": _other_user_expr(user_id), "listing_id": "$listing_id"},
+            "last_message": {"$first": "$content"},
+            "last_message_time": {"$first": "$created_at"},
+            "unread_count": {"$sum": {"$cond": [{"$and": [{"$eq": ["$to_user_id", user_id]}, {"$eq": ["$read", False]}]}, 1, 0]}},
+        }},
+        {"$sort": {"last_message_time": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "other_user_id": "$_id.other_user_id",
+            "listing_id": "$_id.listing_id",
+            "last_message": {"$substrCP": ["$last_message", 0, PREVIEW_LENGTH]},
+            "last_message_time": 1,
+            "unread_count": 1,
+        }},
+    ]
+    return await db.messages.aggregate(pipeline).to_list(limit)
+
+
+async def rebuild_conversations(db) -> None:
+    """Recompute the whole `conversations` collection from `messages` (backfill / repair)."""
+    pipeline = [
+        {"$sort": {"created_at": -1}},
+        {"$project": {"sides": [
+            {"user_id": "$from_user_id", "other_user_id": "$to_user_id", "listing_id": "$listing_id",
+             "content": "$content", "created_at": "$created_at", "unread": {"$literal": 0}},
+            {"user_id": "$to_user_id", "other_user_id": "$from_user_id", "listing_id": "$listing_id",
+             "content": "$content", "created_at": "$created_at", "unread": {"$cond": [{"$eq": ["$read", False]}, 1, 0]}},
+        ]}},
+        {"$unwind": "$sides"},
+        {"$replaceRoot": {"newRoot": "$sides"}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "other_user_id": "$other_user_id", "listing_id": "$listing_id"},
+            "last_message": {"$first": "$content"},
+            "last_message_time": {"$first": "$created_at"},
+            "unread_count": {"$sum": "$unread"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "other_user_id": "$_id.other_user_id",
+            "listing_id": "$_id.listing_id",
+            "last_message": {"$substrCP": ["$last_message", 0, PREVIEW_LENGTH]},
+            "last_message_time": 1,
+            "unread_count": 1,
+        }},
+        {"$merge": {"into": "conversations", "on": ["user_id", "other_user_id", "listing_id"], "whenMatched": "merge", "whenNotMatched": "insert"}},
+    ]
+    await db.messages.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+def thread_query(listing_id: str, user_id: str, other_user_id: str) -> dict:
+    return {"listing_id": listing_id, "$or": [
+        {"from_user_id": user_id, "to_user_id": other_user_id},
+        {"from_user_id": other_user_id, "to_user_id": user_id},
+    ]}
+
+
+async def _position(db, thread: dict, value: str, operator: str) -> dict:
+    """Keyset condition for messages after ($gt) or before ($lt) a message id or an ISO timestamp."""
+    try:
+        stamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        message = await db.messages.find_one({**thread, "id": value}, {"_id": 0, "created_at": 1, "id": 1})
+        if not message:
+            raise InvalidMessageCursor("Unbekannte Nachricht")
+        return {"$or": [{"created_at": {operator: message['created_at']}}, {"created_at": message['created_at'], "id": {operator: message['id']}}]}
+    if stamp.tzinfo:
+        stamp = stamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {"created_at": {operator: stamp}}
+
+
+async def thread_messages(db, listing_id: str, user_id: str, other_user_id: str, projection: dict,
+                          since: Optional[str] = None, before: Optional[str] = None, limit: int = 50) -> List[dict]:
+    """Up to `limit` messages of a thread, oldest first.
+
+    Without cursors these are the newest messages; `before` pages back through history and `since`
+    returns only what is newer than the client's last message, starting right after it.
+    """
+    thread = thread_query(listing_id, user_id, other_user_id)
+    conditions = [thread]
+    if since:
+        conditions.append(await _position(db, thread, since, "$gt"))
+    if before:
+        conditions.append(await _position(db, thread, before, "$lt"))
+    query = {"$and": conditions} if len(conditions) > 1 else thread
+    direction = ASCENDING if since and not before else DESCENDING
+    messages = await db.messages.find(query, projection).sort([("created_at", direction), ("id", direction)]).limit(limit).to_list(limit)
+    return messages if direction == ASCENDING else messages[::-1]
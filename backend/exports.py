@@ -0,0 +1,119 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+import orjson
+
+from models import Listing, SupportTicket, User
+from pagination import KEYSET_SORT, cursor_query, encode_cursor
+
+EXPORT_BATCH_SIZE = 1000
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+class ExportError(ValueError):
+    pass
+
+
+# name -> collection, exportable fields, default fields, filterable fields
+EXPORTS: Dict[str, dict] = {
+    "users": {
+        "collection": "users",
+        "fields": list(User.model_fields),
+        "default_fields": [f for f in User.model_fields if f != 'profile_image'],
+        "filters": ["role"],
+    },
+    "listings": {
+        "collection": "listings",
+        "fields": [f for f in Listing.model_fields if f != 'distance_km'],
+        "default_fields": [f for f in Listing.model_fields if f not in ('images', 'videos', 'distance_km')],
+        "filters": ["category", "seller_id"],
+    },
+    "support": {
+        "collection": "support_tickets",
+        "fields": list(SupportTicket.model_fields),
+        "default_fields": list(SupportTicket.model_fields),
+        "filters": ["status", "user_id"],
+    },
+}
+
+
+def export_fields(spec: dict, fields: Optional[str]) -> List[str]:
+    if not fields:
+        return spec['default_fields']
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in spec['fields']]
+    if unknown:
+        raise ExportError(f"Unbekannte Felder: {', '.join(unknown)}")
+    # id and created_at identify the resume position, so every row carries them
+    return list(dict.fromkeys(['id', 'created_at', *requested]))
+
+
+def export_query(spec: dict, params: Dict[str, str], created_after: Optional[datetime], created_before: Optional[datetime]) -> dict:
+    query = {name: params[name] for name in spec['filters'] if params.get(name)}
+    created = {}
+    if created_after:
+        created['$gte'] = created_after
+    if created_before:
+        created['$lt'] = created_before
+    if created:
+        query['created_at'] = created
+    return query
+
+
+async def resume_cursor(collection, cursor: Optional[str], after_id: Optional[str]) -> Optional[str]:
+    """The keyset cursor to continue from: an explicit token, or the position of the last row received."""
+    if cursor or not after_id:
+        return cursor
+    last = await collection.find_one({"id": after_id}, {"_id": 0, "id": 1, "created_at": 1})
+    if not last:
+        raise ExportError("Unbekannte Position zum Fortsetzen")
+    return encode_cursor(last['created_at'], last['id'])
+
+
+def open_cursor(collection, query: dict, fields: List[str], cursor: Optional[str], batch_size: int = EXPORT_BATCH_SIZE):
+    projection = {"_id": 0, **{f: 1 for f in fields}}
+    return collection.find(cursor_query(query, cursor), projection).sort(KEYSET_SORT).batch_size(batch_size)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode('utf-8')
+    return value
+
+
+async def encode_rows(docs: AsyncIterator[dict], fields: List[str], fmt: str, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Encode documents as NDJSON or CSV, one chunk per `batch_size` rows; only one chunk is held at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(fields)
+    lines: List[bytes] = []
+    count = 0
+    async for doc in docs:
+        if fmt == 'csv':
+            writer.writerow([_csv_value(doc.get(f)) for f in fields])
+        else:
+            lines.append(orjson.dumps({f: doc.get(f) for f in fields}))
+        count += 1
+        if count % batch_size == 0:
+            yield _flush(buffer, lines, fmt)
+    chunk = _flush(buffer, lines, fmt)
+    if chunk:
+        yield chunk
+
+
+def _flush(buffer: io.StringIO, lines: List[bytes], fmt: str) -> bytes:
+    if fmt == 'csv':
+        chunk = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+    chunk = b''.join(line + b'\n' for line in lines)
+    lines.clear()
+    return chunk
@@ -0,0 +1,156 @@
+import math
+import re
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from catalog import CATEGORIES
+from fastjson import pipeline_projection
+from pagination import KEYSET_SORT, cursor_query
+
+FACET_SEARCH_CANDIDATES = 1000  # text matches considered when a search is combined with facets
+FACET_TYPES = {"select": "select", "select_dynamic": "select", "number": "number"}
+# Listing query parameters; a category field with one of these names is filtered as field_<name>
+RESERVED_PARAMS = frozenset({"category", "search", "view", "skip", "limit", "cursor", "lat", "lng", "near", "radius_km"})
+
+
+class FacetError(ValueError):
+    pass
+
+
+def _facet_fields() -> Dict[str, List[dict]]:
+    fields = {}
+    for category in CATEGORIES:
+        fields[category['id']] = [
+            {"name": f['name'], "label": f['label'], "type": FACET_TYPES[f['type']],
+             "param": f"field_{f['name']}" if f['name'] in RESERVED_PARAMS else f['name'],
+             "options": _options(f.get('options'))}
+            for f in category['fields'] if f['type'] in FACET_TYPES
+        ]
+    return fields
+
+
+def _options(options) -> List[str]:
+    if isinstance(options, dict):  # select_dynamic: options per brand
+        return list(dict.fromkeys(o for values in options.values() for o in values))
+    return list(options or [])
+
+
+FACET_FIELDS = _facet_fields()
+
+
+def parse_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(' ', '')
+        # German notation: "150.000" thousands separators, "1,5" decimal comma
+        value = value.replace('.', '') if re.fullmatch(r'-?\d{1,3}(\.\d{3})+', value) else value.replace(',', '.')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def _option(field: dict, value: Any) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    value = ' '.join(str(value).split())
+    if not value:
+        return None
+    # Stored and filtered as the catalog's spelling, so "bmw" and "BMW" are one facet value
+    return next((o for o in field['options'] if o.casefold() == value.casefold()), value)
+
+
+def listing_attributes(category: str, category_fields: Optional[dict]) -> Dict[str, Any]:
+    """Typed copy of the filterable category fields: catalog spelling for selects, numbers for number fields."""
+    attributes = {}
+    for field in FACET_FIELDS.get(category, []):
+        raw = (category_fields or {}).get(field['name'])
+        value = parse_number(raw) if field['type'] == 'number' else _option(field, raw)
+        if value is not None:
+            attributes[field['name']] = value
+    return attributes
+
+
+def parse_facet_filters(category: Optional[str], params: Mapping) -> Dict[str, Any]:
+    """Mongo conditions on `attributes` for the facet parameters: `<field>=` (repeatable) and `<field>_min`/`_max`."""
+    filters = {}
+    for field in FACET_FIELDS.get(category, []) if category else []:
+        path = f"attributes.{field['name']}"
+        if field['type'] == 'select':
+            values = [v for raw in params.getlist(field['param']) for v in [_option(field, raw)] if v]
+            if values:
+                filters[path] = values[0] if len(values) == 1 else {"$in": values}
+            continue
+        condition = {}
+        for suffix, operator in (("_min", "$gte"), ("_max", "$lte")):
+            raw = params.get(field['param'] + suffix)
+            if raw in (None, ''):
+                continue
+            number = parse_number(raw)
+            if number is None:
+                raise FacetError(f"Ungültiger Wert für {field['param']}{suffix}")
+            condition[operator] = number
+        if condition:
+            filters[path] = condition
+    return filters
+
+
+def facet_pipeline(category: str, base: dict, filters: Dict[str, dict], projection: dict,
+                   cursor: Optional[str], skip: int, limit: int) -> list:
+    """One aggregation returning the page, the total, the counts per option and the number ranges.
+
+    The page and the total honour every filter. Each facet is counted with every filter except its
+    own (multi-select): with brand=BMW selected the brand facet still lists the other brands, while
+    the fuel types are those of the BMWs. The leading $match holds the category and `base`, so the
+    partial per-category indexes apply.
+    """
+    facets = {
+        "items": [{"$match": {**filters, **cursor_query({}, cursor)}}, {"$sort": dict(KEYSET_SORT)}, {"$skip": skip}, {"$limit": limit},
+                  {"$project": pipeline_projection(projection)}],
+        "total": [{"$match": filters}, {"$count": "n"}],
+    }
+    for field in FACET_FIELDS[category]:
+        path = f"attributes.{field['name']}"
+        others = {key: condition for key, condition in filters.items() if key != path}
+        if field['type'] == 'select':
+            facets[field['name']] = [{"$match": {**others, path: {"$exists": True}}},
+                                     {"$group": {"_id": f"${path}", "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+        else:
+            facets[field['name']] = [{"$match": others}, {"$group": {"_id": None, "min": {"$min": f"${path}"}, "max": {"$max": f"${path}"}}}]
+    return [{"$match": {"category": category, **base}}, {"$facet": facets}]
+
+
+def facet_result(category: str, result: dict) -> Tuple[List[dict], int, List[dict]]:
+    """(items, total, facets) from the single document `facet_pipeline` returns."""
+    total = result['total'][0]['n'] if result['total'] else 0
+    facets = []
+    for field in FACET_FIELDS[category]:
+        facet = {"name": field['name'], "label": field['label'], "type": field['type'], "param": field['param']}
+        if field['type'] == 'select':
+            facet['counts'] = [{"value": row['_id'], "count": row['count']} for row in result[field['name']]]
+        else:
+            bounds = result[field['name']][0] if result[field['name']] else {}
+            facet.update({"min": bounds.get('min'), "max": bounds.get('max')})
+        facets.append(facet)
+    return result['items'], total, facets
+
+
+async def backfill_listing_attributes(db, batch_size: int = 1000) -> int:
+    """Recompute `attributes` of every listing from its category fields. Returns the number of listings changed."""
+    updated = 0
+    operations = []
+    async for listing in db.listings.find({}, {"_id": 1, "category": 1, "category_fields": 1, "attributes": 1}):
+        attributes = listing_attributes(listing.get('category'), listing.get('category_fields'))
+        if attributes != listing.get('attributes'):
+            operations.append(UpdateOne({"_id": listing['_id']}, {"$set": {"attributes": attributes}}))
+        if len(operations) >= batch_size:
+            updated += (await db.listings.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await db.listings.bulk_write(operations, ordered=False)).modified_count
+    return updated
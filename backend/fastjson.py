@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Type
+
+import orjson
+from starlette.responses import Response  # what fastapi.Response is, without importing fastapi
+from pydantic import BaseModel
+
+_REQUIRED = object()
+
+
+@lru_cache(maxsize=None)
+def schema_fields(model: Type[BaseModel]) -> Tuple[Tuple[str, Callable[[], Any]], ...]:
+    """(field name, default factory) for every field of `model`; required fields map to _REQUIRED."""
+    fields = []
+    for name, field in model.model_fields.items():
+        if field.is_required():
+            fields.append((name, lambda: _REQUIRED))
+        elif field.default_factory is not None:
+            fields.append((name, field.default_factory))
+        else:
+            fields.append((name, lambda default=field.default: default))
+    return tuple(fields)
+
+
+def schema_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning exactly the fields of `model`."""
+    return {"_id": 0, **{name: 1 for name, _ in schema_fields(model)}}
+
+
+def pipeline_projection(projection: dict) -> dict:
+    """`projection` for a $project stage: find() slices arrays with {"$slice": n}, $project needs the expression form."""
+    return {field: {"$slice": [f"${field}", value['$slice']]} if isinstance(value, dict) and '$slice' in value else value
+            for field, value in projection.items()}
+
+
+def to_row(doc: dict, model: Type[BaseModel]) -> dict:
+    """`doc` reduced to the schema fields with model defaults filled in, without building the model.
+
+    Documents written by this backend already have the right types; anything missing a required
+    field goes through the model so the error is the same as on the regular path.
+    """
+    row = {}
+    for name, default in schema_fields(model):
+        if name in doc:
+            row[name] = doc[name]
+        else:
+            value = default()
+            if value is _REQUIRED:
+                return model(**doc).model_dump(mode='json')
+            row[name] = value
+    return row
+
+
+def dumps(rows: Any) -> bytes:
+    # Enums and datetimes serialize natively; naive datetimes stay naive as in pydantic's output
+    return orjson.dumps(rows, default=_default)
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    raise TypeError
+
+
+def rows_response(docs: Iterable[dict], model: Type[BaseModel], response: Optional[Response] = None) -> Response:
+    """JSON list response for `docs` shaped like List[model], keeping headers already set on `response`."""
+    fast = Response(dumps([to_row(doc, model) for doc in docs]), media_type="application/json")
+    if response is not None:
+        fast.raw_headers.extend(response.raw_headers)
+    return fast
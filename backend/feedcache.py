@@ -0,0 +1,179 @@
+import asyncio
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import bson
+
+FEED_CACHE_CHANNEL = "cache:feed"
+
+
+class _LoadCancelled(Exception):
+    pass
+
+
+def feed_key(category: Optional[str], view: str, limit: int) -> str:
+    return f"{category or '*'}|{view}|{limit}"
+
+
+class FeedCacheBackend(ABC):
+    shared = False  # one store for all workers, so broadcast invalidations need no local action
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[List[dict]]: ...
+
+    @abstractmethod
+    async def set(self, key: str, category: Optional[str], docs: List[dict], ttl: float) -> None: ...
+
+    @abstractmethod
+    async def drop(self, category: Optional[str]) -> None:
+        """Drop the entries of `category` and the unfiltered feed; everything if `category` is None."""
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class MemoryFeedBackend(FeedCacheBackend):
+    """Per-process LRU with expiry. Cached documents are shared and must not be mutated."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.entries: 'OrderedDict[str, Tuple[float, Optional[str], List[dict]]]' = OrderedDict()
+
+    async def get(self, key: str) -> Optional[List[dict]]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            return None
+        self.entries.move_to_end(key)
+        return entry[2]
+
+    async def set(self, key: str, category: Optional[str], docs: List[dict], ttl: float) -> None:
+        self.entries[key] = (time.monotonic() + ttl, category, docs)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def drop(self, category: Optional[str]) -> None:
+        if category is None:
+            self.entries.clear()
+            return
+        for key in [k for k, (_, c, _) in self.entries.items() if c in (None, category)]:
+            del self.entries[key]
+
+    def size(self) -> Optional[int]:
+        return len(self.entries)
+
+
+class MongoFeedBackend(FeedCacheBackend):
+    """Cache shared by all workers in the `feed_cache` collection; pages are stored BSON-encoded."""
+
+    shared = True
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, key: str) -> Optional[List[dict]]:
+        # The TTL monitor only runs once a minute, so expiry is checked here as well
+        entry = await self.db.feed_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        return bson.decode(entry['docs'])['docs'] if entry else None
+
+    async def set(self, key: str, category: Optional[str], docs: List[dict], ttl: float) -> None:
+        entry = {"category": category, "docs": bson.encode({"docs": docs}), "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}
+        await self.db.feed_cache.replace_one({"_id": key}, entry, upsert=True)
+
+    async def drop(self, category: Optional[str]) -> None:
+        await self.db.feed_cache.delete_many({} if category is None else {"category": {"$in": [None, category]}})
+
+
+def create_feed_backend(name: str, db, max_size: int) -> FeedCacheBackend:
+    if name == 'mongo':
+        return MongoFeedBackend(db)
+    if name == 'memory':
+        return MemoryFeedBackend(max_size)
+    raise ValueError(f"Unknown feed cache backend: {name}")
+
+
+class FeedCache:
+    """Short-TTL cache of the anonymous listing feed pages.
+
+    Concurrent misses for one key share a single load. `invalidate()` drops the affected entries
+    and broadcasts on `FEED_CACHE_CHANNEL` so workers with their own memory backend follow; a load
+    that started before an invalidation is served to its callers but not stored.
+    """
+
+    def __init__(self, backend: FeedCacheBackend, broker=None, ttl: float = 5.0):
+        self.backend = backend
+        self.broker = broker
+        self.ttl = ttl
+        self.generation = 0
+        self.origin = uuid.uuid4().hex
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    async def get(self, key: str, category: Optional[str], load: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        docs = await self.backend.get(key)
+        if docs is not None:
+            self.stats['hits'] += 1
+            return docs
+        self.stats['misses'] += 1
+        pending = self.inflight.get(key)
+        if pending is not None:
+            self.stats['coalesced'] += 1
+            try:
+                return await asyncio.shield(pending)
+            except _LoadCancelled:  # the request running the load went away; load for this one
+                return await load()
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        generation = self.generation
+        try:
+            docs = await load()
+        except (Exception, asyncio.CancelledError) as e:
+            future.set_exception(e if isinstance(e, Exception) else _LoadCancelled())
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            del self.inflight[key]
+        future.set_result(docs)
+        if generation == self.generation:
+            await self.backend.set(key, category, docs, self.ttl)
+        return docs
+
+    async def drop(self, category: Optional[str]) -> None:
+        self.generation += 1
+        self.stats['invalidations'] += 1
+        await self.backend.drop(category)
+
+    async def invalidate(self, category: Optional[str] = None) -> None:
+        await self.drop(category)
+        if self.broker is not None:
+            await self.broker.publish(FEED_CACHE_CHANNEL, {"origin": self.origin, "category": category})
+
+    async def listen(self) -> None:
+        """Apply invalidations broadcast by other workers until cancelled."""
+        subscription = await self.broker.subscribe(FEED_CACHE_CHANNEL)
+        try:
+            async for event in subscription:
+                if event.get('origin') != self.origin:
+                    self.generation += 1
+                    if not self.backend.shared:
+                        await self.backend.drop(event['category'])
+        finally:
+            await subscription.close()
+
+    def metrics(self) -> Dict[str, float]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            "size": self.backend.size(),
+            "inflight": len(self.inflight),
+            "hit_ratio": self.stats['hits'] / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,237 @@
+import math
+import re
+from typing import Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from fastjson import pipeline_projection
+from search import fold
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_RADIUS_KM = 25.0
+MAX_RADIUS_KM = 500.0
+GEO_SEARCH_CANDIDATES = 1000  # text matches considered when a search is restricted to a radius
+
+# City name | latitude | longitude. Offline gazetteer of the larger cities in Germany, Austria and Switzerland;
+# a name followed by "am"/"an der"/"im"/"(...)" is also found by its first part, first entry wins.
+CITIES = """
+Berlin|52.5200|13.4050
+Hamburg|53.5511|9.9937
+München|48.1372|11.5756
+Köln|50.9375|6.9603
+Frankfurt am Main|50.1109|8.6821
+Stuttgart|48.7758|9.1829
+Düsseldorf|51.2277|6.7735
+Leipzig|51.3397|12.3731
+Dortmund|51.5136|7.4653
+Essen|51.4556|7.0116
+Bremen|53.0793|8.8017
+Dresden|51.0504|13.7373
+Hannover|52.3759|9.7320
+Nürnberg|49.4521|11.0767
+Duisburg|51.4344|6.7623
+Bochum|51.4818|7.2162
+Wuppertal|51.2562|7.1508
+Bielefeld|52.0302|8.5325
+Bonn|50.7374|7.0982
+Münster|51.9607|7.6261
+Mannheim|49.4875|8.4660
+Karlsruhe|49.0069|8.4037
+Augsburg|48.3705|10.8978
+Wiesbaden|50.0782|8.2398
+Mönchengladbach|51.1805|6.4428
+Gelsenkirchen|51.5177|7.0857
+Aachen|50.7753|6.0839
+Braunschweig|52.2689|10.5268
+Kiel|54.3233|10.1228
+Chemnitz|50.8278|12.9214
+Halle (Saale)|51.4969|11.9688
+Magdeburg|52.1205|11.6276
+Freiburg im Breisgau|47.9990|7.8421
+Krefeld|51.3388|6.5853
+Mainz|49.9929|8.2473
+Lübeck|53.8655|10.6866
+Erfurt|50.9848|11.0299
+Oberhausen|51.4963|6.8638
+Rostock|54.0924|12.0991
+Kassel|51.3127|9.4797
+Hagen|51.3671|7.4633
+Potsdam|52.3906|13.0645
+Saarbrücken|49.2402|6.9969
+Hamm|51.6739|7.8150
+Ludwigshafen am Rhein|49.4774|8.4452
+Mülheim an der Ruhr|51.4186|6.8845
+Oldenburg|53.1435|8.2146
+Osnabrück|52.2799|8.0472
+Leverkusen|51.0459|6.9853
+Darmstadt|49.8728|8.6512
+Heidelberg|49.3988|8.6724
+Solingen|51.1652|7.0671
+Herne|51.5369|7.2009
+Neuss|51.2042|6.6879
+Regensburg|49.0134|12.1016
+Paderborn|51.7189|8.7575
+Ingolstadt|48.7665|11.4258
+Offenbach am Main|50.0956|8.7761
+Würzburg|49.7913|9.9534
+Fürth|49.4771|10.9887
+Ulm|48.4011|9.9876
+Heilbronn|49.1427|9.2109
+Pforzheim|48.8922|8.6946
+Wolfsburg|52.4227|10.7865
+Göttingen|51.5413|9.9158
+Bottrop|51.5247|6.9229
+Reutlingen|48.4914|9.2043
+Koblenz|50.3569|7.5890
+Bremerhaven|53.5396|8.5809
+Recklinghausen|51.6141|7.1979
+Erlangen|49.5897|11.0040
+Bergisch Gladbach|50.9918|7.1366
+Jena|50.9271|11.5892
+Remscheid|51.1798|7.1925
+Trier|49.7499|6.6371
+Salzgitter|52.1508|10.3593
+Moers|51.4516|6.6408
+Siegen|50.8748|8.0243
+Hildesheim|52.1508|9.9511
+Cottbus|51.7563|14.3329
+Gütersloh|51.9032|8.3858
+Kaiserslautern|49.4401|7.7491
+Schwerin|53.6355|11.4012
+Witten|51.4436|7.3528
+Gera|50.8765|12.0826
+Iserlohn|51.3750|7.6950
+Zwickau|50.7189|12.4961
+Düren|50.8048|6.4932
+Esslingen am Neckar|48.7406|9.3108
+Ratingen|51.2973|6.8493
+Flensburg|54.7937|9.4469
+Lünen|51.6166|7.5254
+Konstanz|47.6603|9.1758
+Marl|51.6567|7.0901
+Worms|49.6341|8.3507
+Villingen-Schwenningen|48.0623|8.4936
+Neubrandenburg|53.5568|13.2610
+Bamberg|49.8988|10.9028
+Bayreuth|49.9456|11.5713
+Passau|48.5665|13.4312
+Rosenheim|47.8571|12.1181
+Landshut|48.5442|12.1469
+Stralsund|54.3091|13.0818
+Greifswald|54.0865|13.3923
+Frankfurt (Oder)|52.3471|14.5506
+Wien|48.2082|16.3738
+Graz|47.0707|15.4395
+Linz|48.3069|14.2858
+Salzburg|47.8095|13.0550
+Innsbruck|47.2692|11.4041
+Zürich|47.3769|8.5417
+Basel|47.5596|7.5886
+Bern|46.9480|7.4474
+"""
+
+
+class GeoError(ValueError):
+    pass
+
+
+def place_key(name: str) -> str:
+    # "Muenchen" and "München" both become "munchen"
+    name = fold(name).replace('ae', 'a').replace('oe', 'o').replace('ue', 'u')
+    name = re.sub(r'^\d{4,5}\s+', '', name.strip())  # leading postal code
+    return ' '.join(re.findall(r'[a-z]+', name))
+
+
+def _gazetteer() -> Dict[str, Tuple[float, float]]:
+    places: Dict[str, Tuple[float, float]] = {}
+    for line in CITIES.strip().splitlines():
+        name, lat, lng = line.split('|')
+        coordinates = (float(lat), float(lng))
+        places.setdefault(place_key(name), coordinates)
+        short = re.split(r'\s+(?:am|an der|im)\s+|\s*\(', name)[0]
+        places.setdefault(place_key(short), coordinates)
+    return places
+
+
+GAZETTEER = _gazetteer()
+
+
+def lookup_place(name: Optional[str]) -> Optional[Tuple[float, float]]:
+    """(lat, lng) of a city name, ignoring case, umlaut spelling, a postal code and a ", region" suffix."""
+    if not name or not isinstance(name, str):
+        return None
+    return GAZETTEER.get(place_key(name.split(',')[0]))
+
+
+def point(lat: float, lng: float) -> dict:
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or math.isnan(lat) or math.isnan(lng):
+        raise GeoError("Ungültige Koordinaten")
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+def listing_location(location: Optional[str], latitude: Optional[float], longitude: Optional[float],
+                     category_fields: Optional[dict] = None) -> dict:
+    """Location fields of a listing: explicit coordinates win, otherwise the city is looked up in the gazetteer."""
+    location = location or (category_fields or {}).get('location') or None
+    if (latitude is None) != (longitude is None):
+        raise GeoError("Breiten- und Längengrad müssen zusammen angegeben werden")
+    if latitude is None:
+        coordinates = lookup_place(location)
+        if coordinates is None:
+            return {"location": location, "latitude": None, "longitude": None}
+        latitude, longitude = coordinates
+    return {"location": location, "latitude": latitude, "longitude": longitude, "geo": point(latitude, longitude)}
+
+
+def search_center(lat: Optional[float], lng: Optional[float], near: Optional[str]) -> Tuple[float, float]:
+    if lat is not None and lng is not None:
+        point(lat, lng)
+        return lat, lng
+    if lat is not None or lng is not None:
+        raise GeoError("Breiten- und Längengrad müssen zusammen angegeben werden")
+    coordinates = lookup_place(near)
+    if coordinates is None:
+        raise GeoError("Ort nicht gefunden")
+    return coordinates
+
+
+def near_pipeline(center: Tuple[float, float], radius_km: float, query: dict, projection: dict, skip: int, limit: int) -> list:
+    """Listings within `radius_km` of `center` matching `query`, nearest first, with `distance_km`."""
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        raise GeoError(f"Umkreis muss zwischen 0 und {MAX_RADIUS_KM:g} km liegen")
+    return [
+        {"$geoNear": {
+            "near": point(*center), "key": "geo", "spherical": True, "query": query,
+            "maxDistance": radius_km * 1000, "distanceField": "distance_km", "distanceMultiplier": 0.001,
+        }},
+        {"$skip": skip},
+        {"$limit": limit},
+        {"$project": {**pipeline_projection(projection), "distance_km": {"$round": ["$distance_km", 2]}}},
+    ]
+
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle (haversine) distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+async def backfill_listing_geo(db, batch_size: int = 1000) -> int:
+    """Set `geo` on listings created before it existed, from their coordinates or their city. Returns the number updated."""
+    updated = 0
+    operations = []
+    cursor = db.listings.find({"geo": {"$exists": False}}, {"_id": 1, "location": 1, "latitude": 1, "longitude": 1, "category_fields": 1})
+    async for listing in cursor:
+        try:
+            fields = listing_location(listing.get('location'), listing.get('latitude'), listing.get('longitude'), listing.get('category_fields'))
+        except GeoError:
+            continue
+        if 'geo' in fields:
+            operations.append(UpdateOne({"_id": listing['_id']}, {"$set": fields}))
+        if len(operations) >= batch_size:
+            updated += (await db.listings.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await db.listings.bulk_write(operations, ordered=False)).modified_count
+    return updated
@@ -0,0 +1,157 @@
+import logging
+from datetime import datetime
+from typing import List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# (collection, keys, options) - every index the routes in server.py rely on
+INDEXES: List[Tuple[str, list, dict]] = [
+    ("users", [("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    ("users", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("users", [("created_at", DESCENDING), ("id", DESCENDING)], {"name": "created_at"}),
+
+    ("listings", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("listings", [("created_at", DESCENDING), ("id", DESCENDING)], {"name": "created_at"}),
+    ("listings", [("category", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "category_created_at"}),
+    ("listings", [("seller_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "seller_created_at"}),
+    ("listings", [("geo", GEOSPHERE), ("category", ASCENDING)], {"name": "geo_category"}),
+    # Facet filters of the busiest categories; partial, so each only holds that category's listings
+    ("listings", [("attributes.brand", ASCENDING), ("attributes.model", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+     {"name": "cars_brand_model", "partialFilterExpression": {"category": "cars"}}),
+    ("listings", [("attributes.fuel_type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+     {"name": "cars_fuel_type", "partialFilterExpression": {"category": "cars"}}),
+    ("listings", [("attributes.year", ASCENDING), ("attributes.mileage", ASCENDING)],
+     {"name": "cars_year_mileage", "partialFilterExpression": {"category": "cars"}}),
+    ("listings", [("attributes.listing_type", ASCENDING), ("attributes.property_type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+     {"name": "real_estate_type", "partialFilterExpression": {"category": "real_estate"}}),
+    ("listings", [("attributes.area", ASCENDING)], {"name": "real_estate_area", "partialFilterExpression": {"category": "real_estate"}}),
+
+    ("messages", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("messages", [("to_user_id", ASCENDING), ("read", ASCENDING)], {"name": "to_user_read"}),
+    ("messages", [("listing_id", ASCENDING), ("from_user_id", ASCENDING), ("to_user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {"name": "thread"}),
+    ("messages", [("from_user_id", ASCENDING), ("created_at", DESCENDING)], {"name": "from_user_created_at"}),
+    ("messages", [("to_user_id", ASCENDING), ("created_at", DESCENDING)], {"name": "to_user_created_at"}),
+
+    ("conversations", [("user_id", ASCENDING), ("other_user_id", ASCENDING), ("listing_id", ASCENDING)], {"name": "participants_listing_unique", "unique": True}),
+    ("conversations", [("user_id", ASCENDING), ("last_message_time", DESCENDING)], {"name": "user_last_message_time"}),
+
+    ("unread_counters", [("user_id", ASCENDING)], {"name": "user_unique", "unique": True}),
+
+    ("listing_views", [("listing_id", ASCENDING), ("hour", ASCENDING)], {"name": "listing_hour_unique", "unique": True}),
+    ("listing_views", [("seller_id", ASCENDING), ("hour", ASCENDING)], {"name": "seller_hour"}),
+    ("listing_views", [("hour", ASCENDING)], {"name": "hour_ttl", "expireAfterSeconds": 90 * 24 * 3600}),
+
+    ("offers", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("offers", [("seller_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "seller_created_at"}),
+    ("offers", [("buyer_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "buyer_created_at"}),
+
+    ("reviews", [("reviewed_user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "reviewed_user_created_at"}),
+    ("reviews", [("reviewer_id", ASCENDING), ("reviewed_user_id", ASCENDING)], {"name": "reviewer_reviewed_user"}),
+
+    ("favorites", [("user_id", ASCENDING), ("listing_id", ASCENDING)], {"name": "user_listing_unique", "unique": True}),
+    ("favorites", [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "user_created_at"}),
+    ("favorites", [("listing_id", ASCENDING)], {"name": "listing"}),
+
+    ("support_tickets", [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "user_created_at"}),
+    ("support_tickets", [("status", ASCENDING)], {"name": "status"}),
+    ("support_tickets", [("created_at", DESCENDING), ("id", DESCENDING)], {"name": "created_at"}),
+
+    ("media", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+
+    ("stats_series", [("granularity", ASCENDING), ("ts", ASCENDING)], {"name": "granularity_ts_unique", "unique": True}),
+    ("stats_series", [("ts", ASCENDING)], {"name": "minute_ttl", "expireAfterSeconds": 14 * 24 * 3600, "partialFilterExpression": {"granularity": "minute"}}),
+
+    ("feed_cache", [("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+
+    ("jobs", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("jobs", [("status", ASCENDING), ("created_at", ASCENDING)], {"name": "status_created_at"}),
+]
+
+# (route, collection, filter, sort) - representative query shape of each route, used by `manage.py explain`
+ROUTE_QUERIES = [
+    ("POST /auth/login", "users", {"email": "user@example.com"}, None),
+    ("GET /auth/profile", "users", {"id": "u1"}, None),
+    ("GET /admin/users", "users", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings", "listings", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings?category", "listings", {"category": "cars"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings?lat&lng", "listings", {"geo": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [13.405, 52.52]}, "$maxDistance": 25000}}, "category": "cars"}, None),
+    ("GET /listings/facets?brand", "listings", {"category": "cars", "attributes.brand": "BMW"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings/facets?year_min", "listings", {"category": "cars", "attributes.year": {"$gte": 2018}}, None),
+    ("GET /listings/my", "listings", {"seller_id": "u1"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings/{id}", "listings", {"id": "l1"}, None),
+    ("GET /listings/my/analytics", "listing_views", {"seller_id": "u1", "hour": {"$gte": datetime(2024, 1, 1)}}, None),
+    ("GET /messages/conversations", "conversations", {"user_id": "u1"}, [("last_message_time", DESCENDING)]),
+    ("GET /messages/unread-count", "unread_counters", {"user_id": "u1"}, None),
+    ("POST /messages/mark-read", "messages", {"listing_id": "l1", "from_user_id": "u2", "to_user_id": "u1", "read": False}, None),
+    ("GET /messages/{listing}/{user}", "messages", {"listing_id": "l1", "$or": [{"from_user_id": "u1", "to_user_id": "u2"}, {"from_user_id": "u2", "to_user_id": "u1"}]}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /offers/received", "offers", {"seller_id": "u1"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /offers/sent", "offers", {"buyer_id": "u1"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("POST /offers/action", "offers", {"id": "o1"}, None),
+    ("POST /reviews", "reviews", {"reviewer_id": "u1", "reviewed_user_id": "u2"}, None),
+    ("GET /reviews/{user_id}", "reviews", {"reviewed_user_id": "u1"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /favorites", "favorites", {"user_id": "u1"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /favorites/check/{id}", "favorites", {"user_id": "u1", "listing_id": "l1"}, None),
+    ("POST /favorites/check", "favorites", {"user_id": "u1", "listing_id": {"$in": ["l1", "l2"]}}, None),
+    ("GET /support/my", "support_tickets", {"user_id": "u1"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /admin/support", "support_tickets", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /admin/stats/series", "stats_series", {"granularity": "minute", "ts": {"$gte": datetime(2024, 1, 1), "$lte": datetime(2024, 1, 2)}}, None),
+    ("job worker claim", "jobs", {"status": "queued"}, [("created_at", ASCENDING)]),
+]
+
+INDEX_CONFLICT_CODES = (85, 86)  # IndexOptionsConflict, IndexKeySpecsConflict
+
+
+async def ensure_indexes(db, migrate: bool = False) -> None:
+    """Create every registered index. Safe to run on every startup.
+
+    An existing index with a conflicting definition is only dropped and rebuilt with `migrate`
+    (`manage.py ensure-indexes`), never by the workers starting up side by side.
+    """
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                logger.error(f"Could not create index {collection}.{options['name']}: {e}")
+                continue
+            if not migrate:
+                logger.warning(f"Index {collection}.{options['name']} differs from the registry; run `manage.py ensure-indexes` to rebuild it")
+                continue
+            logger.info(f"Rebuilding index {collection}.{options['name']}")
+            existing = await db[collection].index_information()
+            for name, info in existing.items():
+                if name == options['name'] or [tuple(k) for k in info['key']] == keys:
+                    await db[collection].drop_index(name)
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                logger.error(f"Could not create index {collection}.{options['name']}: {e}")
+
+
+def plan_stages(plan: dict) -> list:
+    """Flatten a winning plan into its stage names, outermost first."""
+    stage = plan.get('stage')
+    if stage and plan.get('indexName'):
+        stage = f"{stage}({plan['indexName']})"
+    stages = [stage]
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            stages += plan_stages(child)
+    return [s for s in stages if s]
+
+
+async def explain_route_queries(db) -> list:
+    """Return (route, stages) for every entry in ROUTE_QUERIES."""
+    results = []
+    for route, collection, query, sort in ROUTE_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning = explain.get('queryPlanner', {}).get('winningPlan', {})
+        winning = winning.get('queryPlan', winning)
+        results.append((route, plan_stages(winning)))
+    return results
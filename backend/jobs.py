@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobLeaseLost(Exception):
+    """This worker's lease expired and another worker took the job over."""
+
+
+class JobQueue:
+    """Jobs persisted in the `jobs` collection. A running job whose lease expired (crashed worker) is picked up again."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def enqueue(self, job_type: str, params: Optional[dict] = None) -> dict:
+        now = datetime.utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "params": params or {},
+            "status": QUEUED,
+            "progress": {"completed_steps": [], "counts": {}},
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+            "lease_until": None,
+        }
+        await self.db.jobs.insert_one(job)
+        job.pop('_id', None)
+        return job
+
+    async def enqueue_once(self, job_type: str, params: Optional[dict] = None) -> Optional[dict]:
+        """Enqueue unless a job of `job_type` is already queued or running. None if one is."""
+        if await self.db.jobs.find_one({"status": {"$in": [QUEUED, RUNNING]}, "type": job_type}, {"_id": 1}):
+            return None
+        return await self.enqueue(job_type, params)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.db.jobs.find_one({"id": job_id}, {"_id": 0})
+
+    async def claim(self, worker_id: str, lease: timedelta) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.db.jobs.find_one_and_update(
+            {"$or": [{"status": QUEUED}, {"status": RUNNING, "lease_until": {"$lt": now}}]},
+            {"$set": {"status": RUNNING, "worker": worker_id, "lease_until": now + lease, "updated_at": now},
+             "$min": {"started_at": now}, "$inc": {"attempts": 1}},  # started_at is kept from the first attempt
+            sort=[("created_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew(self, job_id: str, worker_id: str, lease: timedelta) -> bool:
+        """Extend the lease. False if `worker_id` no longer owns the running job."""
+        result = await self.db.jobs.update_one({"id": job_id, "worker": worker_id, "status": RUNNING},
+                                               {"$set": {"lease_until": datetime.utcnow() + lease}})
+        return result.matched_count > 0
+
+    async def finish(self, job_id: str, worker_id: str, status: str, error: Optional[str] = None) -> None:
+        now = datetime.utcnow()
+        await self.db.jobs.update_one(
+            {"id": job_id, "worker": worker_id, "status": RUNNING},
+            {"$set": {"status": status, "error": error, "finished_at": now if status in (DONE, FAILED) else None, "updated_at": now, "lease_until": None}}
+        )
+
+
+class JobContext:
+    """Handed to job handlers: parameters, progress checkpoints and throttled batch deletes.
+
+    Steps and batches only start while this worker still holds the lease; otherwise `JobLeaseLost`
+    aborts the handler, so a worker that stalled past its lease never runs alongside the new owner.
+    """
+
+    def __init__(self, queue: JobQueue, job: dict, batch_size: int, pause: float,
+                 worker_id: Optional[str] = None, lease: timedelta = timedelta(minutes=5)):
+        self.queue = queue
+        self.job = job
+        self.params = job['params']
+        self.progress = job['progress']
+        self.batch_size = batch_size
+        self.pause = pause
+        self.worker_id = worker_id if worker_id is not None else job.get('worker')
+        self.lease = lease
+
+    async def renew_lease(self) -> None:
+        if not await self.queue.renew(self.job['id'], self.worker_id, self.lease):
+            raise JobLeaseLost()
+
+    async def save_progress(self) -> None:
+        result = await self.queue.db.jobs.update_one({"id": self.job['id'], "worker": self.worker_id, "status": RUNNING},
+                                                     {"$set": {"progress": self.progress, "updated_at": datetime.utcnow()}})
+        if not result.matched_count:
+            raise JobLeaseLost()
+
+    async def count(self, name: str, n: int) -> None:
+        self.progress['counts'][name] = self.progress['counts'].get(name, 0) + n
+        await self.save_progress()
+
+    async def run_steps(self, steps: List[Tuple[str, Callable[[], Awaitable[None]]]]) -> None:
+        """Run the steps not completed by an earlier attempt. Steps must be safe to repeat after a crash."""
+        for name, step in steps:
+            if name in self.progress['completed_steps']:
+                continue
+            await self.renew_lease()
+            await step()
+            self.progress['completed_steps'].append(name)
+            await self.save_progress()
+
+    async def delete_in_batches(self, collection, query: dict, name: str,
+                                before_delete: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+                                after_delete: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+                                projection: Optional[dict] = None) -> int:
+        """Delete matching documents `batch_size` at a time, pausing between batches to spare the primary."""
+        deleted = 0
+        while True:
+            await self.renew_lease()
+            docs = await collection.find(query, {"_id": 1, **(projection or {})}).limit(self.batch_size).to_list(self.batch_size)
+            if not docs:
+                return deleted
+            if before_delete:
+                await before_delete(docs)
+            result = await collection.delete_many({"_id": {"$in": [doc['_id'] for doc in docs]}})
+            if after_delete:
+                await after_delete(docs)
+            deleted += result.deleted_count
+            await self.count(name, result.deleted_count)
+            await asyncio.sleep(self.pause)
+
+
+JobHandler = Callable[[JobContext], Awaitable[None]]
+
+
+class JobRunner:
+    """asyncio worker executing queued jobs with the handler registered for their type."""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, JobHandler], batch_size: int = 500, pause: float = 0.05,
+                 poll_interval: float = 1.0, lease: timedelta = timedelta(minutes=5), max_attempts: int = 3):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.worker_id = uuid.uuid4().hex
+        self.wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Skip the poll delay after enqueueing a job in this process."""
+        self.wakeup.set()
+
+    async def run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            try:
+                job = await self.queue.claim(self.worker_id, self.lease)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.execute(job)
+
+    async def execute(self, job: dict) -> None:
+        handler = self.handlers.get(job['type'])
+        if handler is None:
+            await self.queue.finish(job['id'], self.worker_id, FAILED, f"Unknown job type: {job['type']}")
+            return
+        heartbeat = asyncio.create_task(self.heartbeat(job['id']))
+        try:
+            await handler(JobContext(self.queue, job, self.batch_size, self.pause, self.worker_id, self.lease))
+        except JobLeaseLost:
+            logger.warning(f"Job {job['id']} ({job['type']}) was taken over by another worker; stopped here")
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['type']}) failed: {e}")
+            await self.queue.finish(job['id'], self.worker_id, FAILED if job['attempts'] >= self.max_attempts else QUEUED, str(e))
+        else:
+            await self.queue.finish(job['id'], self.worker_id, DONE)
+        finally:
+            heartbeat.cancel()
+
+    async def heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                if not await self.queue.renew(job_id, self.worker_id, self.lease):
+                    return  # taken over; the handler stops at its next step or batch
+            except Exception as e:
+                logger.error(f"Renewing the lease of job {job_id} failed: {e}")
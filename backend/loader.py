@@ -0,0 +1,87 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+USER_PUBLIC_PROJECTION = {"_id": 0, "id": 1, "name": 1, "profile_image": 1}
+LISTING_REF_PROJECTION = {"_id": 0, "id": 1, "title": 1, "price": 1, "images": {"$slice": 1}}
+
+
+class BatchLoader:
+    """DataLoader-style batching for one collection and projection.
+
+    `load()` calls made in the same event-loop tick are coalesced into a single `$in` query;
+    repeated keys are deduplicated and results are cached for the loader's lifetime.
+    With a `shared_cache` (e.g. `UserCache`) hits are served from it and misses are fetched as
+    full cached documents, then projected; only plain field inclusions are supported then.
+    """
+
+    def __init__(self, collection, projection: dict, key: str = 'id', shared_cache=None):
+        self.collection = collection
+        self.projection = projection
+        self.key = key
+        self.shared_cache = shared_cache
+        self.cache: Dict[Any, asyncio.Future] = {}
+        self.queue: List[Any] = []
+
+    def load(self, key) -> asyncio.Future:
+        future = self.cache.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.cache[key] = future
+            shared = self.shared_cache.peek(key) if self.shared_cache is not None else None
+            if shared is not None:
+                future.set_result(self.project(shared))
+                return future
+            if not self.queue:
+                asyncio.get_running_loop().call_soon(lambda: asyncio.ensure_future(self.dispatch()))
+            self.queue.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable) -> Dict[Any, Optional[dict]]:
+        keys = list(dict.fromkeys(keys))
+        docs = await asyncio.gather(*(self.load(k) for k in keys))
+        return dict(zip(keys, docs))
+
+    def project(self, doc: dict) -> dict:
+        return {field: doc[field] for field, include in self.projection.items() if include and field in doc}
+
+    async def dispatch(self) -> None:
+        keys, self.queue = self.queue, []
+        shared = self.shared_cache
+        generation = shared.generation if shared is not None else None
+        try:
+            projection = shared.projection if shared is not None else self.projection
+            docs = await self.collection.find({self.key: {"$in": keys}}, projection).to_list(None)
+        except Exception as e:
+            for k in keys:
+                self.cache.pop(k).set_exception(e)
+            return
+        if shared is not None:
+            for doc in docs:
+                shared.put(doc, generation)
+            docs = [self.project(doc) for doc in docs]
+        found = {doc[self.key]: doc for doc in docs}
+        for k in keys:
+            if not self.cache[k].done():
+                self.cache[k].set_result(found.get(k))
+
+
+class RequestLoaders:
+    """Per-request registry of loaders, one per (collection, projection)."""
+
+    def __init__(self, db, user_cache=None):
+        self.db = db
+        self.user_cache = user_cache
+        self.loaders: Dict[tuple, BatchLoader] = {}
+
+    def get(self, collection: str, projection: dict, shared_cache=None) -> BatchLoader:
+        key = (collection, repr(sorted(projection.items())))
+        if key not in self.loaders:
+            self.loaders[key] = BatchLoader(self.db[collection], projection, shared_cache=shared_cache)
+        return self.loaders[key]
+
+    @property
+    def users(self) -> BatchLoader:
+        return self.get('users', USER_PUBLIC_PROJECTION, self.user_cache)
+
+    def listings(self, projection: dict = LISTING_REF_PROJECTION) -> BatchLoader:
+        return self.get('listings', projection)
@@ -0,0 +1,371 @@
+"""Maintenance commands for the ChancenMarket backend.
+
+Usage: python manage.py <command> [options]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, GEOSPHERE
+
+from conversations import rebuild_conversations, reconcile_unread_counters
+from exports import EXPORTS, encode_rows
+from facets import backfill_listing_attributes
+from geo import GAZETTEER, backfill_listing_geo, distance_km, near_pipeline, point
+from indexes import ensure_indexes, explain_route_queries
+from media import MediaStore, LocalDiskBackend, media_base_url, migrate_inline_media
+from passwords import PasswordHasher
+from pricing import PriceEstimator
+from ratings import recompute_ratings
+from search import InMemorySearchEngine, backfill_category_values
+from stats import rebuild_stats
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+def get_db():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    return client[os.environ['DB_NAME']]
+
+
+async def cmd_migrate_media(args):
+    db = get_db()
+    base_url = media_base_url(os.getenv('MEDIA_BASE_URL'), os.getenv('PUBLIC_BASE_URL'))
+    store = MediaStore(db, LocalDiskBackend(os.getenv('MEDIA_ROOT', str(ROOT_DIR / 'media'))), base_url)
+    updated = await migrate_inline_media(db, store)
+    print(f"Migrated {updated} listings")
+
+
+async def cmd_rebuild_conversations(args):
+    await rebuild_conversations(get_db())
+    print("Conversations rebuilt")
+
+
+async def cmd_reconcile_unread(args):
+    users = await reconcile_unread_counters(get_db())
+    print(f"Unread counters recomputed ({users} users with unread messages)")
+
+
+async def cmd_recompute_ratings(args):
+    users = await recompute_ratings(get_db())
+    print(f"Ratings recomputed for {users} users")
+
+
+async def cmd_rebuild_price_index(args):
+    index = await PriceEstimator().rebuild(get_db())
+    print(f"Price index rebuilt from {index['listings']} listings ({len(index['buckets'])} buckets)")
+
+
+async def cmd_rebuild_stats(args):
+    buckets = await rebuild_stats(get_db())
+    print(f"Stats rebuilt ({buckets} series buckets)")
+
+
+async def cmd_backfill_geo(args):
+    updated = await backfill_listing_geo(get_db())
+    print(f"Coordinates set on {updated} listings")
+
+
+async def cmd_backfill_attributes(args):
+    updated = await backfill_listing_attributes(get_db())
+    print(f"Facet attributes updated on {updated} listings")
+
+
+async def cmd_backfill_search(args):
+    updated = await backfill_category_values(get_db())
+    print(f"Search values updated on {updated} listings")
+
+
+async def cmd_ensure_indexes(args):
+    await ensure_indexes(get_db(), migrate=True)
+    print("Indexes up to date")
+
+
+async def cmd_explain(args):
+    collscans = 0
+    for route, stages in await explain_route_queries(get_db()):
+        flag = 'COLLSCAN' if 'COLLSCAN' in stages else 'ok'
+        collscans += flag == 'COLLSCAN'
+        print(f"{flag:8}  {route:35}  {' <- '.join(stages)}")
+    print(f"{collscans} route queries fall back to COLLSCAN")
+
+
+BENCH_WORDS = {
+    "cars": ["Audi", "BMW", "Volkswagen", "Golf", "Passat", "Kombi", "Limousine", "Diesel", "Benzin", "Automatik", "Scheckheft", "TÜV"],
+    "electronics": ["iPhone", "Samsung", "Laptop", "Fernseher", "Kopfhörer", "Kamera", "Ladegerät", "Tablet", "Spielkonsole", "Drucker"],
+    "furniture": ["Sofa", "Schrank", "Küchentisch", "Stühle", "Kommode", "Regal", "Bett", "Matratze", "Sessel", "Schreibtisch"],
+    "sports": ["Fahrrad", "Mountainbike", "Laufschuhe", "Zelt", "Skier", "Hanteln", "Rucksack", "Schlafsack", "Helm", "Trikot"],
+}
+BENCH_FILLER = "gut erhalten gebraucht wenig benutzt abholung bar nur selbstabholer versand möglich neuwertig top zustand preis verhandelbar".split()
+BENCH_MODELS = [f"{prefix}{n}" for prefix in ("x", "s", "pro", "max", "m", "gt") for n in range(1, 800)]
+BENCH_INFLECTIONS = {"Fahrrad": "Fahrräder", "Stühle": "Stuhl", "Küchentisch": "Küchentische", "Laufschuhe": "Laufschuh", "Fernseher": "fernseher", "Kopfhörer": "Kopfhoerer"}
+
+
+def synthetic_listing(i: int, now: datetime) -> dict:
+    category = random.choice(list(BENCH_WORDS))
+    title_words = random.sample(BENCH_WORDS[category], 2) + [random.choice(BENCH_MODELS)]
+    return {
+        "id": f"bench-{i}",
+        "title": ' '.join(title_words),
+        "description": ' '.join(random.choices(BENCH_FILLER + BENCH_WORDS[category], k=25)),
+        "category": category,
+        "category_fields": {"condition": random.choice(["Neu", "Gebraucht", "Wie neu"])},
+        "created_at": now - timedelta(minutes=i),
+    }
+
+
+async def cmd_bench_search(args):
+    random.seed(42)
+    now = datetime.utcnow()
+    engine = InMemorySearchEngine()
+    titles = []
+    started = time.perf_counter()
+    for i in range(args.docs):
+        listing = synthetic_listing(i, now)
+        engine.add(listing)
+        titles.append(frozenset(listing['title'].split()))
+    print(f"Indexed {args.docs} listings in {time.perf_counter() - started:.1f}s ({len(engine.postings)} terms)")
+
+    # Relevance: query with inflected forms of a random title; a hit is any result containing all its words
+    latencies, reciprocal_ranks = [], []
+    for target in random.sample(range(args.docs), args.queries):
+        query = ' '.join(BENCH_INFLECTIONS.get(w, w) for w in titles[target])
+        started = time.perf_counter()
+        ranked = engine.rank(query, limit=10)
+        latencies.append((time.perf_counter() - started) * 1000)
+        relevant = [rank for rank, (_, listing_id) in enumerate(ranked) if titles[target] <= titles[int(listing_id[6:])]]
+        reciprocal_ranks.append(1 / (relevant[0] + 1) if relevant else 0.0)
+    latencies.sort()
+    print(f"Queries: {args.queries}  p50 {statistics.median(latencies):.2f} ms  p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms")
+    print(f"Relevant result in top 10: {sum(1 for r in reciprocal_ranks if r) / args.queries:.1%}  MRR@10: {statistics.mean(reciprocal_ranks):.3f}")
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def cmd_bench_hashing(args):
+    """Latency of a cheap endpoint (GET /categories) while a burst of logins is served, bcrypt inline vs pooled."""
+    import httpx  # only needed here; keep the other commands free of the web stack
+    from fastapi import FastAPI, Response
+
+    from catalog import load_catalog
+
+    hasher = PasswordHasher(args.rounds, args.workers)
+    hashed = hasher._hash("Passwort123")
+    catalog = load_catalog()
+    app = FastAPI()
+
+    @app.post("/inline/login")
+    async def inline_login():
+        return {"ok": PasswordHasher._verify("Passwort123", hashed)}
+
+    @app.post("/pool/login")
+    async def pooled_login():
+        return {"ok": await hasher.verify("Passwort123", hashed)}
+
+    @app.get("/categories")
+    async def categories():
+        return Response(catalog.body, media_type="application/json")
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await client.get("/categories")
+        for label in ("inline", "pool"):
+            latencies = []
+            burst_end = None
+
+            async def reader():
+                due = time.perf_counter()
+                while burst_end is None or due <= burst_end:  # also send what fell due while the loop was blocked
+                    await asyncio.sleep(max(due - time.perf_counter(), 0))
+                    await client.get("/categories")
+                    # Measured from when the request was due, so time spent waiting for a blocked loop counts
+                    latencies.append((time.perf_counter() - due) * 1000)
+                    due += args.interval / 1000
+
+            readers = [asyncio.create_task(reader()) for _ in range(args.readers)]
+            await asyncio.sleep(0.1)  # readers running before the burst starts
+            started = time.perf_counter()
+            await asyncio.gather(*(client.post(f"/{label}/login") for _ in range(args.logins)))
+            burst_end = time.perf_counter()
+            elapsed = burst_end - started
+            await asyncio.gather(*readers)
+            latencies.sort()
+            print(f"{label:>6}: {args.logins} logins in {elapsed:.2f}s  GET /categories x{len(latencies)}  "
+                  f"p50 {statistics.median(latencies):.1f} ms  p99 {percentile(latencies, 0.99):.1f} ms  max {latencies[-1]:.1f} ms")
+    print(f"Pool peak queue depth: {hasher.metrics()['peak_queue_depth']}")
+    hasher.executor.shutdown()
+
+
+async def cmd_bench_serialize(args):
+    import httpx  # only needed here; keep the other commands free of the web stack
+    from fastapi import FastAPI
+
+    from fastjson import rows_response
+    from models import Listing
+
+    now = datetime.utcnow()
+    docs = []
+    for i in range(args.rows):
+        listing = synthetic_listing(i, now)
+        docs.append({**listing, "seller_id": "bench", "seller_name": "Bench", "price": 10.0 + i,
+                     "images": [f"/api/media/{i:032x}.jpg"], "image_ids": [f"{i:032x}.jpg"], "views": i})
+
+    app = FastAPI()
+
+    @app.get("/models", response_model=List[Listing])
+    async def model_path():
+        return [Listing(**{k: v for k, v in doc.items() if k != '_id'}) for doc in docs]
+
+    @app.get("/fast", response_model=List[Listing])
+    async def fast_path():
+        return rows_response(docs, Listing)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        baseline = None
+        for path in ("/models", "/fast"):
+            await client.get(path)
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                response = await client.get(path)
+            rps = args.requests / (time.perf_counter() - started)
+            baseline = baseline or rps
+            print(f"{path:>8}: {rps:8.0f} req/s on one core ({args.rows} listings, {len(response.content)} bytes)  x{rps / baseline:.2f}")
+
+
+async def cmd_bench_export(args):
+    """Stream synthetic listings through the export encoder and track peak memory along the way."""
+    fields = EXPORTS['listings']['default_fields']
+    now = datetime.utcnow()
+    checkpoints = {args.docs // 10: None, args.docs: None}
+
+    async def synthetic_cursor():
+        for i in range(args.docs):
+            yield {**synthetic_listing(i, now), "seller_id": "bench", "seller_name": "Bench", "price": 10.0 + i % 1000,
+                   "image_ids": [f"{i:032x}.jpg"], "views": i % 500}
+
+    for fmt in ("ndjson", "csv"):
+        random.seed(42)
+        tracemalloc.start()
+        started = time.perf_counter()
+        rows = size = 0
+        async for chunk in encode_rows(synthetic_cursor(), fields, fmt):
+            size += len(chunk)
+            rows += chunk.count(b'\n')
+            for checkpoint in checkpoints:
+                if checkpoints[checkpoint] is None and rows >= checkpoint:
+                    checkpoints[checkpoint] = tracemalloc.get_traced_memory()[1] / 2**20
+        elapsed = time.perf_counter() - started
+        tracemalloc.stop()
+        peaks = '  '.join(f"peak after {n:,} rows {mb:.1f} MiB" for n, mb in checkpoints.items())
+        print(f"{fmt:>6}: {args.docs:,} docs, {size / 2**20:.0f} MiB in {elapsed:.1f}s  {peaks}")
+        checkpoints = dict.fromkeys(checkpoints)
+
+
+async def cmd_bench_geo(args):
+    """Radius queries against a scratch collection of points clustered around the gazetteer cities."""
+    db = get_db()
+    collection = db.bench_geo
+    await collection.drop()
+    random.seed(42)
+    cities = list(GAZETTEER.values())
+    categories = list(BENCH_WORDS)
+    points = []
+    started = time.perf_counter()
+    for offset in range(0, args.points, 10_000):
+        batch = []
+        for i in range(offset, min(offset + 10_000, args.points)):
+            lat, lng = random.choice(cities)
+            lat, lng = lat + random.gauss(0, 0.2), lng + random.gauss(0, 0.3)
+            points.append((lat, lng))
+            batch.append({"id": f"bench-{i}", "category": random.choice(categories), "price": float(i % 1000), "geo": point(lat, lng)})
+        await collection.insert_many(batch, ordered=False)
+    await collection.create_index([("geo", GEOSPHERE), ("category", ASCENDING)])
+    print(f"Inserted and indexed {args.points:,} points in {time.perf_counter() - started:.1f}s")
+
+    projection = {"_id": 0, "id": 1, "price": 1}
+    latencies = []
+    for q in range(args.queries):
+        center = random.choice(cities)
+        query = {"category": random.choice(categories)} if q % 2 else {}
+        started = time.perf_counter()
+        rows = await collection.aggregate(near_pipeline(center, args.radius_km, query, projection, 0, 20)).to_list(20)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if q < 3:
+            # Cross-check against a brute-force haversine scan: same nearest points, all within the radius
+            # (MongoDB uses a slightly larger earth radius, hence the tolerance)
+            nearest = sorted(distance_km(*center, *p) for p in points)[:len(rows)]
+            if not query and any(abs(d - r['distance_km']) > 0.005 * d + 0.01 for d, r in zip(nearest, rows)):
+                print(f"Mismatch for query {q}: {nearest[:3]} vs {[r['distance_km'] for r in rows[:3]]}")
+    latencies.sort()
+    print(f"Queries: {args.queries} within {args.radius_km:g} km, limit 20  p50 {statistics.median(latencies):.1f} ms  "
+          f"p99 {latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]:.1f} ms")
+    explain = await db.command("explain", {"aggregate": "bench_geo", "pipeline": near_pipeline(cities[0], args.radius_km, {}, projection, 0, 20), "cursor": {}})
+    print(f"Plan uses the 2dsphere index: {'GEO_NEAR_2DSPHERE' in str(explain)}")
+    if not args.keep:
+        await collection.drop()
+
+
+# name -> (handler, help, [(flags, argparse kwargs), ...])
+COMMANDS = {
+    'migrate-media': (cmd_migrate_media, "Move inline base64 listing media into the media store and make media URLs absolute", []),
+    'rebuild-conversations': (cmd_rebuild_conversations, "Recompute the materialized conversations from messages", []),
+    'reconcile-unread': (cmd_reconcile_unread, "Recompute per-user unread counters from messages", []),
+    'recompute-ratings': (cmd_recompute_ratings, "Backfill seller rating aggregates and histograms from reviews", []),
+    'rebuild-price-index': (cmd_rebuild_price_index, "Recompute the price estimation buckets from listings", []),
+    'rebuild-stats': (cmd_rebuild_stats, "Recompute the dashboard counters and created series from the raw collections", []),
+    'backfill-geo': (cmd_backfill_geo, "Set GeoJSON coordinates on listings from their coordinates or city", []),
+    'backfill-attributes': (cmd_backfill_attributes, "Recompute the typed facet attributes of every listing from its category fields", []),
+    'backfill-search': (cmd_backfill_search, "Set the text-indexed category values of every listing for SEARCH_BACKEND=mongo", []),
+    'ensure-indexes': (cmd_ensure_indexes, "Create all registered indexes, rebuilding those whose definition changed", []),
+    'explain': (cmd_explain, "Print the query plan of every route query", []),
+    'bench-search': (cmd_bench_search, "Benchmark search relevance and latency on a synthetic corpus", [
+        (['--docs'], {"type": int, "default": 1_000_000}),
+        (['--queries'], {"type": int, "default": 200}),
+    ]),
+    'bench-hashing': (cmd_bench_hashing, "Compare GET /categories p50/p99 during a login burst with inline vs pooled bcrypt", [
+        (['--logins'], {"type": int, "default": 50}),
+        (['--readers'], {"type": int, "default": 4}),
+        (['--interval'], {"type": float, "default": 10.0, "help": "ms between a reader's requests"}),
+        (['--rounds'], {"type": int, "default": 12}),
+        (['--workers'], {"type": int, "default": 4}),
+    ]),
+    'bench-geo': (cmd_bench_geo, "Benchmark radius queries on a scratch collection of synthetic points (needs MongoDB)", [
+        (['--points'], {"type": int, "default": 2_000_000}),
+        (['--queries'], {"type": int, "default": 200}),
+        (['--radius-km'], {"type": float, "default": 25.0}),
+        (['--keep'], {"action": "store_true"}),
+    ]),
+    'bench-export': (cmd_bench_export, "Check that streaming exports keep memory flat over a synthetic collection", [
+        (['--docs'], {"type": int, "default": 1_000_000}),
+    ]),
+    'bench-serialize': (cmd_bench_serialize, "Compare list response throughput of pydantic models vs the orjson fast path", [
+        (['--rows'], {"type": int, "default": 50}),
+        (['--requests'], {"type": int, "default": 2000}),
+    ]),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChancenMarket maintenance commands")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (_, help_text, arguments) in COMMANDS.items():
+        sub = subparsers.add_parser(name, help=help_text)
+        for flags, kwargs in arguments:
+            sub.add_argument(*flags, **kwargs)
+    args = parser.parse_args()
+    asyncio.run(COMMANDS[args.command][0](args))
+
+
+if __name__ == '__main__':
+    main()
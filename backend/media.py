@@ -0,0 +1,248 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+# data:image/jpeg;base64,....
+DATA_URI_RE = re.compile(r'^data:(?P<type>[\w.+-]+/[\w.+-]+)?(;[\w-]+=[\w.-]+)*;base64,', re.IGNORECASE)
+MEDIA_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+MEDIA_PATH = '/api/media'  # route serving the blobs; relative media URLs start with it
+CHUNK_SIZE = 64 * 1024
+# ISO base media (MP4/QuickTime/HEIF) major brands, from the `ftyp` box at offset 4
+FTYP_BRANDS = {
+    b'heic': 'image/heic', b'heix': 'image/heic', b'mif1': 'image/heif', b'msf1': 'image/heif', b'avif': 'image/avif',
+    b'qt  ': 'video/quicktime', b'3gp4': 'video/3gpp', b'3gp5': 'video/3gpp', b'3g2a': 'video/3gpp2',
+}
+# Every type sniff_type() recognizes; the only ones served back under their own content type
+MEDIA_TYPES = frozenset({'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'video/x-msvideo', 'video/webm', 'video/mp4',
+                         *FTYP_BRANDS.values()})
+
+logger = logging.getLogger(__name__)
+
+
+class MediaError(ValueError):
+    pass
+
+
+class MediaBackend(ABC):
+    """Storage backend for content-addressed media blobs."""
+
+    @abstractmethod
+    async def exists(self, media_id: str) -> bool: ...
+
+    @abstractmethod
+    async def put(self, media_id: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    async def size(self, media_id: str) -> Optional[int]: ...
+
+    @abstractmethod
+    def iter_range(self, media_id: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Yield the bytes in [start, end] (inclusive)."""
+
+
+class LocalDiskBackend(MediaBackend):
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path_for(self, media_id: str) -> Path:
+        return self.root / media_id[:2] / media_id[2:4] / media_id
+
+    async def exists(self, media_id: str) -> bool:
+        return await asyncio.to_thread(self.path_for(media_id).exists)
+
+    async def put(self, media_id: str, data: bytes) -> None:
+        await asyncio.to_thread(self._write, self.path_for(media_id), data)
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    async def size(self, media_id: str) -> Optional[int]:
+        try:
+            return (await asyncio.to_thread(os.stat, self.path_for(media_id))).st_size
+        except FileNotFoundError:
+            return None
+
+    async def iter_range(self, media_id: str, start: int, end: int) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self.path_for(media_id), 'rb')
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+
+def sniff_type(data: bytes) -> Optional[str]:
+    """Image or video type of `data` from its magic bytes; None for anything else."""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data.startswith(b'RIFF') and data[8:12] == b'AVI ':
+        return 'video/x-msvideo'
+    if data.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    if data[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(data[8:12], 'video/mp4')
+    return None
+
+
+def is_media_type(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split('/', 1)[0] in ('image', 'video')
+
+
+def decode_upload(value: str, kind: str) -> tuple:
+    """Decode a base64 upload (optionally a data URI) of an `image` or `video` into (bytes, content_type).
+
+    The content type is taken from the magic bytes, not from the client's data URI, so nothing but
+    images and videos is ever stored or served back.
+    """
+    match = DATA_URI_RE.match(value)
+    if match:
+        if match.group('type') and not is_media_type(match.group('type')):
+            raise MediaError("Nicht unterstütztes Medienformat")
+        value = value[match.end():]
+    try:
+        data = base64.b64decode(''.join(value.split()), validate=True)
+    except (binascii.Error, ValueError):
+        raise MediaError("Ungültige Mediendaten")
+    if not data:
+        raise MediaError("Leere Mediendatei")
+    content_type = sniff_type(data)
+    if content_type is None or not content_type.startswith(kind + '/'):
+        raise MediaError("Nicht unterstütztes Medienformat")
+    return data, content_type
+
+
+def media_base_url(media_base_url: Optional[str], public_base_url: Optional[str]) -> str:
+    """Absolute prefix of media URLs: MEDIA_BASE_URL, or the backend origin PUBLIC_BASE_URL + /api/media.
+
+    Clients put the URLs straight into image components, which cannot resolve a relative URL on native,
+    so without either setting the URLs stay relative and only work on web.
+    """
+    base = media_base_url or (f"{public_base_url.rstrip('/')}{MEDIA_PATH}" if public_base_url else '')
+    if not re.match(r'^https?://[^/]+', base):
+        logger.warning("Neither PUBLIC_BASE_URL nor an absolute MEDIA_BASE_URL is set; media URLs stay relative to %s", MEDIA_PATH)
+        return MEDIA_PATH
+    return base
+
+
+class MediaStore:
+    def __init__(self, db, backend: MediaBackend, base_url: str):
+        self.db = db
+        self.backend = backend
+        self.base_url = base_url.rstrip('/')
+
+    def url_for(self, media_id: str) -> str:
+        return f"{self.base_url}/{media_id}"
+
+    def is_inline(self, value: str) -> bool:
+        """True if the value is inline base64 data rather than a media URL."""
+        return bool(value) and not value.startswith((self.base_url + '/', MEDIA_PATH + '/', 'http://', 'https://'))
+
+    def is_relative(self, url: str) -> bool:
+        """True for a relative media URL that the current base URL would make absolute."""
+        return url.startswith(MEDIA_PATH + '/') and self.base_url != MEDIA_PATH
+
+    def ref_for(self, url: str) -> dict:
+        """Reference of an already stored media URL; relative ones are rewritten under the current base URL."""
+        media_id = url.rsplit('/', 1)[-1]
+        return {"id": media_id, "url": self.url_for(media_id) if url.startswith(MEDIA_PATH + '/') else url}
+
+    async def save(self, value: str, kind: str) -> dict:
+        """Store an inline upload once and return its media reference."""
+        data, content_type = decode_upload(value, kind)
+        media_id = hashlib.sha256(data).hexdigest()
+        if not await self.backend.exists(media_id):
+            await self.backend.put(media_id, data)
+        await self.db.media.update_one(
+            {"id": media_id},
+            {"$setOnInsert": {"id": media_id, "kind": kind, "content_type": content_type, "size": len(data), "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return {"id": media_id, "url": self.url_for(media_id)}
+
+    async def save_all(self, values: list, kind: str) -> list:
+        return [await self.save(v, kind) for v in values if v]
+
+    async def get_meta(self, media_id: str) -> Optional[dict]:
+        return await self.db.media.find_one({"id": media_id}, {"_id": 0})
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """Parse a single-range `Range: bytes=a-b` header. Returns (start, end) or None for a full response."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition('-')
+    try:
+        if start_s == '':
+            length = int(end_s)
+            if length <= 0:
+                raise MediaError("Ungültiger Bereich")
+            return max(size - length, 0), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise MediaError("Ungültiger Bereich")
+    return start, min(end, size - 1)
+
+
+async def migrate_inline_media(db, store: MediaStore) -> int:
+    """Rewrite listings that still hold base64 images/videos inline or relative media URLs. Returns the number of listings updated."""
+    updated = 0
+    async for listing in db.listings.find({}, {"_id": 0, "id": 1, "images": 1, "videos": 1, "video": 1}):
+        images = listing.get('images') or []
+        videos = list(listing.get('videos') or [])
+        if listing.get('video'):
+            videos.append(listing['video'])
+        if not any(store.is_inline(v) or store.is_relative(v) for v in images + videos if v) and 'video' not in listing:
+            continue
+        try:
+            image_refs = [await store.save(v, 'image') if store.is_inline(v) else store.ref_for(v) for v in images if v]
+            video_refs = [await store.save(v, 'video') if store.is_inline(v) else store.ref_for(v) for v in videos if v]
+        except MediaError as e:
+            logger.warning("Listing %s left unchanged: %s", listing['id'], e)
+            continue
+        await db.listings.update_one({"id": listing['id']}, {
+            "$set": {
+                "images": [r['url'] for r in image_refs],
+                "image_ids": [r['id'] for r in image_refs],
+                "videos": [r['url'] for r in video_refs],
+                "video_ids": [r['id'] for r in video_refs],
+            },
+            "$unset": {"video": ""}
+        })
+        updated += 1
+    return updated
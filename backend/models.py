@@ -21,6 +21,10 @@ class SupportStatus(str, Enum):
     OPEN = "open"
     CLOSED = "closed"
 
+class ListingView(str, Enum):
+    CARD = "card"
+    FULL = "full"
+
 # User Models
 class UserCreate(BaseModel):
     name: str
@@ -38,6 +42,7 @@ class User(BaseModel):
     role: UserRole = UserRole.USER
     rating: float = 0.0
     review_count: int = 0
+    rating_histogram: Dict[str, int] = {}  # stars ("1".."5") -> count
     profile_image: Optional[str] = None
     phone_enabled: bool = False  # للاتصال الصوتي
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -50,7 +55,11 @@ class ListingCreate(BaseModel):
     category: str
     images: List[str] = []  # base64 encoded
     video: Optional[str] = None  # base64 encoded
+    videos: List[str] = []  # base64 encoded
     category_fields: Dict[str, Any] = {}  # حقول خاصة بكل فئة
+    location: Optional[str] = None  # city; coordinates are looked up if not given
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class Listing(BaseModel):
     id: str
@@ -60,16 +69,40 @@ class Listing(BaseModel):
     description: str
     price: float
     category: str
-    images: List[str] = []
+    images: List[str] = []  # media URLs
+    image_ids: List[str] = []
     videos: List[str] = []  # إضافة دعم الفيديوهات
+    video_ids: List[str] = []
     category_fields: Dict[str, Any] = {}
     views: int = 0
     negotiable: bool = False  # قابل للتفاوض
     location: Optional[str] = None  # الموقع (المدينة)
     latitude: Optional[float] = None  # خط العرض
     longitude: Optional[float] = None  # خط الطول
+    distance_km: Optional[float] = None  # only set by radius searches
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Compact listing used by feeds and grids (only the first image)
+class ListingSummary(BaseModel):
+    id: str
+    seller_id: str
+    title: str
+    price: float
+    category: str
+    images: List[str] = []
+    image_ids: List[str] = []
+    views: int = 0
+    negotiable: bool = False
+    location: Optional[str] = None
+    distance_km: Optional[float] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+LISTING_CARD_PROJECTION = {
+    "_id": 0, "id": 1, "seller_id": 1, "title": 1, "price": 1, "category": 1,
+    "views": 1, "negotiable": 1, "location": 1, "created_at": 1,
+    "images": {"$slice": 1}, "image_ids": {"$slice": 1},
+}
+
 # Message Models
 class MessageCreate(BaseModel):
     to_user_id: str
@@ -165,3 +198,6 @@ class Favorite(BaseModel):
     user_id: str
     listing_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class FavoriteCheck(BaseModel):
+    listing_ids: List[str]
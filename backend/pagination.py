@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo import DESCENDING
+
+# Newest first; `id` breaks ties between documents created in the same millisecond
+KEYSET_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, doc_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), doc_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, doc_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(doc_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Ungültiger Cursor")
+
+
+def cursor_query(query: dict, cursor: Optional[str]) -> dict:
+    """Restrict `query` to documents strictly after `cursor` in KEYSET_SORT order."""
+    if not cursor:
+        return query
+    created_at, doc_id = decode_cursor(cursor)
+    after = {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}},
+    ]}
+    return {"$and": [query, after]} if query else after
+
+
+def next_cursor(docs: List[dict], limit: int) -> Optional[str]:
+    """Cursor for the page after `docs`, or None if this was the last page."""
+    if not docs or len(docs) < limit:
+        return None
+    last = docs[-1]
+    return encode_cursor(last['created_at'], last['id'])
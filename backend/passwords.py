@@ -0,0 +1,86 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_COST_RE = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded thread pool so hashing never blocks the event loop.
+
+    bcrypt releases the GIL, so `max_workers` threads hash in parallel. Calls beyond that wait in
+    the pool queue; with `max_queue` > 0 further calls are rejected instead of piling up.
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 4, max_queue: int = 0):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        self.pending = 0  # only touched on the event loop
+        self.running = 0  # updated by the pool threads, under running_lock
+        self.running_lock = threading.Lock()
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self.pending - self.running
+
+    async def run(self, fn, *args):
+        if self.max_queue and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self.pending += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.pending - self.max_workers)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self._tracked, fn, args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def _tracked(self, fn, args):
+        with self.running_lock:
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self.running_lock:
+                self.running -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(self._hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(self._verify, password, hashed)
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True if `hashed` was produced with a different work factor than the current one."""
+        match = BCRYPT_COST_RE.match(hashed)
+        return not match or int(match.group(1)) != self.rounds
+
+    def metrics(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,225 @@
+import asyncio
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalog import CATEGORIES
+from facets import parse_number
+
+PRICE_INDEX_VERSION = 1
+MIN_SAMPLES = 5
+MIN_FIT_SAMPLES = 20
+# Numeric fields that shift estimates (age, wear, size); "log" fields are compared on a log scale
+NUMERIC_FIELDS = {"year": "linear", "year_built": "linear", "mileage": "linear", "area": "log", "power": "log"}
+FREE_TEXT_BUCKET_FIELDS = ("brand", "model")
+# Confidence multiplier per bucket level
+SPECIFICITY = {"combo": 1.0, "attribute": 0.85, "category": 0.7}
+
+
+def _bucket_fields() -> Dict[str, List[str]]:
+    fields = {}
+    for category in CATEGORIES:
+        fields[category['id']] = [
+            f['name'] for f in category['fields']
+            if f['type'] in ('select', 'select_dynamic') or (f['type'] == 'text' and f['name'] in FREE_TEXT_BUCKET_FIELDS)
+        ]
+    return fields
+
+
+BUCKET_FIELDS = _bucket_fields()
+
+
+def _value(value: Any) -> Optional[str]:
+    value = ' '.join(str(value).casefold().split()) if value is not None else ''
+    return value or None
+
+
+def _number(value: Any) -> Optional[float]:
+    number = parse_number(value)
+    return float(number) if number is not None and number > 0 else None
+
+
+def _feature(field: str, number: float) -> float:
+    return math.log(number) if NUMERIC_FIELDS[field] == 'log' else number
+
+
+def bucket_keys(category: str, fields: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(level, key) of every bucket a listing with `fields` falls into, most specific first."""
+    values = {name: _value(fields.get(name)) for name in BUCKET_FIELDS.get(category, [])}
+    keys = []
+    if values.get('brand') and values.get('model'):
+        keys.append(("combo", f"{category}|brand={values['brand']}|model={values['model']}"))
+    keys.extend(("attribute", f"{category}|{name}={value}") for name, value in values.items() if value)
+    keys.append(("category", category))
+    return keys
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    position = (len(ordered) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _fit(points: List[Tuple[float, float]]) -> Optional[Dict[str, float]]:
+    """Least-squares slope of log(price) against a feature, with the correlation coefficient."""
+    if len(points) < MIN_FIT_SAMPLES:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    var_y = sum((y - mean_y) ** 2 for _, y in points)
+    if not var_x or not var_y:
+        return None
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return {"slope": cov / var_x, "r": cov / math.sqrt(var_x * var_y)}
+
+
+def _stats(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {"median": _quantile(values, 0.5), "q1": _quantile(values, 0.25), "q3": _quantile(values, 0.75)}
+
+
+async def build_price_index(db) -> dict:
+    """Read the priced listings and compute the index from them in a thread, off the event loop."""
+    cursor = db.listings.find({"price": {"$gt": 0}}, {"_id": 0, "category": 1, "price": 1, "category_fields": 1})
+    listings = await cursor.to_list(None)
+    return await asyncio.to_thread(compute_price_index, listings)
+
+
+def compute_price_index(listings: List[dict]) -> dict:
+    """Aggregate priced listings into bucket statistics and per-category numeric slopes.
+
+    Each bucket keeps raw price quartiles plus, where possible, quartiles of prices normalized to the
+    bucket's median value of the category's strongest numeric predictor (e.g. year), so estimates that
+    adjust for that field get the narrower residual range.
+    """
+    samples: Dict[str, List[Tuple[float, Dict[str, float]]]] = defaultdict(list)
+    points: Dict[str, Dict[str, List[Tuple[float, float]]]] = defaultdict(lambda: defaultdict(list))
+    for listing in listings:
+        fields = listing.get('category_fields') or {}
+        category = listing['category']
+        numbers = {field: n for field, n in ((f, _number(fields.get(f))) for f in NUMERIC_FIELDS) if n is not None}
+        for field, number in numbers.items():
+            points[category][field].append((_feature(field, number), math.log(listing['price'])))
+        for _, key in bucket_keys(category, fields):
+            samples[key].append((listing['price'], numbers))
+
+    slopes = {}
+    for category, by_field in points.items():
+        fits = {field: fit for field, fit in ((f, _fit(p)) for f, p in by_field.items()) if fit}
+        if fits:
+            slopes[category] = fits
+
+    buckets = []
+    for key, rows in samples.items():
+        if len(rows) < MIN_SAMPLES:
+            continue
+        bucket = {"key": key, "n": len(rows), **_stats([price for price, _ in rows]), "refs": {}}
+        for field in NUMERIC_FIELDS:
+            values = [numbers[field] for _, numbers in rows if field in numbers]
+            if len(values) >= MIN_SAMPLES:
+                bucket['refs'][field] = _stats(values)['median']
+        fits = slopes.get(key.split('|', 1)[0], {})
+        primary = max((f for f in fits if f in bucket['refs']), key=lambda f: abs(fits[f]['r']), default=None)
+        if primary:
+            slope, ref = fits[primary]['slope'], _feature(primary, bucket['refs'][primary])
+            adjusted = [price * math.exp(-slope * (_feature(primary, numbers[primary]) - ref)) for price, numbers in rows if primary in numbers]
+            if len(adjusted) >= MIN_SAMPLES:
+                bucket['adjusted'] = {"field": primary, **_stats(adjusted)}
+        buckets.append(bucket)
+    return {
+        "_id": "current",
+        "version": PRICE_INDEX_VERSION,
+        "built_at": datetime.utcnow(),
+        "listings": len(listings),
+        "buckets": buckets,
+        "slopes": slopes,
+    }
+
+
+class PriceEstimator:
+    """Serves price estimates from the precomputed index held in memory."""
+
+    def __init__(self):
+        self.buckets: Dict[str, dict] = {}
+        self.slopes: Dict[str, Dict[str, dict]] = {}
+        self.built_at: Optional[datetime] = None
+
+    def load(self, index: dict) -> None:
+        # Bucket keys contain user-entered values, so they are stored as a list rather than as field names
+        self.buckets = {bucket['key']: bucket for bucket in index['buckets']}
+        self.slopes = index['slopes']
+        self.built_at = index['built_at']
+
+    async def refresh(self, db, max_age: timedelta) -> bool:
+        """Load the stored index if it is newer than the one held. False if it is missing, outdated or older than `max_age`.
+
+        Building the index scans every listing, so that is left to the `rebuild-price-index` job or
+        `manage.py rebuild-price-index` rather than done in each web worker.
+        """
+        index = await db.price_index.find_one({"_id": "current", "version": PRICE_INDEX_VERSION}, {"_id": 0, "built_at": 1})
+        if not index:
+            return False
+        if self.built_at is None or index['built_at'] > self.built_at:
+            self.load(await db.price_index.find_one({"_id": "current"}))
+        return self.built_at >= datetime.utcnow() - max_age
+
+    async def rebuild(self, db) -> dict:
+        index = await build_price_index(db)
+        await db.price_index.replace_one({"_id": "current"}, index, upsert=True)
+        self.load(index)
+        return index
+
+    def estimate(self, category: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        buckets = self.buckets
+        candidates = [(level, key, buckets[key]) for level, key in bucket_keys(category, fields) if key in buckets]
+        if not candidates:
+            return None
+        combo = [c for c in candidates if c[0] == 'combo']
+        attributes = [c for c in candidates if c[0] == 'attribute']
+        if combo:
+            level, key, bucket = combo[0]
+        elif attributes:
+            # The attribute that splits prices best: the tightest relative spread
+            level, key, bucket = min(attributes, key=lambda c: (c[2]['q3'] - c[2]['q1']) / c[2]['median'])
+        else:
+            level, key, bucket = candidates[-1]
+
+        factor, field = self._numeric_factor(category, fields, bucket)
+        stats = bucket['adjusted'] if field and bucket.get('adjusted', {}).get('field') == field else bucket
+        category_bucket = buckets.get(category)
+        condition = _value(fields.get('condition'))
+        condition_bucket = buckets.get(f"{category}|condition={condition}") if condition else None
+        if condition_bucket and category_bucket and not key.endswith(f"|condition={condition}"):
+            factor *= condition_bucket['median'] / category_bucket['median']
+        factor = min(max(factor, 0.25), 4.0)
+
+        spread = (stats['q3'] - stats['q1']) / stats['median']
+        confidence = bucket['n'] / (bucket['n'] + 10) / (1 + spread) * SPECIFICITY[level]
+        digits = -1 if stats['median'] * factor >= 100 else 0
+        return {
+            "min": round(stats['q1'] * factor, digits),
+            "max": round(stats['q3'] * factor, digits),
+            "median": round(stats['median'] * factor, digits),
+            "confidence": round(confidence, 2),
+            "sample_size": bucket['n'],
+            "basis": key,
+        }
+
+    def _numeric_factor(self, category: str, fields: Dict[str, Any], bucket: dict) -> Tuple[float, Optional[str]]:
+        """Shift for the single strongest numeric predictor the request provides, and that field."""
+        best = None
+        for field, fit in self.slopes.get(category, {}).items():
+            number = _number(fields.get(field))
+            ref = bucket['refs'].get(field)
+            if number is None or ref is None:
+                continue
+            if best is None or abs(fit['r']) > abs(best[1]['r']):
+                best = (field, fit, number, ref)
+        if best is None:
+            return 1.0, None
+        field, fit, number, ref = best
+        return math.exp(fit['slope'] * (_feature(field, number) - _feature(field, ref))), field
@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Iterable
+
+from pymongo import UpdateOne
+
+STARS = range(1, 6)
+
+
+def _rating_update(rating: int, sign: int) -> list:
+    """Pipeline update adding (sign=1) or removing (sign=-1) one review of `rating` stars."""
+    return [
+        {"$set": {
+            # Users rated before the incremental fields existed start from rating * review_count
+            "rating_sum": {"$add": [
+                {"$ifNull": ["$rating_sum", {"$multiply": [{"$ifNull": ["$rating", 0]}, {"$ifNull": ["$review_count", 0]}]}]},
+                sign * rating
+            ]},
+            "review_count": {"$max": [{"$add": [{"$ifNull": ["$review_count", 0]}, sign]}, 0]},
+            f"rating_histogram.{rating}": {"$max": [{"$add": [{"$ifNull": [f"$rating_histogram.{rating}", 0]}, sign]}, 0]},
+            "reviews_updated_at": "$$NOW",
+        }},
+        {"$set": {
+            "rating": {"$cond": [{"$gt": ["$review_count", 0]}, {"$divide": ["$rating_sum", "$review_count"]}, 0.0]},
+            "rating_sum": {"$cond": [{"$gt": ["$review_count", 0]}, "$rating_sum", 0]},
+        }},
+    ]
+
+
+async def add_review(db, user_id: str, rating: int) -> None:
+    await db.users.update_one({"id": user_id}, _rating_update(rating, 1))
+
+
+async def remove_reviews(db, reviews: Iterable[dict]) -> None:
+    """Take deleted reviews out of the reviewed users' aggregates."""
+    updates = [UpdateOne({"id": r['reviewed_user_id']}, _rating_update(r['rating'], -1)) for r in reviews if r['rating'] in STARS]
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+
+
+async def recompute_ratings(db) -> int:
+    """Rebuild rating_sum, review_count, rating_histogram and rating for every user from `reviews`."""
+    pipeline = [{"$group": {"_id": {"user_id": "$reviewed_user_id", "rating": "$rating"}, "count": {"$sum": 1}}}]
+    stats = {}
+    now = datetime.utcnow()
+    async for row in db.reviews.aggregate(pipeline, allowDiskUse=True):
+        user_stats = stats.setdefault(row['_id']['user_id'], {"rating_sum": 0, "review_count": 0, "rating_histogram": {}})
+        user_stats['rating_sum'] += row['_id']['rating'] * row['count']
+        user_stats['review_count'] += row['count']
+        user_stats['rating_histogram'][str(row['_id']['rating'])] = row['count']
+    updates = [
+        UpdateOne({"id": user_id}, {"$set": {**s, "rating": s['rating_sum'] / s['review_count'], "reviews_updated_at": now}})
+        for user_id, s in stats.items()
+    ]
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+    await db.users.update_many(
+        {"id": {"$nin": list(stats)}, "review_count": {"$ne": 0}},
+        {"$set": {"rating_sum": 0, "review_count": 0, "rating_histogram": {}, "rating": 0.0, "reviews_updated_at": now}}
+    )
+    return len(stats)
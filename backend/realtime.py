@@ -0,0 +1,74 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Optional, Set
+
+
+class Subscription:
+    """Queue of events for one subscriber. Iterate it to receive events; close() when done."""
+
+    def __init__(self, broker: 'Broker', channel: str, max_pending: int = 100):
+        self.broker = broker
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+
+    def deliver(self, event: dict) -> None:
+        if self.queue.full():
+            # Slow consumer: drop the oldest event rather than blocking publishers
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.queue.get()
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self) -> None:
+        await self.broker.unsubscribe(self)
+
+
+class Broker(ABC):
+    """Pub/sub transport. Implementations backed by a shared bus (e.g. Redis) fan events out across workers."""
+
+    @abstractmethod
+    async def publish(self, channel: str, event: dict) -> None: ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str) -> Subscription: ...
+
+    @abstractmethod
+    async def unsubscribe(self, subscription: Subscription) -> None: ...
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker; also used in tests."""
+
+    def __init__(self):
+        self.subscriptions: Dict[str, Set[Subscription]] = {}
+
+    async def publish(self, channel: str, event: dict) -> None:
+        for subscription in list(self.subscriptions.get(channel, ())):
+            subscription.deliver(event)
+
+    async def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel)
+        self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self.subscriptions.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscriptions[subscription.channel]
+
+
+def user_channel(user_id: str) -> str:
+    return f"user:{user_id}"
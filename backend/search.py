@@ -0,0 +1,281 @@
+import heapq
+import logging
+import math
+import re
+import unicodedata
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import lru_cache
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'[0-9a-zäöüß]+')
+UMLAUTS = str.maketrans({'ä': 'a', 'ö': 'o', 'ü': 'u', 'ß': 'ss'})
+
+STOPWORDS = frozenset("""
+aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes auch auf aus bei bin bis
+bist da damit dann das dass dem den der des dessen die dies diese diesem diesen dieser dieses doch dort du durch ein
+eine einem einen einer eines es fur hat hatte ich ihr im in ist ja jede jedem jeden jeder jedes kein keine mit nach
+nicht noch nur oder ohne sehr sich sie sind so um und uns unter vom von vor war wie wir wird zu zum zur uber
+""".split())
+
+# field -> weight used for the weighted term frequency (BM25F-style)
+FIELD_WEIGHTS = {"title": 3.0, "description": 1.0, "category_fields": 1.5}
+SEARCH_INDEX_CHANNEL = "search:listings"
+INDEX_PROJECTION = {"_id": 0, "id": 1, "title": 1, "description": 1, "category": 1, "category_fields": 1, "created_at": 1}
+
+
+def fold(text: str) -> str:
+    """Lowercase, fold umlauts/ß and strip remaining diacritics."""
+    text = text.lower().translate(UMLAUTS)
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """CISTEM stemmer for German (Weissweiler & Fraser, 2017) on already folded input."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.startswith('ge') and len(word) >= 6:
+        word = word[2:]
+    word = word.replace('sch', '$').replace('ei', '%').replace('ie', '&')
+    word = re.sub(r'(.)\1', r'\1*', word)
+    while len(word) > 3:
+        if len(word) > 5 and word[-2:] in ('em', 'er', 'nd'):
+            word = word[:-2]
+        elif word[-1] in ('t', 'e', 's', 'n'):
+            word = word[:-1]
+        else:
+            break
+    word = re.sub(r'(.)\*', r'\1\1', word)
+    return word.replace('&', 'ie').replace('%', 'ei').replace('$', 'sch')
+
+
+def analyze(text: str) -> List[str]:
+    return [stem(t) for t in TOKEN_RE.findall(fold(text)) if t not in STOPWORDS]
+
+
+def listing_fields(listing: dict) -> Dict[str, str]:
+    values = (listing.get('category_fields') or {}).values()
+    return {
+        "title": listing.get('title') or '',
+        "description": listing.get('description') or '',
+        "category_fields": ' '.join(str(v) for v in values if isinstance(v, (str, int, float))),
+    }
+
+
+class SearchEngine(ABC):
+    """Full-text search over listings. Returns listing ids ordered by relevance."""
+
+    shared = False  # one index for all workers; otherwise `listen()` follows the changes published on the broker
+
+    async def setup(self, db) -> None:
+        pass
+
+    @abstractmethod
+    async def index_listing(self, listing: dict) -> None: ...
+
+    @abstractmethod
+    async def remove_listing(self, listing_id: str) -> None: ...
+
+    async def remove_listings(self, listing_ids: List[str]) -> None:
+        for listing_id in listing_ids:
+            await self.remove_listing(listing_id)
+
+    @abstractmethod
+    async def search(self, query: str, category: Optional[str] = None, skip: int = 0, limit: int = 20) -> List[str]: ...
+
+
+class InMemorySearchEngine(SearchEngine):
+    """Inverted index with BM25 ranking and a recency boost, rebuilt from Mongo at startup.
+
+    The index lives in the process, so it only sees the listings this process writes: run it with a
+    single worker (see `create_search_engine`). Changes are also published on `SEARCH_INDEX_CHANNEL`
+    as listing ids, and `listen()` applies those of other engines on the same broker, re-reading the
+    listings from Mongo; with the in-process broker that is only other engines in this process.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, recency_weight: float = 0.3, recency_half_life_days: float = 14.0, broker=None):
+        self.k1 = k1
+        self.b = b
+        self.recency_weight = recency_weight
+        self.recency_half_life = recency_half_life_days * 86400
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.doc_ids: Dict[str, int] = {}
+        self.docs: Dict[int, tuple] = {}  # internal id -> (listing id, category, created_at timestamp, terms)
+        self.lengths: Dict[int, float] = {}
+        self.total_length = 0.0
+        self.next_id = 0
+        self.db = None
+        self.broker = broker
+        self.origin = uuid.uuid4().hex
+        self.subscription = None
+
+    async def setup(self, db) -> None:
+        self.db = db
+        if self.broker is not None:
+            # Subscribed before loading, so changes made meanwhile by other workers are applied afterwards
+            self.subscription = await self.broker.subscribe(SEARCH_INDEX_CHANNEL)
+        async for listing in db.listings.find({}, INDEX_PROJECTION):
+            self.add(listing)
+
+    def add(self, listing: dict) -> None:
+        self.remove(listing['id'])
+        tf: Counter = Counter()
+        for field, text in listing_fields(listing).items():
+            for term in analyze(text):
+                tf[term] += FIELD_WEIGHTS[field]
+        created_at = listing.get('created_at')
+        timestamp = created_at.timestamp() if isinstance(created_at, datetime) else 0.0
+        doc = self.next_id
+        self.next_id += 1
+        length = sum(tf.values())
+        self.doc_ids[listing['id']] = doc
+        self.docs[doc] = (listing['id'], listing.get('category'), timestamp, tuple(tf))
+        self.lengths[doc] = length
+        self.total_length += length
+        for term, freq in tf.items():
+            self.postings.setdefault(term, {})[doc] = freq
+
+    def remove(self, listing_id: str) -> None:
+        doc = self.doc_ids.pop(listing_id, None)
+        if doc is None:
+            return
+        terms = self.docs.pop(doc)[3]
+        self.total_length -= self.lengths.pop(doc)
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc, None)
+                if not postings:
+                    del self.postings[term]
+
+    async def index_listing(self, listing: dict) -> None:
+        self.add(listing)
+        await self.publish(index=[listing['id']])
+
+    async def remove_listing(self, listing_id: str) -> None:
+        await self.remove_listings([listing_id])
+
+    async def remove_listings(self, listing_ids: List[str]) -> None:
+        for listing_id in listing_ids:
+            self.remove(listing_id)
+        await self.publish(remove=list(listing_ids))
+
+    async def publish(self, index: List[str] = (), remove: List[str] = ()) -> None:
+        if self.broker is not None:
+            await self.broker.publish(SEARCH_INDEX_CHANNEL, {"origin": self.origin, "index": list(index), "remove": list(remove)})
+
+    async def listen(self) -> None:
+        """Apply index changes broadcast by other workers until cancelled. Needs `setup()` first."""
+        if self.broker is None:
+            return
+        subscription = self.subscription or await self.broker.subscribe(SEARCH_INDEX_CHANNEL)
+        try:
+            async for event in subscription:
+                if event.get('origin') == self.origin:
+                    continue
+                for listing_id in event['remove']:
+                    self.remove(listing_id)
+                try:
+                    async for listing in self.db.listings.find({"id": {"$in": event['index']}}, INDEX_PROJECTION):
+                        self.add(listing)
+                except Exception as e:
+                    logger.error(f"Indexing listings {event['index']} from another worker failed: {e}")
+        finally:
+            await subscription.close()
+
+    def rank(self, query: str, category: Optional[str] = None, limit: int = 20, now: Optional[float] = None) -> List[tuple]:
+        """Return up to `limit` (score, listing id) pairs, best first."""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        k1, lengths = self.k1, self.lengths
+        k1_b = k1 * self.b / avg_length
+        k1_1b = k1 * (1 - self.b)
+        scores: Dict[int, float] = {}
+        for term in set(analyze(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5)) * (k1 + 1)
+            get = scores.get
+            for doc, freq in postings.items():
+                scores[doc] = get(doc, 0.0) + idf * freq / (freq + k1_1b + k1_b * lengths[doc])
+        now = now or datetime.utcnow().timestamp()
+        ranked = []
+        for doc, score in scores.items():
+            listing_id, doc_category, timestamp, _ = self.docs[doc]
+            if category and doc_category != category:
+                continue
+            age = max(now - timestamp, 0.0)
+            score *= 1 + self.recency_weight * 0.5 ** (age / self.recency_half_life)
+            ranked.append((score, listing_id))
+        return heapq.nlargest(limit, ranked)
+
+    async def search(self, query: str, category: Optional[str] = None, skip: int = 0, limit: int = 20) -> List[str]:
+        return [listing_id for _, listing_id in self.rank(query, category, skip + limit)[skip:]]
+
+
+class MongoTextSearchEngine(SearchEngine):
+    """Delegates to a MongoDB text index (German analyzer). Suitable when several workers share one index."""
+
+    shared = True
+
+    def __init__(self, db):
+        self.db = db
+
+    async def setup(self, db) -> None:
+        if await db.listings.find_one({"category_values": {"$exists": False}}, {"_id": 1}):
+            logger.warning("Some listings have no category_values, so their category fields are not searchable; run `manage.py backfill-search`")
+        await db.listings.create_index(
+            [("title", "text"), ("description", "text"), ("category_values", "text")],
+            name="listing_text", default_language="german",
+            weights={"title": 10, "category_values": 5, "description": 2}
+        )
+
+    async def index_listing(self, listing: dict) -> None:
+        await self.db.listings.update_one({"id": listing['id']}, {"$set": {"category_values": listing_fields(listing)['category_fields']}})
+
+    async def remove_listing(self, listing_id: str) -> None:
+        pass
+
+    async def search(self, query: str, category: Optional[str] = None, skip: int = 0, limit: int = 20) -> List[str]:
+        match = {"$text": {"$search": query}}
+        if category:
+            match['category'] = category
+        cursor = self.db.listings.find(match, {"_id": 0, "id": 1, "score": {"$meta": "textScore"}})
+        cursor = cursor.sort([("score", {"$meta": "textScore"}), ("created_at", -1)]).skip(skip).limit(limit)
+        return [doc['id'] async for doc in cursor]
+
+
+def create_search_engine(backend: str, db, broker=None, workers: int = 1) -> SearchEngine:
+    if backend == 'mongo':
+        return MongoTextSearchEngine(db)
+    if backend == 'memory':
+        if workers > 1:
+            raise ValueError(f"SEARCH_BACKEND=memory keeps one index per process and cannot serve {workers} workers; use SEARCH_BACKEND=mongo")
+        return InMemorySearchEngine(broker=broker)
+    raise ValueError(f"Unknown search backend: {backend}")
+
+
+async def backfill_category_values(db, batch_size: int = 1000) -> int:
+    """Set the text-indexed `category_values` of listings created before the Mongo backend was used. Returns the number updated."""
+    updated = 0
+    operations = []
+    async for listing in db.listings.find({}, {"_id": 1, "category_fields": 1, "category_values": 1}):
+        values = listing_fields(listing)['category_fields']
+        if values != listing.get('category_values'):
+            operations.append(UpdateOne({"_id": listing['_id']}, {"$set": {"category_values": values}}))
+        if len(operations) >= batch_size:
+            updated += (await db.listings.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await db.listings.bulk_write(operations, ordered=False)).modified_count
+    return updated
@@ -1,18 +1,44 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
+import json
+import asyncio
 import logging
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union
 import uuid
 from datetime import datetime, timedelta
-import bcrypt
 import jwt
 
 from models import *
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from indexes import ensure_indexes
+from conversations import (record_message, mark_conversation_read, aggregate_conversations, rebuild_conversations,
+                           increment_unread, uncount_unread, get_unread_total, reconcile_unread_counters, thread_messages, InvalidMessageCursor)
+from loader import RequestLoaders
+from pagination import KEYSET_SORT, NEXT_CURSOR_HEADER, InvalidCursor, cursor_query, next_cursor
+from media import MediaStore, LocalDiskBackend, MediaError, MEDIA_ID_RE, MEDIA_TYPES, media_base_url, parse_range
+from search import create_search_engine
+from ratings import add_review, remove_reviews, recompute_ratings
+from passwords import PasswordHasher, PasswordHasherBusy
+from usercache import UserCache
+from catalog import category_id, load_catalog
+from conditional import conditional, etag_matches, make_etag
+from views import ViewCounter, seller_view_stats
+from fastjson import rows_response, schema_projection
+from aigateway import AIGateway, AIUnavailable, create_provider, request_key
+from pricing import PriceEstimator
+from jobs import JobContext, JobQueue, JobRunner
+from geo import DEFAULT_RADIUS_KM, GEO_SEARCH_CANDIDATES, GeoError, listing_location, near_pipeline, search_center
+from facets import FACET_FIELDS, FACET_SEARCH_CANDIDATES, FacetError, facet_pipeline, facet_result, listing_attributes, parse_facet_filters
+from feedcache import FeedCache, create_feed_backend, feed_key
+from stats import StatsError, StatsRecorder, rebuild_stats, reconcile_open_tickets, stats_series
+from exports import EXPORTS, FORMATS, ExportError, encode_rows, export_fields, export_query, open_cursor, resume_cursor
+from realtime import InMemoryBroker, user_channel
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -24,6 +50,52 @@ db = client[os.environ['DB_NAME']]
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
 EMERGENT_LLM_KEY = os.getenv('EMERGENT_LLM_KEY')
+AI_PROVIDER = os.getenv('AI_PROVIDER', 'emergent')  # emergent | fake
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '4'))
+AI_TIMEOUT_SECONDS = float(os.getenv('AI_TIMEOUT_SECONDS', '20'))
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', '1000'))
+AI_CACHE_TTL_SECONDS = float(os.getenv('AI_CACHE_TTL_SECONDS', '86400'))
+PRICE_INDEX_REFRESH_SECONDS = float(os.getenv('PRICE_INDEX_REFRESH_SECONDS', '3600'))
+PRICE_INDEX_POLL_SECONDS = min(PRICE_INDEX_REFRESH_SECONDS, 300.0)  # how soon workers pick up an index rebuilt elsewhere
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '500'))
+JOB_BATCH_PAUSE_SECONDS = float(os.getenv('JOB_BATCH_PAUSE_SECONDS', '0.05'))  # throttle between delete batches
+PRICE_MIN_CONFIDENCE = float(os.getenv('PRICE_MIN_CONFIDENCE', '0.35'))  # below this the LLM is asked as well
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', str(ROOT_DIR / 'media'))
+MEDIA_BASE_URL = media_base_url(os.getenv('MEDIA_BASE_URL'), os.getenv('PUBLIC_BASE_URL'))  # absolute unless neither is set, see media_base_url
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'mongo')  # mongo (shared text index) | memory (BM25 in process, single worker only)
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))  # worker processes; uvicorn and gunicorn read it as well
+UNREAD_RECONCILE_SECONDS = float(os.getenv('UNREAD_RECONCILE_SECONDS', '0'))  # 0 = only at startup / via manage.py
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+VIEW_FLUSH_SECONDS = float(os.getenv('VIEW_FLUSH_SECONDS', '5'))
+VIEW_MAX_PENDING = int(os.getenv('VIEW_MAX_PENDING', '1000'))  # views that may be lost on a crash
+STATS_SNAPSHOT_SECONDS = float(os.getenv('STATS_SNAPSHOT_SECONDS', '60'))
+FAST_JSON = os.getenv('FAST_JSON', '0') == '1'  # encode list responses with orjson, skipping per-row models
+FEED_CACHE_BACKEND = os.getenv('FEED_CACHE_BACKEND', 'memory')  # memory | mongo (shared by all workers)
+FEED_CACHE_TTL_SECONDS = float(os.getenv('FEED_CACHE_TTL_SECONDS', '5'))  # 0 = off
+FEED_CACHE_SIZE = int(os.getenv('FEED_CACHE_SIZE', '256'))
+FAVORITE_CHECK_MAX = 500  # listing ids per batch favorite check
+MAX_PAGE_SIZE = 200  # limit of the paged list endpoints
+MAX_ADMIN_PAGE_SIZE = 1000
+CATALOG_CACHE_CONTROL = os.getenv('CATALOG_CACHE_CONTROL', 'public, max-age=86400, stale-while-revalidate=604800')
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', '4'))
+BCRYPT_MAX_QUEUE = int(os.getenv('BCRYPT_MAX_QUEUE', '0'))  # 0 = unbounded
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_BYTES = int(os.getenv('USER_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # profile images may be inline data URIs
+
+media_store = MediaStore(db, LocalDiskBackend(MEDIA_ROOT), MEDIA_BASE_URL)
+broker = InMemoryBroker()
+search_engine = create_search_engine(SEARCH_BACKEND, db, broker, WEB_CONCURRENCY)
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_QUEUE)
+user_cache = UserCache(db, broker, USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_BYTES)
+catalog = load_catalog()
+view_counter = ViewCounter(db, VIEW_MAX_PENDING)
+stats_recorder = StatsRecorder(db)
+feed_cache = FeedCache(create_feed_backend(FEED_CACHE_BACKEND, db, FEED_CACHE_SIZE), broker, FEED_CACHE_TTL_SECONDS)
+price_estimator = PriceEstimator()
+job_queue = JobQueue(db)
+ai_gateway = AIGateway(create_provider(AI_PROVIDER, EMERGENT_LLM_KEY), AI_MAX_CONCURRENCY, AI_TIMEOUT_SECONDS, AI_CACHE_SIZE, AI_CACHE_TTL_SECONDS)
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -31,11 +103,17 @@ api_router = APIRouter(prefix="/api")
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server ausgelastet, bitte später erneut versuchen")
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server ausgelastet, bitte später erneut versuchen")
 
 def create_token(user_id: str, email: str, role: str) -> str:
     payload = {'user_id': user_id, 'email': email, 'role': role, 'exp': datetime.utcnow() + timedelta(days=30)}
@@ -63,6 +141,30 @@ async def get_current_user_optional(authorization: Optional[str] = Header(None))
     except:
         return None
 
+def get_loaders(request: Request) -> RequestLoaders:
+    """Batched users/listings lookups shared by everything handling this request."""
+    if not hasattr(request.state, 'loaders'):
+        request.state.loaders = RequestLoaders(db, user_cache)
+    return request.state.loaders
+
+def model_rows(docs: list, model, response: Optional[Response] = None):
+    """List response for `docs`: orjson-encoded schema rows with FAST_JSON, pydantic models otherwise."""
+    if FAST_JSON:
+        return rows_response(docs, model, response)
+    return [model(**{k: v for k, v in doc.items() if k != '_id'}) for doc in docs]
+
+async def fetch_page(collection, query: dict, response: Response, cursor: Optional[str], skip: int, limit: int, projection: Optional[dict] = None) -> list:
+    """Newest-first page of `collection`; the cursor for the next page is returned in the X-Next-Cursor header."""
+    try:
+        query = cursor_query(query, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    docs = await collection.find(query, projection).sort(KEYSET_SORT).skip(skip).limit(limit).to_list(limit)
+    token = next_cursor(docs, limit)
+    if token:
+        response.headers[NEXT_CURSOR_HEADER] = token
+    return docs
+
 # ============= AUTH =============
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate):
@@ -79,16 +181,22 @@ async def register(user_data: UserCreate):
         "id": user_id,
         "name": user_data.name,
         "email": user_data.email,
-        "password": hash_password(user_data.password),
+        "password": await hash_password(user_data.password),
         "role": UserRole.USER,
         "rating": 0.0,
+        "rating_sum": 0,
         "review_count": 0,
+        "rating_histogram": {},
         "profile_image": None,
         "phone_enabled": False,
         "created_at": datetime.utcnow()
     }
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:  # registered concurrently since the check above
+        raise HTTPException(status_code=400, detail="E-Mail wird bereits verwendet")
+    stats_recorder.record('users')
     token = create_token(user_id, user_data.email, UserRole.USER)
     user_response = User(**{k: v for k, v in user_dict.items() if k != 'password'})
     return {"user": user_response, "token": token}
@@ -96,8 +204,11 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user['password']):
+    if not user or not await verify_password(credentials.password, user['password']):
         raise HTTPException(status_code=401, detail="E-Mail oder Passwort ist falsch")
+    if password_hasher.needs_rehash(user['password']):
+        # Work factor changed since this hash was created; upgrade it while we know the plaintext
+        await db.users.update_one({"id": user['id']}, {"$set": {"password": await hash_password(credentials.password)}})
     
     token = create_token(user['id'], user['email'], user['role'])
     user_response = User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
@@ -105,11 +216,10 @@ async def login(credentials: UserLogin):
 
 @api_router.get("/auth/profile")
 async def get_profile(current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": current_user['user_id']})
+    user = await user_cache.get(current_user['user_id'])
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
-    user_response = User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
-    return user_response
+    return User(**user)
 
 @api_router.put("/auth/profile")
 async def update_profile(profile_image: Optional[str] = None, phone_enabled: Optional[bool] = None, current_user: dict = Depends(get_current_user)):
@@ -120,7 +230,8 @@ async def update_profile(profile_image: Optional[str] = None, phone_enabled: Opt
         update_data['phone_enabled'] = phone_enabled
     if update_data:
         await db.users.update_one({"id": current_user['user_id']}, {"$set": update_data})
-    user = await db.users.find_one({"id": current_user['user_id']})
+        await user_cache.invalidate(current_user['user_id'])
+    user = await user_cache.get(current_user['user_id'])
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
     return User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
@@ -138,153 +249,46 @@ async def update_user_profile(profile_data: dict, current_user: dict = Depends(g
     
     if update_data:
         await db.users.update_one({"id": current_user['user_id']}, {"$set": update_data})
+        await user_cache.invalidate(current_user['user_id'])
     
-    user = await db.users.find_one({"id": current_user['user_id']})
+    user = await user_cache.get(current_user['user_id'])
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
-    return User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
+    return User(**user)
 
 # ============= CATEGORIES =============
 @api_router.get("/categories")
-async def get_categories():
-    categories = [
-        {
-            "id": "cars",
-            "name": "Autos",
-            "name_de": "Autos",
-            "icon": "car",
-            "fields": [
-                {"name": "brand", "label": "Marke", "type": "select", "options": ["Audi", "BMW", "Mercedes-Benz", "Volkswagen", "Opel", "Ford", "Toyota", "Honda", "Nissan", "Mazda", "Hyundai", "Kia", "Peugeot", "Renault", "Fiat", "Volvo", "Skoda", "Seat", "Porsche", "Tesla", "Andere"]},
-                {"name": "model", "label": "Modell", "type": "select_dynamic", "options": {
-                    "Audi": ["A1", "A3", "A4", "A5", "A6", "A7", "A8", "Q2", "Q3", "Q5", "Q7", "Q8", "TT", "R8", "e-tron"],
-                    "BMW": ["1er", "2er", "3er", "4er", "5er", "6er", "7er", "8er", "X1", "X2", "X3", "X4", "X5", "X6", "X7", "Z4", "i3", "i4", "iX"],
-                    "Mercedes-Benz": ["A-Klasse", "B-Klasse", "C-Klasse", "E-Klasse", "S-Klasse", "GLA", "GLB", "GLC", "GLE", "GLS", "CLA", "CLS", "AMG GT", "EQC", "EQS"],
-                    "Volkswagen": ["Polo", "Golf", "Passat", "Tiguan", "Touareg", "T-Roc", "T-Cross", "Arteon", "ID.3", "ID.4", "ID.5"],
-                    "Opel": ["Corsa", "Astra", "Insignia", "Mokka", "Crossland", "Grandland"],
-                    "Ford": ["Fiesta", "Focus", "Mondeo", "Kuga", "Puma", "Explorer", "Mustang"],
-                    "Toyota": ["Aygo", "Yaris", "Corolla", "Camry", "RAV4", "Highlander", "C-HR", "Prius"],
-                    "Honda": ["Jazz", "Civic", "Accord", "CR-V", "HR-V"],
-                    "Nissan": ["Micra", "Juke", "Qashqai", "X-Trail", "Leaf"],
-                    "Mazda": ["2", "3", "6", "CX-3", "CX-5", "CX-30", "MX-5"],
-                    "Andere": []
-                }},
-                {"name": "year", "label": "Baujahr", "type": "number"},
-                {"name": "mileage", "label": "Kilometerstand", "type": "number"},
-                {"name": "fuel_type", "label": "Kraftstoffart", "type": "select", "options": ["Benzin", "Diesel", "Elektro", "Hybrid", "Plug-in-Hybrid", "Erdgas (CNG)", "Autogas (LPG)"]},
-                {"name": "transmission", "label": "Getriebe", "type": "select", "options": ["Automatik", "Manuell", "Halbautomatik"]},
-                {"name": "power", "label": "Leistung (PS)", "type": "number"},
-                {"name": "doors", "label": "Türen", "type": "select", "options": ["2/3", "4/5", "6/7"]},
-                {"name": "seats", "label": "Sitze", "type": "number"},
-                {"name": "color", "label": "Farbe", "type": "select", "options": ["Schwarz", "Weiß", "Silber", "Grau", "Blau", "Rot", "Grün", "Gelb", "Braun", "Beige", "Orange", "Andere"]},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Neuwertig", "Gebraucht", "Beschädigt"]}
-            ]
-        },
-        {
-            "id": "electronics",
-            "name": "Elektronik",
-            "name_de": "Elektronik",
-            "icon": "laptop",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Smartphones", "Tablets", "Laptops", "Desktop-PCs", "Monitore", "Drucker", "Kameras", "TV & Audio", "Smart Home", "Zubehör", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "select", "options": ["Apple", "Samsung", "Huawei", "Xiaomi", "Sony", "LG", "Lenovo", "HP", "Dell", "Asus", "Acer", "Microsoft", "Canon", "Nikon", "Bose", "JBL", "Philips", "Andere"]},
-                {"name": "model", "label": "Modell", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Sehr gut", "Gut", "Akzeptabel", "Defekt"]},
-                {"name": "warranty", "label": "Garantie", "type": "select", "options": ["Mit Garantie", "Ohne Garantie"]},
-                {"name": "storage", "label": "Speicher", "type": "text"},
-                {"name": "color", "label": "Farbe", "type": "text"}
-            ]
-        },
-        {
-            "id": "real_estate",
-            "name": "Immobilien",
-            "name_de": "Immobilien",
-            "icon": "home",
-            "fields": [
-                {"name": "property_type", "label": "Immobilientyp", "type": "select", "options": ["Wohnung", "Haus", "Villa", "Grundstück", "Gewerbeimmobilie", "Büro", "Garage/Stellplatz", "Andere"]},
-                {"name": "listing_type", "label": "Angebotstyp", "type": "select", "options": ["Zu verkaufen", "Zu vermieten", "Zwischenmiete"]},
-                {"name": "area", "label": "Wohnfläche (m²)", "type": "number"},
-                {"name": "plot_area", "label": "Grundstücksfläche (m²)", "type": "number"},
-                {"name": "bedrooms", "label": "Schlafzimmer", "type": "number"},
-                {"name": "bathrooms", "label": "Badezimmer", "type": "number"},
-                {"name": "floor", "label": "Etage", "type": "text"},
-                {"name": "year_built", "label": "Baujahr", "type": "number"},
-                {"name": "heating", "label": "Heizung", "type": "select", "options": ["Zentralheizung", "Gasheizung", "Ölheizung", "Fernwärme", "Wärmepumpe", "Elektrisch", "Keine"]},
-                {"name": "parking", "label": "Parkplatz", "type": "select", "options": ["Garage", "Stellplatz", "Tiefgarage", "Keine"]},
-                {"name": "balcony", "label": "Balkon/Terrasse", "type": "select", "options": ["Ja", "Nein"]},
-                {"name": "elevator", "label": "Aufzug", "type": "select", "options": ["Ja", "Nein"]},
-                {"name": "location", "label": "Standort", "type": "text"}
-            ]
-        },
-        {
-            "id": "furniture",
-            "name": "Möbel",
-            "name_de": "Möbel",
-            "icon": "bed",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Wohnzimmer", "Schlafzimmer", "Küche", "Badezimmer", "Büro", "Kinderzimmer", "Garten", "Andere"]},
-                {"name": "type", "label": "Möbeltyp", "type": "select", "options": ["Sofa", "Sessel", "Tisch", "Stuhl", "Bett", "Schrank", "Regal", "Kommode", "Andere"]},
-                {"name": "material", "label": "Material", "type": "select", "options": ["Holz", "Metall", "Kunststoff", "Glas", "Stoff", "Leder", "Andere"]},
-                {"name": "color", "label": "Farbe", "type": "text"},
-                {"name": "dimensions", "label": "Maße (L×B×H in cm)", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
-            ]
-        },
-        {
-            "id": "fashion",
-            "name": "Mode",
-            "name_de": "Mode",
-            "icon": "shirt",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Oberbekleidung", "Hosen", "Kleider & Röcke", "Schuhe", "Accessoires", "Taschen", "Uhren", "Schmuck", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "text"},
-                {"name": "size", "label": "Größe", "type": "select", "options": ["XXS", "XS", "S", "M", "L", "XL", "XXL", "XXXL", "Andere"]},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu mit Etikett", "Neu ohne Etikett", "Wie neu", "Sehr gut", "Gut"]},
-                {"name": "gender", "label": "Geschlecht", "type": "select", "options": ["Herren", "Damen", "Unisex", "Kinder"]},
-                {"name": "color", "label": "Farbe", "type": "text"},
-                {"name": "material", "label": "Material", "type": "text"}
-            ]
-        },
-        {
-            "id": "sports",
-            "name": "Sport & Freizeit",
-            "name_de": "Sport & Freizeit",
-            "icon": "football",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Fitnessgeräte", "Fahrräder", "Camping & Outdoor", "Wintersport", "Wassersport", "Ballsport", "Sportbekleidung", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "text"},
-                {"name": "type", "label": "Typ", "type": "text"},
-                {"name": "size", "label": "Größe", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
-            ]
-        },
-        {
-            "id": "garden",
-            "name": "Garten & Heimwerk",
-            "name_de": "Garten & Heimwerk",
-            "icon": "hammer",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Gartengeräte", "Pflanzen", "Gartenmöbel", "Werkzeuge", "Baumaterial", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
-            ]
-        },
-        {
-            "id": "other",
-            "name": "Sonstiges",
-            "name_de": "Sonstiges",
-            "icon": "apps",
-            "fields": [
-                {"name": "type", "label": "Typ", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Gebraucht"]}
-            ]
-        }
-    ]
-    return categories
+async def get_categories(request: Request):
+    gzipped = 'gzip' in request.headers.get('accept-encoding', '')
+    headers = {"ETag": catalog.gzip_etag if gzipped else catalog.etag, "Cache-Control": CATALOG_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get('if-none-match'), catalog.etag, catalog.gzip_etag):
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        return Response(catalog.gzip_body, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(catalog.body, media_type="application/json", headers=headers)
 
 # ============= LISTINGS =============
+def listing_projection(view: ListingView) -> dict:
+    return LISTING_CARD_PROJECTION if view == ListingView.CARD else schema_projection(Listing)
+
+def listing_model(view: ListingView):
+    return ListingSummary if view == ListingView.CARD else Listing
+
+def listing_from_doc(listing: dict, view: ListingView = ListingView.FULL):
+    return listing_model(view)(**{k: v for k, v in listing.items() if k != '_id'})
+
 @api_router.post("/listings", response_model=Listing)
 async def create_listing(listing_data: ListingCreate, current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": current_user['user_id']})
+    user = await user_cache.get(current_user['user_id'])
+    try:
+        image_refs = await media_store.save_all(listing_data.images, 'image')
+        video_refs = await media_store.save_all(listing_data.videos + [listing_data.video], 'video')
+    except MediaError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        location = listing_location(listing_data.location, listing_data.latitude, listing_data.longitude, listing_data.category_fields)
+    except GeoError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     listing_id = str(uuid.uuid4())
     listing_dict = {
         "id": listing_id,
@@ -294,40 +298,111 @@ async def create_listing(listing_data: ListingCreate, current_user: dict = Depen
         "description": listing_data.description,
         "price": listing_data.price,
         "category": listing_data.category,
-        "images": listing_data.images,
-        "video": listing_data.video,
+        "images": [r['url'] for r in image_refs],
+        "image_ids": [r['id'] for r in image_refs],
+        "videos": [r['url'] for r in video_refs],
+        "video_ids": [r['id'] for r in video_refs],
         "category_fields": listing_data.category_fields,
+        "attributes": listing_attributes(listing_data.category, listing_data.category_fields),
         "views": 0,
+        **location,
         "created_at": datetime.utcnow()
     }
+    listing_dict['updated_at'] = listing_dict['created_at']
     await db.listings.insert_one(listing_dict)
-    return Listing(**{k: v for k, v in listing_dict.items() if k != '_id'})
+    stats_recorder.record('listings')
+    await feed_cache.invalidate(listing_dict['category'])
+    await search_engine.index_listing(listing_dict)
+    return listing_from_doc(listing_dict)
 
-@api_router.get("/listings", response_model=List[Listing])
-async def get_listings(category: Optional[str] = None, search: Optional[str] = None, skip: int = 0, limit: int = 20):
+@api_router.get("/listings", response_model=List[Union[ListingSummary, Listing]])
+async def get_listings(request: Request, response: Response, category: Optional[str] = None, search: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None, view: ListingView = ListingView.CARD,
+                       lat: Optional[float] = None, lng: Optional[float] = None, near: Optional[str] = None, radius_km: float = DEFAULT_RADIUS_KM):
+    try:
+        filters = parse_facet_filters(category, request.query_params)
+    except FacetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if lat is not None or lng is not None or near:
+        # Radius search: nearest first with distance_km, paged with skip
+        query = {"category": category, **filters} if category else {}
+        if search:
+            query['id'] = {"$in": await search_engine.search(search, category, 0, GEO_SEARCH_CANDIDATES)}
+        try:
+            pipeline = near_pipeline(search_center(lat, lng, near), radius_km, query, listing_projection(view), skip, limit)
+        except GeoError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        listings = await db.listings.aggregate(pipeline).to_list(limit)
+        return model_rows(listings, listing_model(view))
+    if search:
+        if filters:
+            # Filter the top-ranked candidates first, then page, so skip/limit count matching listings only
+            candidates = await search_engine.search(search, category, 0, FACET_SEARCH_CANDIDATES)
+            cursor = db.listings.find({"id": {"$in": candidates}, **filters}, {"_id": 0, "id": 1})
+            matching = {listing['id'] async for listing in cursor}
+            ids = [listing_id for listing_id in candidates if listing_id in matching][skip:skip + limit]
+        else:
+            ids = await search_engine.search(search, category, skip, limit)
+        listings = await db.listings.find({"id": {"$in": ids}, **filters}, listing_projection(view)).to_list(len(ids))
+        order = {listing_id: i for i, listing_id in enumerate(ids)}
+        listings.sort(key=lambda listing: order[listing['id']])
+        return model_rows(listings, listing_model(view))
     query = {}
     if category:
         query['category'] = category
+    query.update(filters)
+    if feed_cache.enabled and not (filters or cursor or skip):
+        # First page of a feed, the same for every visitor: served from the short-TTL cache
+        load = lambda: db.listings.find(query, listing_projection(view)).sort(KEYSET_SORT).limit(limit).to_list(limit)
+        listings = await feed_cache.get(feed_key(category, view.value, limit), category, load)
+        token = next_cursor(listings, limit)
+        if token:
+            response.headers[NEXT_CURSOR_HEADER] = token
+        return model_rows(listings, listing_model(view), response)
+    listings = await fetch_page(db.listings, query, response, cursor, skip, limit, listing_projection(view))
+    return model_rows(listings, listing_model(view), response)
+
+@api_router.get("/listings/facets")
+async def get_listing_facets(request: Request, response: Response, category: str, search: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+                             cursor: Optional[str] = None, view: ListingView = ListingView.CARD):
+    """Filtered page plus the counts per select option and the range of every number field, in one aggregation."""
+    if category not in FACET_FIELDS:
+        raise HTTPException(status_code=404, detail="Kategorie nicht gefunden")
+    base = {}
     if search:
-        query['$or'] = [
-            {'title': {'$regex': search, '$options': 'i'}},
-            {'description': {'$regex': search, '$options': 'i'}}
-        ]
-    listings = await db.listings.find(query).sort('created_at', -1).skip(skip).limit(limit).to_list(limit)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
-
-@api_router.get("/listings/my")
-async def get_my_listings(current_user: dict = Depends(get_current_user)):
-    listings = await db.listings.find({"seller_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
+        base['id'] = {"$in": await search_engine.search(search, category, 0, FACET_SEARCH_CANDIDATES)}
+    try:
+        pipeline = facet_pipeline(category, base, parse_facet_filters(category, request.query_params), listing_projection(view), cursor, skip, limit)
+    except (FacetError, InvalidCursor) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = await db.listings.aggregate(pipeline, allowDiskUse=True).to_list(1)
+    items, total, facets = facet_result(category, result[0])
+    token = next_cursor(items, limit)
+    if token:
+        response.headers[NEXT_CURSOR_HEADER] = token
+    return {"items": [listing_from_doc(item, view) for item in items], "total": total, "facets": facets}
+
+@api_router.get("/listings/my", response_model=List[Union[ListingSummary, Listing]])
+async def get_my_listings(response: Response, view: ListingView = ListingView.CARD, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
+    listings = await fetch_page(db.listings, {"seller_id": current_user['user_id']}, response, cursor, skip, limit, listing_projection(view))
+    return model_rows(listings, listing_model(view), response)
+
+@api_router.get("/listings/my/analytics")
+async def get_my_listing_analytics(hours: int = 168, current_user: dict = Depends(get_current_user)):
+    if not 1 <= hours <= 24 * 90:
+        raise HTTPException(status_code=400, detail="Zeitraum muss zwischen 1 und 2160 Stunden liegen")
+    return await seller_view_stats(db, current_user['user_id'], hours)
 
 @api_router.get("/listings/{listing_id}", response_model=Listing)
-async def get_listing(listing_id: str):
-    listing = await db.listings.find_one({"id": listing_id})
+async def get_listing(listing_id: str, request: Request, response: Response):
+    listing = await db.listings.find_one({"id": listing_id}, {"_id": 0})
     if not listing:
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
-    await db.listings.update_one({"id": listing_id}, {"$inc": {"views": 1}})
-    return Listing(**{k: v for k, v in listing.items() if k != '_id'})
+    listing['views'] = listing.get('views', 0) + view_counter.pending_for(listing_id)
+    view_counter.record(listing_id, listing['seller_id'])
+    # Weak validator: the view counter may differ between otherwise identical representations
+    stamp = listing.get('updated_at') or listing['created_at']
+    not_modified = conditional(request, response, make_etag('listing', listing_id, stamp.isoformat(), weak=True), stamp)
+    return not_modified or listing_from_doc(listing)
 
 @api_router.delete("/listings/{listing_id}")
 async def delete_listing(listing_id: str, current_user: dict = Depends(get_current_user)):
@@ -337,22 +412,62 @@ async def delete_listing(listing_id: str, current_user: dict = Depends(get_curre
     if listing['seller_id'] != current_user['user_id'] and current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
     await db.listings.delete_one({"id": listing_id})
+    await db.favorites.delete_many({"listing_id": listing_id})
+    await feed_cache.invalidate(listing['category'])
+    await search_engine.remove_listing(listing_id)
     return {"message": "Anzeige gelöscht"}
 
-# ============= MESSAGES =============
-@api_router.post("/messages/mark-read/{listing_id}/{other_user_id}")
-async def mark_messages_read(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
-    """Mark all messages from other_user_id as read"""
-    await db.messages.update_many(
-        {
-            "listing_id": listing_id,
-            "from_user_id": other_user_id,
-            "to_user_id": current_user['user_id'],
-            "read": False
-        },
-        {"$set": {"read": True}}
+# ============= MEDIA =============
+@api_router.get("/media/{media_id}")
+async def get_media(media_id: str, range_header: Optional[str] = Header(None, alias="Range"), if_none_match: Optional[str] = Header(None)):
+    if not MEDIA_ID_RE.match(media_id):
+        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    size = await media_store.backend.size(media_id)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    if etag_matches(if_none_match, f'"{media_id}"'):
+        return Response(status_code=304, headers={"ETag": if_none_match, "Cache-Control": "public, max-age=31536000, immutable"})
+    meta = await media_store.get_meta(media_id) or {}
+    try:
+        byte_range = parse_range(range_header, size)
+    except MediaError:
+        raise HTTPException(status_code=416, detail="Ungültiger Bereich", headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{media_id}"',
+        "Content-Length": str(end - start + 1),
+        "X-Content-Type-Options": "nosniff",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        media_store.backend.iter_range(media_id, start, end),
+        status_code=206 if byte_range else 200,
+        # Blobs stored before uploads were sniffed may carry any type the client claimed
+        media_type=meta['content_type'] if meta.get('content_type') in MEDIA_TYPES else 'application/octet-stream',
+        headers=headers
     )
-    return {"message": "Messages marked as read"}
+
+# ============= MESSAGES =============
+async def unread_count_for(user_id: str) -> int:
+    return await get_unread_total(db, user_id)
+
+async def notify(user_id: str, event_type: str, data) -> None:
+    await broker.publish(user_channel(user_id), {"type": event_type, "data": jsonable_encoder(data)})
+
+async def deliver_message(message_dict: dict) -> Message:
+    """Persist a message, update both conversations and push it to both participants."""
+    await db.messages.insert_one(message_dict)
+    stats_recorder.record('messages')
+    await record_message(db, message_dict)
+    await increment_unread(db, message_dict)
+    message = Message(**{k: v for k, v in message_dict.items() if k != '_id'})
+    await notify(message.to_user_id, "message.new", message)
+    await notify(message.from_user_id, "message.new", message)
+    await notify(message.to_user_id, "unread.count", {"count": await unread_count_for(message.to_user_id)})
+    return message
 
 @api_router.post("/messages")
 async def send_message(message_data: MessageCreate, current_user: dict = Depends(get_current_user)):
@@ -367,73 +482,119 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
         "read": False,
         "created_at": datetime.utcnow()
     }
-    await db.messages.insert_one(message_dict)
-    return Message(**{k: v for k, v in message_dict.items() if k != '_id'})
+    return await deliver_message(message_dict)
 
 @api_router.get("/messages/conversations")
-async def get_conversations(current_user: dict = Depends(get_current_user)):
+async def get_conversations(limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), loaders: RequestLoaders = Depends(get_loaders), current_user: dict = Depends(get_current_user)):
     user_id = current_user['user_id']
-    messages = await db.messages.find({"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]}).sort('created_at', -1).to_list(1000)
-    conversations = {}
-    for msg in messages:
-        other_user_id = msg['to_user_id'] if msg['from_user_id'] == user_id else msg['from_user_id']
-        conv_key = f"{other_user_id}_{msg['listing_id']}"
-        if conv_key not in conversations:
-            other_user = await db.users.find_one({"id": other_user_id})
-            listing = await db.listings.find_one({"id": msg['listing_id']})
-            
-            # Count unread messages from this user
-            unread_count = await db.messages.count_documents({
-                "listing_id": msg['listing_id'],
-                "from_user_id": other_user_id,
-                "to_user_id": user_id,
-                "read": False
-            })
-            
-            conversations[conv_key] = {
-                "other_user_id": other_user_id,
-                "other_user_name": other_user['name'] if other_user else "Gelöschter Benutzer",
-                "other_user_image": other_user.get('profile_image') if other_user else None,
-                "listing_id": msg['listing_id'],
-                "listing_title": listing['title'] if listing else "Gelöschte Anzeige",
-                "listing_image": listing['images'][0] if listing and listing.get('images') else None,
-                "last_message": msg['content'][:50],
-                "last_message_time": msg['created_at'],
-                "unread_count": unread_count
-            }
-    return list(conversations.values())
+    conversations = await db.conversations.find({"user_id": user_id}, {"_id": 0, "user_id": 0}).sort('last_message_time', -1).to_list(limit)
+    if not conversations:
+        # Nothing materialized yet for this user (e.g. before the backfill ran)
+        conversations = await aggregate_conversations(db, user_id, limit)
+    users, listings = await asyncio.gather(
+        loaders.users.load_many(c['other_user_id'] for c in conversations),
+        loaders.listings().load_many(c['listing_id'] for c in conversations)
+    )
+    result = []
+    for conv in conversations:
+        other_user = users.get(conv['other_user_id'])
+        listing = listings.get(conv['listing_id'])
+        result.append({
+            "other_user_id": conv['other_user_id'],
+            "other_user_name": other_user['name'] if other_user else "Gelöschter Benutzer",
+            "other_user_image": other_user.get('profile_image') if other_user else None,
+            "listing_id": conv['listing_id'],
+            "listing_title": listing['title'] if listing else "Gelöschte Anzeige",
+            "listing_image": listing['images'][0] if listing and listing.get('images') else None,
+            "last_message": conv['last_message'],
+            "last_message_time": conv['last_message_time'],
+            "unread_count": conv['unread_count']
+        })
+    return result
+
 @api_router.get("/messages/unread-count")
 async def get_unread_count(current_user: dict = Depends(get_current_user)):
     """Get count of unread messages"""
-    count = await db.messages.count_documents({
-        "to_user_id": current_user['user_id'],
-        "read": False
-    })
-    return {"count": count}
+    return {"count": await unread_count_for(current_user['user_id'])}
 
-@api_router.post("/messages/mark-read/{listing_id}/{other_user_id}")
-async def mark_messages_read(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
-    """Mark messages as read when user opens a conversation"""
-    user_id = current_user['user_id']
-    await db.messages.update_many({
+async def mark_thread_read(user_id: str, other_user_id: str, listing_id: str) -> int:
+    result = await db.messages.update_many({
         "listing_id": listing_id,
         "from_user_id": other_user_id,
         "to_user_id": user_id,
         "read": False
     }, {"$set": {"read": True}})
+    await mark_conversation_read(db, user_id, other_user_id, listing_id, result.modified_count)
+    if result.modified_count:
+        await notify(user_id, "unread.count", {"count": await unread_count_for(user_id)})
+        await notify(other_user_id, "messages.read", {"listing_id": listing_id, "reader_id": user_id})
+    return result.modified_count
+
+@api_router.post("/messages/mark-read/{listing_id}/{other_user_id}")
+async def mark_messages_read(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
+    """Mark messages as read when user opens a conversation"""
+    await mark_thread_read(current_user['user_id'], other_user_id, listing_id)
     return {"message": "Messages marked as read"}
 
-@api_router.get("/messages/{listing_id}/{other_user_id}")
-async def get_conversation_messages(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
+@api_router.get("/messages/{listing_id}/{other_user_id}", response_model=List[Message])
+async def get_conversation_messages(listing_id: str, other_user_id: str, since: Optional[str] = None, before: Optional[str] = None,
+                                    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), mark_read: bool = False, current_user: dict = Depends(get_current_user)):
+    """Newest `limit` messages, oldest first. Poll with `since` = id of the last message held, page back with `before` =
+    id of the oldest; `mark_read` marks the thread read in the same request."""
     user_id = current_user['user_id']
-    messages = await db.messages.find({
-        "listing_id": listing_id,
-        "$or": [
-            {"from_user_id": user_id, "to_user_id": other_user_id},
-            {"from_user_id": other_user_id, "to_user_id": user_id}
-        ]
-    }).sort('created_at', 1).to_list(100)  # Limit to last 100 messages for speed
-    return [Message(**{k: v for k, v in msg.items() if k != '_id'}) for msg in messages]
+    if mark_read:
+        await mark_thread_read(user_id, other_user_id, listing_id)
+    try:
+        messages = await thread_messages(db, listing_id, user_id, other_user_id, schema_projection(Message), since, before, limit)
+    except InvalidMessageCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return model_rows(messages, Message)
+
+# ============= REALTIME =============
+@api_router.websocket("/ws")
+async def realtime_socket(websocket: WebSocket, token: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    """Push channel for new messages, unread counts and offer updates. Authenticate with ?token= or a Bearer header."""
+    try:
+        current_user = await get_current_user(authorization or (f"Bearer {token}" if token else None))
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = await broker.subscribe(user_channel(current_user['user_id']))
+
+    async def forward():
+        await websocket.send_json({"type": "unread.count", "data": {"count": await unread_count_for(current_user['user_id'])}})
+        async for event in subscription:
+            await websocket.send_json(event)
+
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            await websocket.receive_text()  # client keepalive pings; raises on disconnect
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        await subscription.close()
+
+@api_router.get("/events")
+async def realtime_events(request: Request, current_user: dict = Depends(get_current_user)):
+    """Server-sent events fallback for clients that cannot hold a WebSocket."""
+    subscription = await broker.subscribe(user_channel(current_user['user_id']))
+
+    async def stream():
+        try:
+            yield f"event: unread.count\ndata: {json.dumps({'count': await unread_count_for(current_user['user_id'])})}\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.get(SSE_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            await subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ============= OFFERS =============
 @api_router.post("/offers")
@@ -450,7 +611,8 @@ async def create_offer(offer_data: OfferCreate, current_user: dict = Depends(get
         "created_at": datetime.utcnow()
     }
     await db.offers.insert_one(offer_dict)
-    buyer = await db.users.find_one({"id": current_user['user_id']})
+    stats_recorder.record('offers')
+    buyer = await user_cache.get(current_user['user_id'])
     auto_message = f"Neues Angebot von {buyer['name']}: €{offer_data.offered_price} - {offer_data.message or ''}"
     message_id = str(uuid.uuid4())
     message_dict = {
@@ -463,27 +625,37 @@ async def create_offer(offer_data: OfferCreate, current_user: dict = Depends(get
         "read": False,
         "created_at": datetime.utcnow()
     }
-    await db.messages.insert_one(message_dict)
-    return Offer(**{k: v for k, v in offer_dict.items() if k != '_id'})
+    await deliver_message(message_dict)
+    offer = Offer(**{k: v for k, v in offer_dict.items() if k != '_id'})
+    await notify(offer.seller_id, "offer.new", offer)
+    return offer
 
 @api_router.get("/offers/received")
-async def get_received_offers(current_user: dict = Depends(get_current_user)):
-    offers = await db.offers.find({"seller_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
+async def get_received_offers(response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), loaders: RequestLoaders = Depends(get_loaders), current_user: dict = Depends(get_current_user)):
+    offers = await fetch_page(db.offers, {"seller_id": current_user['user_id']}, response, cursor, skip, limit)
+    buyers, listings = await asyncio.gather(
+        loaders.users.load_many(o['buyer_id'] for o in offers),
+        loaders.listings().load_many(o['listing_id'] for o in offers)
+    )
     result = []
     for offer in offers:
-        buyer = await db.users.find_one({"id": offer['buyer_id']})
-        listing = await db.listings.find_one({"id": offer['listing_id']})
+        buyer = buyers[offer['buyer_id']]
+        listing = listings[offer['listing_id']]
         result.append({**{k: v for k, v in offer.items() if k != '_id'}, "buyer_name": buyer['name'] if buyer else "Gelöschter Benutzer", "listing_title": listing['title'] if listing else "Gelöschte Anzeige"})
     return result
 
 @api_router.get("/offers/my")
-async def get_my_offers(current_user: dict = Depends(get_current_user)):
+async def get_my_offers(response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), loaders: RequestLoaders = Depends(get_loaders), current_user: dict = Depends(get_current_user)):
     """Get all offers received by the current user (as seller)"""
-    offers = await db.offers.find({"seller_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
+    offers = await fetch_page(db.offers, {"seller_id": current_user['user_id']}, response, cursor, skip, limit)
+    buyers, listings = await asyncio.gather(
+        loaders.users.load_many(o['buyer_id'] for o in offers),
+        loaders.listings().load_many(o['listing_id'] for o in offers)
+    )
     result = []
     for offer in offers:
-        buyer = await db.users.find_one({"id": offer['buyer_id']})
-        listing = await db.listings.find_one({"id": offer['listing_id']})
+        buyer = buyers[offer['buyer_id']]
+        listing = listings[offer['listing_id']]
         listing_image = listing['images'][0] if listing and listing.get('images') else None
         result.append({
             **{k: v for k, v in offer.items() if k != '_id'}, 
@@ -495,17 +667,21 @@ async def get_my_offers(current_user: dict = Depends(get_current_user)):
     return result
 
 @api_router.get("/offers/sent")
-async def get_sent_offers(current_user: dict = Depends(get_current_user)):
-    offers = await db.offers.find({"buyer_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
+async def get_sent_offers(response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), loaders: RequestLoaders = Depends(get_loaders), current_user: dict = Depends(get_current_user)):
+    offers = await fetch_page(db.offers, {"buyer_id": current_user['user_id']}, response, cursor, skip, limit)
+    sellers, listings = await asyncio.gather(
+        loaders.users.load_many(o['seller_id'] for o in offers),
+        loaders.listings().load_many(o['listing_id'] for o in offers)
+    )
     result = []
     for offer in offers:
-        seller = await db.users.find_one({"id": offer['seller_id']})
-        listing = await db.listings.find_one({"id": offer['listing_id']})
+        seller = sellers[offer['seller_id']]
+        listing = listings[offer['listing_id']]
         result.append({**{k: v for k, v in offer.items() if k != '_id'}, "seller_name": seller['name'] if seller else "Gelöschter Benutzer", "listing_title": listing['title'] if listing else "Gelöschte Anzeige"})
     return result
 
 @api_router.post("/offers/action")
-async def handle_offer_action(action_data: OfferAction, current_user: dict = Depends(get_current_user)):
+async def handle_offer_action(action_data: OfferAction, loaders: RequestLoaders = Depends(get_loaders), current_user: dict = Depends(get_current_user)):
     offer = await db.offers.find_one({"id": action_data.offer_id})
     if not offer:
         raise HTTPException(status_code=404, detail="Angebot nicht gefunden")
@@ -513,7 +689,7 @@ async def handle_offer_action(action_data: OfferAction, current_user: dict = Dep
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
     new_status = OfferStatus.ACCEPTED if action_data.action == "accept" else OfferStatus.REJECTED
     await db.offers.update_one({"id": action_data.offer_id}, {"$set": {"status": new_status}})
-    listing = await db.listings.find_one({"id": offer['listing_id']})
+    listing = await loaders.listings().load(offer['listing_id'])
     auto_message = f"{'✅ Ihr Angebot wurde angenommen!' if new_status == OfferStatus.ACCEPTED else '❌ Ihr Angebot wurde abgelehnt'} - {listing['title'] if listing else ''}"
     message_id = str(uuid.uuid4())
     message_dict = {
@@ -526,16 +702,19 @@ async def handle_offer_action(action_data: OfferAction, current_user: dict = Dep
         "read": False,
         "created_at": datetime.utcnow()
     }
-    await db.messages.insert_one(message_dict)
+    await deliver_message(message_dict)
+    await notify(offer['buyer_id'], "offer.status", {"offer_id": offer['id'], "listing_id": offer['listing_id'], "status": new_status})
     return {"message": "Angebot aktualisiert", "status": new_status}
 
 # ============= REVIEWS =============
 @api_router.post("/reviews")
 async def create_review(review_data: ReviewCreate, current_user: dict = Depends(get_current_user)):
+    if review_data.rating not in range(1, 6):
+        raise HTTPException(status_code=400, detail="Bewertung muss zwischen 1 und 5 liegen")
     existing = await db.reviews.find_one({"reviewer_id": current_user['user_id'], "reviewed_user_id": review_data.reviewed_user_id})
     if existing:
         raise HTTPException(status_code=400, detail="Sie haben diesen Benutzer bereits bewertet")
-    reviewer = await db.users.find_one({"id": current_user['user_id']})
+    reviewer = await user_cache.get(current_user['user_id'])
     review_id = str(uuid.uuid4())
     review_dict = {
         "id": review_id,
@@ -547,55 +726,72 @@ async def create_review(review_data: ReviewCreate, current_user: dict = Depends(
         "created_at": datetime.utcnow()
     }
     await db.reviews.insert_one(review_dict)
-    all_reviews = await db.reviews.find({"reviewed_user_id": review_data.reviewed_user_id}).to_list(1000)
-    avg_rating = sum(r['rating'] for r in all_reviews) / len(all_reviews)
-    await db.users.update_one({"id": review_data.reviewed_user_id}, {"$set": {"rating": avg_rating, "review_count": len(all_reviews)}})
+    await add_review(db, review_data.reviewed_user_id, review_data.rating)
+    await user_cache.invalidate(review_data.reviewed_user_id)
     return Review(**{k: v for k, v in review_dict.items() if k != '_id'})
 
-@api_router.get("/reviews/{user_id}")
-async def get_user_reviews(user_id: str):
-    reviews = await db.reviews.find({"reviewed_user_id": user_id}).sort('created_at', -1).to_list(100)
-    return [Review(**{k: v for k, v in review.items() if k != '_id'}) for review in reviews]
+@api_router.get("/reviews/{user_id}/summary")
+async def get_rating_summary(user_id: str):
+    user = await user_cache.get(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
+    histogram = user.get('rating_histogram') or {}
+    return {
+        "rating": user.get('rating', 0.0),
+        "review_count": user.get('review_count', 0),
+        "histogram": {str(star): histogram.get(str(star), 0) for star in range(1, 6)}
+    }
+
+@api_router.get("/reviews/{user_id}", response_model=List[Review])
+async def get_user_reviews(user_id: str, request: Request, response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    user = await user_cache.get(user_id)
+    stamp = user.get('reviews_updated_at') if user else None
+    if stamp:
+        not_modified = conditional(request, response, make_etag('reviews', user_id, stamp.isoformat(), weak=True), stamp)
+        if not_modified:
+            return not_modified
+    reviews = await fetch_page(db.reviews, {"reviewed_user_id": user_id}, response, cursor, skip, limit, schema_projection(Review))
+    return model_rows(reviews, Review, response)
 
 # ============= FAVORITES =============
+# Declared before /favorites/{listing_id}, which would otherwise take "check" as a listing id
+@api_router.post("/favorites/check")
+async def check_favorites(check: FavoriteCheck, current_user: dict = Depends(get_current_user)):
+    """Favorite state of a whole page of listings from one query on the (user_id, listing_id) index."""
+    if len(check.listing_ids) > FAVORITE_CHECK_MAX:
+        raise HTTPException(status_code=400, detail=f"Höchstens {FAVORITE_CHECK_MAX} Anzeigen pro Abfrage")
+    cursor = db.favorites.find({"user_id": current_user['user_id'], "listing_id": {"$in": check.listing_ids}}, {"_id": 0, "listing_id": 1})
+    favorited = {fav['listing_id'] async for fav in cursor}
+    return {"is_favorited": {listing_id: listing_id in favorited for listing_id in check.listing_ids}}
+
 @api_router.post("/favorites/{listing_id}")
 async def add_to_favorites(listing_id: str, current_user: dict = Depends(get_current_user)):
-    # Check if listing exists
-    listing = await db.listings.find_one({"id": listing_id})
-    if not listing:
+    if not await db.listings.find_one({"id": listing_id}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
-    
-    # Check if already favorited
-    existing = await db.favorites.find_one({"user_id": current_user['user_id'], "listing_id": listing_id})
-    if existing:
-        raise HTTPException(status_code=400, detail="Bereits zu Favoriten hinzugefügt")
-    
-    favorite_id = str(uuid.uuid4())
-    favorite_dict = {
-        "id": favorite_id,
-        "user_id": current_user['user_id'],
-        "listing_id": listing_id,
-        "created_at": datetime.utcnow()
-    }
-    await db.favorites.insert_one(favorite_dict)
+    # Idempotent: the unique (user_id, listing_id) index turns a concurrent second add into a duplicate key error
+    try:
+        await db.favorites.update_one(
+            {"user_id": current_user['user_id'], "listing_id": listing_id},
+            {"$setOnInsert": {"id": str(uuid.uuid4()), "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
     return {"message": "Zu Favoriten hinzugefügt"}
 
 @api_router.delete("/favorites/{listing_id}")
 async def remove_from_favorites(listing_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.favorites.delete_one({"user_id": current_user['user_id'], "listing_id": listing_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Favorit nicht gefunden")
+    await db.favorites.delete_one({"user_id": current_user['user_id'], "listing_id": listing_id})
     return {"message": "Aus Favoriten entfernt"}
 
-@api_router.get("/favorites")
-async def get_favorites(current_user: dict = Depends(get_current_user)):
-    favorites = await db.favorites.find({"user_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    result = []
-    for fav in favorites:
-        listing = await db.listings.find_one({"id": fav['listing_id']})
-        if listing:
-            result.append(Listing(**{k: v for k, v in listing.items() if k != '_id'}))
-    return result
+@api_router.get("/favorites", response_model=List[Union[ListingSummary, Listing]])
+async def get_favorites(response: Response, view: ListingView = ListingView.CARD, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), loaders: RequestLoaders = Depends(get_loaders), current_user: dict = Depends(get_current_user)):
+    favorites = await fetch_page(db.favorites, {"user_id": current_user['user_id']}, response, cursor, skip, limit, {"_id": 0, "listing_id": 1, "created_at": 1, "id": 1})
+    listings = await loaders.listings(listing_projection(view)).load_many(fav['listing_id'] for fav in favorites)
+    orphaned = [fav['listing_id'] for fav in favorites if not listings[fav['listing_id']]]
+    if orphaned:
+        await db.favorites.delete_many({"user_id": current_user['user_id'], "listing_id": {"$in": orphaned}})
+    return model_rows([listings[fav['listing_id']] for fav in favorites if listings[fav['listing_id']]], listing_model(view), response)
 
 @api_router.get("/favorites/check/{listing_id}")
 async def check_favorite(listing_id: str, current_user: dict = Depends(get_current_user)):
@@ -605,7 +801,7 @@ async def check_favorite(listing_id: str, current_user: dict = Depends(get_curre
 # ============= SUPPORT =============
 @api_router.post("/support")
 async def create_support_ticket(ticket_data: SupportTicketCreate, current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": current_user['user_id']})
+    user = await user_cache.get(current_user['user_id'])
     ticket_id = str(uuid.uuid4())
     ticket_dict = {
         "id": ticket_id,
@@ -619,70 +815,193 @@ async def create_support_ticket(ticket_data: SupportTicketCreate, current_user:
         "created_at": datetime.utcnow()
     }
     await db.support_tickets.insert_one(ticket_dict)
+    stats_recorder.record('support_tickets')
+    await stats_recorder.adjust('open_tickets', 1)
     return SupportTicket(**{k: v for k, v in ticket_dict.items() if k != '_id'})
 
-@api_router.get("/support/my")
-async def get_my_tickets(current_user: dict = Depends(get_current_user)):
-    tickets = await db.support_tickets.find({"user_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    return [SupportTicket(**{k: v for k, v in ticket.items() if k != '_id'}) for ticket in tickets]
+@api_router.get("/support/my", response_model=List[SupportTicket])
+async def get_my_tickets(response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
+    tickets = await fetch_page(db.support_tickets, {"user_id": current_user['user_id']}, response, cursor, skip, limit, schema_projection(SupportTicket))
+    return model_rows(tickets, SupportTicket, response)
 
 # ============= AI =============
+DESCRIPTION_SYSTEM_MESSAGE = "Du bist ein Assistent, der ansprechende Produktbeschreibungen für eine Kleinanzeigen-App schreibt. Schreibe kurz und ansprechend auf Deutsch."
+PRICE_SYSTEM_MESSAGE = "Du bist ein Experte für die Bewertung von gebrauchten und neuen Produkten. Gib eine Preisschätzung basierend auf Produktinformationen und Marktbedingungen."
+
+def fallback_description(request: AIDescriptionRequest) -> str:
+    details = ', '.join(f"{k}: {v}" for k, v in request.category_fields.items() if v not in (None, ''))
+    return f"Zu verkaufen: {request.title}." + (f" {details}." if details else "") + " Bei Fragen gerne melden!"
+
 @api_router.post("/ai/generate-description")
 async def generate_description(request: AIDescriptionRequest):
+    prompt = f"Schreibe eine ansprechende Beschreibung für ein Produkt mit dem Titel: {request.title}\nKategorie: {request.category}\nDetails: {request.category_fields}\n\nSchreibe eine kurze Beschreibung (3-4 Sätze) auf Deutsch."
     try:
-        chat = LlmChat(api_key=EMERGENT_LLM_KEY, session_id=f"desc_{uuid.uuid4()}", system_message="Du bist ein Assistent, der ansprechende Produktbeschreibungen für eine Kleinanzeigen-App schreibt. Schreibe kurz und ansprechend auf Deutsch.").with_model("openai", "gpt-4o-mini")
-        prompt = f"Schreibe eine ansprechende Beschreibung für ein Produkt mit dem Titel: {request.title}\nKategorie: {request.category}\nDetails: {request.category_fields}\n\nSchreibe eine kurze Beschreibung (3-4 Sätze) auf Deutsch."
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        return {"description": response}
-    except Exception as e:
+        description, cached = await ai_gateway.complete(request_key('description', request.model_dump()), DESCRIPTION_SYSTEM_MESSAGE, prompt)
+    except AIUnavailable as e:
         logger.error(f"Error generating description: {e}")
-        raise HTTPException(status_code=500, detail="Fehler beim Generieren der Beschreibung")
+        return {"description": fallback_description(request), "source": "fallback"}
+    return {"description": description, "source": "cache" if cached else "ai"}
+
+def format_price_range(estimate: dict) -> str:
+    def euros(value: float) -> str:
+        return f"{value:,.0f}".replace(',', '.')
+    return f"Angemessener Preis: €{euros(estimate['min'])}-{euros(estimate['max'])}"
 
 @api_router.post("/ai/suggest-price")
 async def suggest_price(request: AIPriceRequest):
+    fields = {**request.category_fields, **({"condition": request.condition} if request.condition else {})}
+    # The app sends the German display name ("Autos"); the index is keyed by catalog id
+    estimate = price_estimator.estimate(category_id(request.category), fields)
+    if estimate and estimate['confidence'] >= PRICE_MIN_CONFIDENCE:
+        return {"suggested_price": format_price_range(estimate), "estimate": estimate, "source": "estimate"}
+    # Too few comparable listings: ask the LLM
+    prompt = f"Was ist ein angemessener Preis für ein Produkt mit folgenden Eigenschaften:\nTitel: {request.title}\nKategorie: {request.category}\nZustand: {request.condition or 'Nicht angegeben'}\nDetails: {request.category_fields}\n\nGib eine ungefähre Preisspanne in Euro. Gib eine kurze Antwort (eine Zeile) wie: 'Angemessener Preis: €500-700'"
     try:
-        chat = LlmChat(api_key=EMERGENT_LLM_KEY, session_id=f"price_{uuid.uuid4()}", system_message="Du bist ein Experte für die Bewertung von gebrauchten und neuen Produkten. Gib eine Preisschätzung basierend auf Produktinformationen und Marktbedingungen.").with_model("openai", "gpt-4o-mini")
-        prompt = f"Was ist ein angemessener Preis für ein Produkt mit folgenden Eigenschaften:\nTitel: {request.title}\nKategorie: {request.category}\nZustand: {request.condition or 'Nicht angegeben'}\nDetails: {request.category_fields}\n\nGib eine ungefähre Preisspanne in Euro. Gib eine kurze Antwort (eine Zeile) wie: 'Angemessener Preis: €500-700'"
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        return {"suggested_price": response}
-    except Exception as e:
+        suggestion, cached = await ai_gateway.complete(request_key('price', request.model_dump()), PRICE_SYSTEM_MESSAGE, prompt)
+    except AIUnavailable as e:
         logger.error(f"Error suggesting price: {e}")
-        raise HTTPException(status_code=500, detail="Fehler beim Vorschlagen des Preises")
+        if estimate:
+            return {"suggested_price": format_price_range(estimate), "estimate": estimate, "source": "estimate"}
+        return {"suggested_price": None, "estimate": None, "source": "fallback", "detail": "Preisschätzung derzeit nicht verfügbar"}
+    return {"suggested_price": suggestion, "estimate": estimate, "source": "cache" if cached else "ai"}
 
 # ============= ADMIN =============
-@api_router.get("/admin/users")
-async def get_all_users(current_user: dict = Depends(get_current_user)):
+@api_router.get("/admin/users", response_model=List[User])
+async def get_all_users(response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=MAX_ADMIN_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
-    users = await db.users.find().sort('created_at', -1).to_list(1000)
-    return [User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'}) for user in users]
+    users = await fetch_page(db.users, {}, response, cursor, skip, limit, schema_projection(User))
+    return model_rows(users, User, response)
+
+async def batched(cursor, size: int):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def delete_user_job(job: JobContext):
+    """Cascade-delete a user's data in throttled batches. Every step can be repeated after a crash."""
+    user_id = job.params['user_id']
+
+    async def delete_user_doc():
+        await db.users.delete_one({"id": user_id})
+        await user_cache.invalidate(user_id)
+
+    async def delete_favorites():
+        # Other users' favorites of this user's listings first, while the listings can still be found
+        async for listings in batched(db.listings.find({"seller_id": user_id}, {"_id": 0, "id": 1}), job.batch_size):
+            await job.renew_lease()
+            result = await db.favorites.delete_many({"listing_id": {"$in": [listing['id'] for listing in listings]}})
+            await job.count("favorites_of_listings", result.deleted_count)
+            await asyncio.sleep(job.pause)
+        await job.delete_in_batches(db.favorites, {"user_id": user_id}, "favorites")
+
+    async def deindex(listings):
+        await search_engine.remove_listings([listing['id'] for listing in listings])
+
+    async def delete_listings():
+        await job.delete_in_batches(db.listings, {"seller_id": user_id}, "listings", after_delete=deindex, projection={"id": 1})
+        await job.delete_in_batches(db.listing_views, {"seller_id": user_id}, "listing_views")
+        await feed_cache.invalidate()
+
+    async def uncount_messages(messages):
+        # After the delete: a crash in between leaves counts too high (fixed by reconcile-unread), never decremented twice
+        for recipient in await uncount_unread(db, messages):
+            if recipient != user_id:
+                await notify(recipient, "unread.count", {"count": await unread_count_for(recipient)})
+
+    async def delete_messages():
+        await job.delete_in_batches(db.messages, {"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]}, "messages",
+                                    after_delete=uncount_messages, projection={"from_user_id": 1, "to_user_id": 1, "listing_id": 1, "read": 1})
+        await job.delete_in_batches(db.conversations, {"$or": [{"user_id": user_id}, {"other_user_id": user_id}]}, "conversations")
+        await db.unread_counters.delete_one({"user_id": user_id})
+
+    async def delete_offers():
+        await job.delete_in_batches(db.offers, {"$or": [{"buyer_id": user_id}, {"seller_id": user_id}]}, "offers")
 
-@api_router.delete("/admin/users/{user_id}")
+    async def unrate(reviews):
+        # After the delete: a crash in between leaves ratings too high (fixed by recompute-ratings), never counted twice
+        await remove_reviews(db, reviews)
+        await user_cache.invalidate(*{r['reviewed_user_id'] for r in reviews})
+
+    async def delete_reviews():
+        await job.delete_in_batches(db.reviews, {"reviewer_id": user_id, "reviewed_user_id": {"$ne": user_id}}, "reviews_written",
+                                    after_delete=unrate, projection={"reviewed_user_id": 1, "rating": 1})
+        await job.delete_in_batches(db.reviews, {"$or": [{"reviewer_id": user_id}, {"reviewed_user_id": user_id}]}, "reviews_received")
+
+    async def uncount_open(tickets):
+        await stats_recorder.adjust('open_tickets', -sum(t.get('status') == SupportStatus.OPEN for t in tickets))
+
+    async def delete_support_tickets():
+        await job.delete_in_batches(db.support_tickets, {"user_id": user_id}, "support_tickets", after_delete=uncount_open, projection={"status": 1})
+
+    await job.run_steps([
+        ("user", delete_user_doc),
+        ("favorites", delete_favorites),
+        ("listings", delete_listings),
+        ("messages", delete_messages),
+        ("offers", delete_offers),
+        ("reviews", delete_reviews),
+        ("support_tickets", delete_support_tickets),
+    ])
+
+async def refresh_price_index_job(job: JobContext):
+    await price_estimator.rebuild(db)
+
+# Job types the admin can start; delete-user is only enqueued by the delete endpoint
+MAINTENANCE_JOBS = {
+    "rebuild-conversations": lambda job: rebuild_conversations(db),
+    "reconcile-unread": lambda job: reconcile_unread_counters(db),
+    "recompute-ratings": lambda job: recompute_ratings(db),
+    "rebuild-price-index": refresh_price_index_job,
+    "rebuild-stats": lambda job: rebuild_stats(db),
+}
+job_runner = JobRunner(job_queue, {"delete-user": delete_user_job, **MAINTENANCE_JOBS}, JOB_BATCH_SIZE, JOB_BATCH_PAUSE_SECONDS)
+
+@api_router.delete("/admin/users/{user_id}", status_code=202)
 async def delete_user(user_id: str, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
-    await db.users.delete_one({"id": user_id})
-    await db.listings.delete_many({"seller_id": user_id})
-    await db.messages.delete_many({"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]})
-    await db.offers.delete_many({"$or": [{"buyer_id": user_id}, {"seller_id": user_id}]})
-    await db.reviews.delete_many({"$or": [{"reviewer_id": user_id}, {"reviewed_user_id": user_id}]})
-    return {"message": "Benutzer gelöscht"}
-
-@api_router.get("/admin/listings")
-async def get_all_listings_admin(current_user: dict = Depends(get_current_user)):
+    job = await job_queue.enqueue("delete-user", {"user_id": user_id})
+    job_runner.notify()
+    return {"message": "Löschung des Benutzers gestartet", "job_id": job['id']}
+
+@api_router.post("/admin/jobs/{job_type}", status_code=202)
+async def start_job(job_type: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Nicht autorisiert")
+    if job_type not in MAINTENANCE_JOBS:
+        raise HTTPException(status_code=404, detail="Unbekannter Auftragstyp")
+    job = await job_queue.enqueue(job_type)
+    job_runner.notify()
+    return {"message": "Auftrag gestartet", "job_id": job['id']}
+
+@api_router.get("/admin/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Nicht autorisiert")
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Auftrag nicht gefunden")
+    return job
+
+@api_router.get("/admin/listings", response_model=List[Union[ListingSummary, Listing]])
+async def get_all_listings_admin(response: Response, view: ListingView = ListingView.CARD, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=MAX_ADMIN_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
-    listings = await db.listings.find().sort('created_at', -1).to_list(1000)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
+    listings = await fetch_page(db.listings, {}, response, cursor, skip, limit, listing_projection(view))
+    return model_rows(listings, listing_model(view), response)
 
-@api_router.get("/admin/support")
-async def get_all_tickets(current_user: dict = Depends(get_current_user)):
+@api_router.get("/admin/support", response_model=List[SupportTicket])
+async def get_all_tickets(response: Response, cursor: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=MAX_ADMIN_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
-    tickets = await db.support_tickets.find().sort('created_at', -1).to_list(1000)
-    return [SupportTicket(**{k: v for k, v in ticket.items() if k != '_id'}) for ticket in tickets]
+    tickets = await fetch_page(db.support_tickets, {}, response, cursor, skip, limit, schema_projection(SupportTicket))
+    return model_rows(tickets, SupportTicket, response)
 
 @api_router.post("/admin/support/{ticket_id}/reply")
 async def reply_to_ticket(ticket_id: str, reply_message: str, current_user: dict = Depends(get_current_user)):
@@ -692,30 +1011,121 @@ async def reply_to_ticket(ticket_id: str, reply_message: str, current_user: dict
     await db.support_tickets.update_one({"id": ticket_id}, {"$push": {"replies": reply}})
     return {"message": "Antwort gesendet"}
 
+@api_router.get("/admin/export/{name}")
+async def export_collection(name: str, request: Request, format: str = "ndjson", fields: Optional[str] = None,
+                            cursor: Optional[str] = None, after_id: Optional[str] = None,
+                            created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                            current_user: dict = Depends(get_current_user)):
+    """Stream a whole collection newest-first. Resume an interrupted export with `after_id` = id of the last row received."""
+    if current_user['role'] != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Nicht autorisiert")
+    spec = EXPORTS.get(name)
+    if spec is None:
+        raise HTTPException(status_code=404, detail="Unbekannter Export")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Format muss ndjson oder csv sein")
+    collection = db[spec['collection']]
+    try:
+        columns = export_fields(spec, fields)
+        query = export_query(spec, request.query_params, created_after, created_before)
+        docs = open_cursor(collection, query, columns, await resume_cursor(collection, cursor, after_id))
+    except (ExportError, InvalidCursor) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(encode_rows(docs, columns, format), media_type=FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @api_router.get("/admin/stats")
 async def get_admin_stats(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
-    users_count = await db.users.count_documents({})
-    listings_count = await db.listings.count_documents({})
-    messages_count = await db.messages.count_documents({})
-    offers_count = await db.offers.count_documents({})
-    support_open = await db.support_tickets.count_documents({"status": SupportStatus.OPEN})
-    return {"users": users_count, "listings": listings_count, "messages": messages_count, "offers": offers_count, "open_tickets": support_open}
+    return await stats_recorder.totals()
+
+@api_router.get("/admin/stats/series")
+async def get_admin_stats_series(series: str = "listings,messages,offers", granularity: str = "minute",
+                                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                 current_user: dict = Depends(get_current_user)):
+    """Created documents per minute or day for charts; defaults to the last hour (minute) or 30 days (day)."""
+    if current_user['role'] != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Nicht autorisiert")
+    end = end or datetime.utcnow()
+    start = start or end - (timedelta(days=29) if granularity == 'day' else timedelta(minutes=59))
+    try:
+        return await stats_series(db, [s.strip() for s in series.split(',') if s.strip()], granularity, start, end)
+    except StatsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Nicht autorisiert")
+    return {"password_hashing": password_hasher.metrics(), "user_cache": user_cache.metrics(), "ai_gateway": ai_gateway.metrics(),
+            "feed_cache": feed_cache.metrics()}
 
 app.include_router(api_router)
-app.add_middleware(CORSMiddleware, allow_credentials=True, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_credentials=True, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=[NEXT_CURSOR_HEADER])
+
+async def load_price_index():
+    """Load the stored price index; when it is missing or stale, one worker rebuilds it as a job."""
+    if not await price_estimator.refresh(db, timedelta(seconds=PRICE_INDEX_REFRESH_SECONDS)):
+        if await job_queue.enqueue_once("rebuild-price-index"):
+            job_runner.notify()
+
+async def refresh_price_index_periodically():
+    while True:
+        await asyncio.sleep(PRICE_INDEX_POLL_SECONDS)
+        try:
+            await load_price_index()
+        except Exception as e:
+            logger.error(f"Price index refresh failed: {e}")
+
+async def reconcile_unread_periodically():
+    while True:
+        await asyncio.sleep(UNREAD_RECONCILE_SECONDS)
+        try:
+            await reconcile_unread_counters(db)
+        except Exception as e:
+            logger.error(f"Unread counter reconciliation failed: {e}")
 
 @app.on_event("startup")
 async def startup_event():
+    await ensure_indexes(db)
+    await search_engine.setup(db)
+    if not search_engine.shared:
+        asyncio.create_task(search_engine.listen())
+    if not await db.conversations.estimated_document_count() and await db.messages.estimated_document_count():
+        logger.info("Backfilling conversations from messages")
+        await rebuild_conversations(db)
+    if not await db.unread_counters.estimated_document_count() and await db.messages.estimated_document_count():
+        await reconcile_unread_counters(db)
+    if UNREAD_RECONCILE_SECONDS > 0:
+        asyncio.create_task(reconcile_unread_periodically())
+    asyncio.create_task(user_cache.listen())
+    asyncio.create_task(feed_cache.listen())
+    asyncio.create_task(view_counter.run(VIEW_FLUSH_SECONDS))
+    if not await db.stats_counters.find_one({"_id": "open_tickets"}):
+        await reconcile_open_tickets(db)
+    asyncio.create_task(stats_recorder.run(STATS_SNAPSHOT_SECONDS))
+    asyncio.create_task(job_runner.run())
+    try:
+        await load_price_index()
+    except Exception as e:
+        logger.error(f"Loading the price index failed: {e}")
+    asyncio.create_task(refresh_price_index_periodically())
     admin_email = "admin@chancenmarket.com"
     existing_admin = await db.users.find_one({"email": admin_email})
     if not existing_admin:
         admin_id = str(uuid.uuid4())
-        admin_dict = {"id": admin_id, "name": "Admin", "email": admin_email, "password": hash_password("Admin@123"), "role": UserRole.ADMIN, "rating": 5.0, "review_count": 0, "profile_image": None, "phone_enabled": False, "created_at": datetime.utcnow()}
+        admin_dict = {"id": admin_id, "name": "Admin", "email": admin_email, "password": await hash_password("Admin@123"), "role": UserRole.ADMIN, "rating": 5.0, "review_count": 0, "profile_image": None, "phone_enabled": False, "created_at": datetime.utcnow()}
         await db.users.insert_one(admin_dict)
         logger.info(f"Admin user created: {admin_email} / Admin@123")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    try:
+        await view_counter.flush()
+    except Exception as e:
+        logger.error(f"Flushing listing views on shutdown failed: {e}")
+    await stats_recorder.try_snapshot()
     client.close()
+    password_hasher.executor.shutdown(wait=False)
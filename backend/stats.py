@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from models import SupportStatus
+
+logger = logging.getLogger(__name__)
+
+# Created-document series, counted per minute and per day in `stats_series`
+SERIES = ("users", "listings", "messages", "offers", "support_tickets")
+GRANULARITIES = {"minute": timedelta(minutes=1), "day": timedelta(days=1)}
+MINUTE_RETENTION = timedelta(days=14)  # TTL of minute buckets; day buckets are kept
+MAX_POINTS = 7 * 24 * 60
+ESTIMATED_TOTALS = ("users", "listings", "messages", "offers")
+
+
+class StatsError(ValueError):
+    pass
+
+
+def truncate(stamp: datetime, granularity: str) -> datetime:
+    if stamp.tzinfo:
+        stamp = stamp.astimezone(timezone.utc).replace(tzinfo=None)  # buckets are naive UTC like every stored timestamp
+    stamp = stamp.replace(second=0, microsecond=0)
+    return stamp.replace(hour=0, minute=0) if granularity == 'day' else stamp
+
+
+class StatsRecorder:
+    """Dashboard statistics that never scan the raw collections.
+
+    Write handlers `record` created documents in memory and `adjust` exact counters (open tickets)
+    in `stats_counters`. Each `snapshot` adds the pending creations to the minute and day buckets of
+    `stats_series` and stamps the current buckets with the totals; collection totals come from
+    `estimated_document_count`, which only reads collection metadata.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pending: Dict[tuple, Counter] = defaultdict(Counter)  # (granularity, bucket) -> series -> created
+
+    def record(self, series: str, n: int = 1) -> None:
+        now = datetime.utcnow()
+        for granularity in GRANULARITIES:
+            self.pending[(granularity, truncate(now, granularity))][series] += n
+
+    async def adjust(self, counter: str, n: int) -> None:
+        if n:
+            await self.db.stats_counters.update_one({"_id": counter}, {"$inc": {"value": n}}, upsert=True)
+
+    async def totals(self) -> Dict[str, int]:
+        totals = {name: await self.db[name].estimated_document_count() for name in ESTIMATED_TOTALS}
+        counter = await self.db.stats_counters.find_one({"_id": "open_tickets"})
+        totals['open_tickets'] = max(counter['value'], 0) if counter else 0
+        return totals
+
+    def _restore(self, buckets) -> None:
+        for key, counts in buckets:
+            self.pending[key].update(counts)
+
+    async def snapshot(self) -> None:
+        pending, self.pending = self.pending, defaultdict(Counter)
+        try:
+            totals = await self.totals()
+        except Exception:
+            self._restore(pending.items())
+            raise
+        now = datetime.utcnow()
+        current = {(granularity, truncate(now, granularity)) for granularity in GRANULARITIES}
+        buckets = list(pending.items()) + [(key, Counter()) for key in current if key not in pending]
+        operations = []
+        for (granularity, bucket), counts in buckets:
+            update = {}
+            if counts:
+                update['$inc'] = {f"created.{series}": n for series, n in counts.items()}
+            if (granularity, bucket) in current:
+                update['$set'] = {"totals": totals, "updated_at": now}
+            operations.append(UpdateOne({"granularity": granularity, "ts": bucket}, update, upsert=True))
+        # Ordered, so on an error exactly the buckets from the failed one on go out again with the next snapshot
+        try:
+            await self.db.stats_series.bulk_write(operations)
+        except BulkWriteError as e:
+            self._restore(buckets[e.details['writeErrors'][0]['index']:])
+            raise
+        except Exception:
+            self._restore(buckets)
+            raise
+
+    async def try_snapshot(self) -> None:
+        try:
+            await self.snapshot()
+        except Exception as e:
+            logger.error(f"Writing the stats snapshot failed: {e}")
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.try_snapshot()
+
+
+async def reconcile_open_tickets(db) -> int:
+    count = await db.support_tickets.count_documents({"status": SupportStatus.OPEN})
+    await db.stats_counters.update_one({"_id": "open_tickets"}, {"$set": {"value": count}}, upsert=True)
+    return count
+
+
+async def rebuild_stats(db) -> int:
+    """Recompute the exact counters and the created series from the raw collections. Returns the number of buckets written."""
+    await reconcile_open_tickets(db)
+    minute_since = truncate(datetime.utcnow() - MINUTE_RETENTION, 'minute')
+    buckets: Dict[tuple, Dict[str, int]] = defaultdict(dict)
+    for series in SERIES:
+        counts: Counter = Counter()
+        async for doc in db[series].find({"created_at": {"$type": "date"}}, {"_id": 0, "created_at": 1}):
+            counts[('day', truncate(doc['created_at'], 'day'))] += 1
+            if doc['created_at'] >= minute_since:
+                counts[('minute', truncate(doc['created_at'], 'minute'))] += 1
+        for key, n in counts.items():
+            buckets[key][f"created.{series}"] = n
+    if buckets:
+        await db.stats_series.bulk_write([
+            UpdateOne({"granularity": granularity, "ts": bucket}, {"$set": values}, upsert=True)
+            for (granularity, bucket), values in buckets.items()
+        ], ordered=False)
+    return len(buckets)
+
+
+async def stats_series(db, series: List[str], granularity: str, start: datetime, end: datetime) -> Dict:
+    """Created documents per bucket between `start` and `end`, zero-filled, one array per series."""
+    unknown = [name for name in series if name not in SERIES]
+    if unknown:
+        raise StatsError(f"Unbekannte Statistik: {', '.join(unknown)}")
+    if granularity not in GRANULARITIES:
+        raise StatsError("Auflösung muss minute oder day sein")
+    step = GRANULARITIES[granularity]
+    start, end = truncate(start, granularity), truncate(end, granularity)
+    if end < start:
+        raise StatsError("Ende liegt vor dem Anfang")
+    points = (end - start) // step + 1
+    if points > MAX_POINTS:
+        raise StatsError(f"Höchstens {MAX_POINTS} Datenpunkte pro Abfrage")
+    values = {name: [0] * points for name in series}
+    query = {"granularity": granularity, "ts": {"$gte": start, "$lte": end}}
+    async for bucket in db.stats_series.find(query, {"_id": 0, "ts": 1, "created": 1}):
+        index = (bucket['ts'] - start) // step
+        created = bucket.get('created') or {}
+        for name in series:
+            values[name][index] = created.get(name, 0)
+    return {
+        "granularity": granularity,
+        "timestamps": [start + i * step for i in range(points)],
+        "series": values,
+    }
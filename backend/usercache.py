@@ -0,0 +1,106 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import bson
+
+USER_CACHE_CHANNEL = "cache:users"
+USER_CACHE_PROJECTION = {"_id": 0, "password": 0}
+
+
+class UserCache:
+    """Per-process TTL + LRU cache of user documents (without password), keyed by user id.
+
+    Bounded by entry count and by the BSON size of the cached documents, since a profile image
+    may be stored inline as a data URI; a document larger than `max_bytes` is not cached.
+
+    Writers call `invalidate()`, which also broadcasts on `USER_CACHE_CHANNEL` so other workers
+    sharing the broker drop their copy; each worker runs `listen()` to receive those events.
+    Returned documents are shared and must not be mutated.
+    """
+
+    projection = USER_CACHE_PROJECTION
+
+    def __init__(self, db, broker=None, max_size: int = 10000, ttl: float = 60.0, max_bytes: int = 64 * 1024 * 1024):
+        self.db = db
+        self.broker = broker
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: 'OrderedDict[str, Tuple[float, dict, int]]' = OrderedDict()
+        self.bytes = 0
+        # Bumped on every invalidation; fetches that started before one must not be cached
+        self.generation = 0
+        self.origin = uuid.uuid4().hex
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, user_id: str) -> Optional[dict]:
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(user_id)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user: dict, generation: int) -> None:
+        if generation != self.generation or self.max_size <= 0:
+            return
+        size = len(bson.encode(user))
+        self._remove(user['id'])
+        if size > self.max_bytes:
+            return
+        self.entries[user['id']] = (time.monotonic() + self.ttl, user, size)
+        self.bytes += size
+        while len(self.entries) > self.max_size or self.bytes > self.max_bytes:
+            self.bytes -= self.entries.popitem(last=False)[1][2]
+
+    def _remove(self, user_id: str) -> None:
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        user = self.peek(user_id)
+        if user is None:
+            generation = self.generation
+            user = await self.db.users.find_one({"id": user_id}, self.projection)
+            if user is not None:
+                self.put(user, generation)
+        return user
+
+    def drop(self, *user_ids: str) -> None:
+        self.generation += 1
+        for user_id in user_ids:
+            self._remove(user_id)
+
+    async def invalidate(self, *user_ids: str) -> None:
+        self.drop(*user_ids)
+        if self.broker is not None and user_ids:
+            await self.broker.publish(USER_CACHE_CHANNEL, {"origin": self.origin, "user_ids": list(user_ids)})
+
+    async def listen(self) -> None:
+        """Apply invalidations broadcast by other workers until cancelled."""
+        subscription = await self.broker.subscribe(USER_CACHE_CHANNEL)
+        try:
+            async for event in subscription:
+                if event.get('origin') != self.origin:
+                    self.drop(*event['user_ids'])
+        finally:
+            await subscription.close()
+
+    def metrics(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
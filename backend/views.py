@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def hour_bucket(stamp: datetime) -> datetime:
+    return stamp.replace(minute=0, second=0, microsecond=0)
+
+
+class ViewCounter:
+    """Write-behind listing view counter.
+
+    Views are counted in memory and written with one unordered bulk_write per flush: `$inc` on
+    `listings.views` plus hourly buckets in `listing_views`. At most `max_pending` views (or one
+    flush interval's worth) are lost if the process dies; a failed flush keeps its counts for the next.
+    """
+
+    def __init__(self, db, max_pending: int = 1000):
+        self.db = db
+        self.max_pending = max_pending
+        self.views: Counter = Counter()
+        self.hourly: Counter = Counter()  # (listing_id, seller_id, hour) -> views
+        self.pending = 0
+        self.flush_task = None
+
+    def record(self, listing_id: str, seller_id: str) -> None:
+        self.pending += 1
+        self.views[listing_id] += 1
+        self.hourly[(listing_id, seller_id, hour_bucket(datetime.utcnow()))] += 1
+        if self.pending >= self.max_pending and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.try_flush())
+
+    def pending_for(self, listing_id: str) -> int:
+        return self.views.get(listing_id, 0)
+
+    async def flush(self) -> int:
+        views, self.views = self.views, Counter()
+        hourly, self.hourly = self.hourly, Counter()
+        flushed, self.pending = self.pending, 0
+        if not hourly:
+            return 0
+        # Failed writes put their counts back so they go out with the next flush
+        try:
+            if views:
+                await self.db.listings.bulk_write(
+                    [UpdateOne({"id": listing_id}, {"$inc": {"views": n}}) for listing_id, n in views.items()], ordered=False
+                )
+        except Exception:
+            self.views.update(views)
+            self.hourly.update(hourly)
+            self.pending += flushed
+            raise
+        try:
+            await self.db.listing_views.bulk_write([
+                UpdateOne({"listing_id": listing_id, "hour": hour}, {"$inc": {"views": n}, "$setOnInsert": {"seller_id": seller_id}}, upsert=True)
+                for (listing_id, seller_id, hour), n in hourly.items()
+            ], ordered=False)
+        except Exception:
+            self.hourly.update(hourly)
+            raise
+        return flushed
+
+    async def try_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Flushing listing views failed: {e}")
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.try_flush()
+
+
+async def seller_view_stats(db, seller_id: str, hours: int) -> Dict:
+    """Views of a seller's listings over the last `hours` hours, per hour and per listing."""
+    since = hour_bucket(datetime.utcnow() - timedelta(hours=hours - 1))
+    by_hour: Dict[datetime, int] = {}
+    by_listing: Dict[str, int] = {}
+    async for bucket in db.listing_views.find({"seller_id": seller_id, "hour": {"$gte": since}}, {"_id": 0}):
+        by_hour[bucket['hour']] = by_hour.get(bucket['hour'], 0) + bucket['views']
+        by_listing[bucket['listing_id']] = by_listing.get(bucket['listing_id'], 0) + bucket['views']
+    return {
+        "since": since,
+        "total": sum(by_hour.values()),
+        "by_hour": [{"hour": hour, "views": n} for hour, n in sorted(by_hour.items())],
+        "by_listing": [{"listing_id": listing_id, "views": n} for listing_id, n in sorted(by_listing.items(), key=lambda item: -item[1])],
+    }
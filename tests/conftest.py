@@ -0,0 +1,21 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: takes minutes; run with RUN_SLOW_TESTS=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.getenv('RUN_SLOW_TESTS') == '1':
+        return
+    skip = pytest.mark.skip(reason="slow; set RUN_SLOW_TESTS=1 to run")
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip)
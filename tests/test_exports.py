@@ -0,0 +1,170 @@
+import asyncio
+import csv
+import io
+import json
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.responses import StreamingResponse
+
+from exports import EXPORTS, FORMATS, ExportError, encode_rows, export_fields, open_cursor, resume_cursor
+from pagination import KEYSET_SORT, decode_cursor, encode_cursor
+
+ROWS = 1_000_000
+FIELDS = EXPORTS['listings']['default_fields']
+NOW = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def synthetic_row(i: int) -> dict:
+    return {"id": f"listing-{i}", "seller_id": "seller", "seller_name": "Verkäufer", "title": f"Fahrrad {i}",
+            "description": "Gut erhalten, nur Abholung", "price": 10.0 + i % 1000, "category": "sports",
+            "category_fields": {"condition": "Gebraucht"}, "image_ids": [f"{i:064x}"], "views": i % 500,
+            "created_at": NOW - timedelta(seconds=i), "images": [f"/api/media/{i:064x}"]}
+
+
+class SyntheticCursor:
+    """Motor-style cursor producing `n` listings newest first, one at a time."""
+
+    def __init__(self, n: int, query: dict, projection: dict):
+        self.n = n
+        self.query = query
+        self.fields = [f for f, include in projection.items() if include and f != '_id']
+        self.sort_spec = None
+        self.batch = None
+
+    def sort(self, spec):
+        self.sort_spec = spec
+        return self
+
+    def batch_size(self, size: int):
+        self.batch = size
+        return self
+
+    async def __aiter__(self):
+        for i in range(self.n):
+            row = synthetic_row(i)
+            yield {f: row[f] for f in self.fields if f in row}
+
+
+class SyntheticCollection:
+    def __init__(self, n: int):
+        self.n = n
+        self.cursors = []
+
+    def find(self, query, projection):
+        self.cursors.append(SyntheticCursor(self.n, query, projection))
+        return self.cursors[-1]
+
+
+async def stream_export(collection, fmt: str, fields=FIELDS, on_chunk=None) -> dict:
+    """Send the export of `collection` as the endpoint does (open_cursor -> encode_rows -> StreamingResponse)."""
+    docs = open_cursor(collection, {"category": "sports"}, fields, None)
+    response = StreamingResponse(encode_rows(docs, fields, fmt), media_type=FORMATS[fmt])
+    sent = {"headers": None, "body": []}
+
+    async def receive():
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            sent['headers'] = dict(message['headers'])
+        elif message.get('body'):
+            (on_chunk or sent['body'].append)(message['body'])
+
+    await response({"type": "http", "method": "GET", "path": "/api/admin/export/listings", "headers": []}, receive, send)
+    return sent
+
+
+async def stream_peaks(fmt: str, n: int, checkpoint: int):
+    """(rows, peak traced bytes after `checkpoint` rows, peak after all rows) while streaming `n` rows."""
+    rows = 0
+    early_peak = None
+
+    def count(chunk: bytes):
+        nonlocal rows, early_peak
+        rows += chunk.count(b'\n')
+        if early_peak is None and rows >= checkpoint:
+            early_peak = tracemalloc.get_traced_memory()[1]
+
+    tracemalloc.start()
+    try:
+        await stream_export(SyntheticCollection(n), fmt, on_chunk=count)
+        return rows, early_peak, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("fmt, header_rows", [("ndjson", 0), ("csv", 1)])
+def test_export_streams_a_million_rows_in_flat_memory(fmt, header_rows):
+    rows, early_peak, final_peak = asyncio.run(stream_peaks(fmt, ROWS, ROWS // 10))
+    assert rows == ROWS + header_rows
+    # Only one encoded chunk is held at a time: the peak after 100k rows is the peak after 1M rows
+    assert final_peak - early_peak < 512 * 1024
+    assert final_peak < 16 * 1024 * 1024
+
+
+def test_export_response_streams_the_projected_cursor_in_batches():
+    collection = SyntheticCollection(2500)
+    sent = asyncio.run(stream_export(collection, "ndjson", fields=["id", "created_at", "title"]))
+    cursor = collection.cursors[0]
+    assert cursor.query == {"category": "sports"}
+    assert cursor.sort_spec == KEYSET_SORT
+    assert cursor.fields == ["id", "created_at", "title"]
+    assert sent['headers'][b'content-type'] == FORMATS['ndjson'].encode()
+    assert len(sent['body']) == 3  # one chunk per 1000 rows
+    rows = [json.loads(line) for chunk in sent['body'] for line in chunk.splitlines()]
+    assert len(rows) == 2500
+    assert rows[0] == {"id": "listing-0", "created_at": NOW.isoformat(), "title": "Fahrrad 0"}
+
+
+def test_csv_header_and_escaping():
+    async def docs():
+        yield {"id": "a", "title": 'Sofa, "wie neu"\nmit Hocker', "price": 12.5, "created_at": NOW,
+               "category_fields": {"farbe": "grün"}, "images": ["x", "y"]}
+        yield {"id": "b", "title": None, "price": 0, "created_at": NOW}
+
+    async def collect():
+        return b''.join([chunk async for chunk in encode_rows(docs(), ["id", "title", "price", "created_at", "category_fields", "images"], "csv")])
+
+    rows = list(csv.reader(io.StringIO(asyncio.run(collect()).decode('utf-8'))))
+    assert rows[0] == ["id", "title", "price", "created_at", "category_fields", "images"]
+    assert rows[1] == ["a", 'Sofa, "wie neu"\nmit Hocker', "12.5", NOW.isoformat(), '{"farbe":"grün"}', '["x","y"]']
+    assert rows[2] == ["b", "", "0", NOW.isoformat(), "", ""]
+
+
+def test_ndjson_rows_keep_requested_fields_only():
+    async def docs():
+        yield {"id": "a", "title": "Tisch", "password": "geheim", "created_at": NOW}
+
+    async def collect():
+        return b''.join([chunk async for chunk in encode_rows(docs(), ["id", "title"], "ndjson")])
+
+    assert [json.loads(line) for line in asyncio.run(collect()).splitlines()] == [{"id": "a", "title": "Tisch"}]
+
+
+def test_export_fields_always_include_the_resume_position():
+    assert export_fields(EXPORTS['listings'], "title,price") == ["id", "created_at", "title", "price"]
+    assert export_fields(EXPORTS['listings'], None) == FIELDS
+    with pytest.raises(ExportError):
+        export_fields(EXPORTS['listings'], "title,password")
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = {doc['id']: doc for doc in docs}
+
+    async def find_one(self, query, projection=None):
+        return self.docs.get(query['id'])
+
+
+def test_resume_cursor_continues_after_the_last_row_received():
+    collection = FakeCollection([{"id": "listing-7", "created_at": NOW}])
+    token = asyncio.run(resume_cursor(collection, None, "listing-7"))
+    assert decode_cursor(token) == (NOW, "listing-7")
+    explicit = encode_cursor(NOW, "listing-3")
+    assert asyncio.run(resume_cursor(collection, explicit, "listing-7")) == explicit
+    assert asyncio.run(resume_cursor(collection, None, None)) is None
+    with pytest.raises(ExportError):
+        asyncio.run(resume_cursor(collection, None, "listing-unknown"))
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+
+pytest.importorskip('emergentintegrations')  # the AI provider SDK server.py imports
+
+from fastapi.testclient import TestClient
+
+import server
+from pricing import compute_price_index
+
+
+def car(i: int) -> dict:
+    return {"category": "cars", "price": 15000 + 100 * (i % 10),
+            "category_fields": {"brand": "BMW", "model": "3er", "year": 2015 + i % 3, "condition": "Gebraucht"}}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, 'price_estimator', server.PriceEstimator())
+    server.price_estimator.load(compute_price_index([car(i) for i in range(60)]))
+
+    async def no_ai(*args, **kwargs):
+        raise AssertionError("the estimate should have answered without the AI provider")
+
+    monkeypatch.setattr(server.ai_gateway, 'complete', no_ai)
+    return TestClient(server.app)
+
+
+def test_suggest_price_estimates_for_the_app_payload(client):
+    # What frontend/app/listings/create.tsx sends: the German category name, not the catalog id
+    response = client.post('/api/ai/suggest-price', json={
+        "title": "BMW 320d", "category": "Autos", "condition": "Gebraucht",
+        "category_fields": {"brand": "BMW", "model": "3er", "year": "2016", "condition": "Gebraucht"},
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body['source'] == 'estimate'
+    assert body['estimate']['basis'] == 'cars|brand=bmw|model=3er'
+    assert body['suggested_price'].startswith('Angemessener Preis: €')
+
+
+def test_suggest_price_accepts_the_catalog_id(client):
+    response = client.post('/api/ai/suggest-price', json={"title": "BMW 320d", "category": "cars",
+                                                          "category_fields": {"brand": "BMW", "model": "3er"}})
+    assert response.json()['source'] == 'estimate'